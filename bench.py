@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark time.py against appliances made up by fixtures.py: key decode
+throughput, `Timeline` construction and the simulation, as the number of
+agents and snapshots grows.
+
+    ./bench.py -n 1 10 100 1000 -m 1000 50000 --json results.json
+    ./bench.py --compare results.json     # exits 1 on a regression
+"""
+
+from typing import List, Dict, Callable, Any
+
+import importlib.util
+import argparse
+import tempfile
+import warnings
+import timeit
+import json
+import glob
+import sys
+import os
+
+import fixtures
+
+# Ours, before fixtures' bin/ is put first.
+PATH = os.environ.get('PATH', '')
+
+
+def loadEstimator() -> Any:
+    """
+    Import time.py, which can't be imported by name past the stdlib `time`.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'time.py')
+    spec = importlib.util.spec_from_file_location('estimator', path)
+    estimator = importlib.util.module_from_spec(spec)
+    # Registered first, so workers can unpickle what refers to it.
+    sys.modules['estimator'] = estimator
+    spec.loader.exec_module(estimator)
+    return estimator
+
+
+def best(function: Callable[[], Any], repeat: int) -> float:
+    """
+    Fastest of `repeat` calls of `function`, in seconds.
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def benchDecode(estimator: Any, root: str, repeat: int) -> float:
+    """
+    MB/s `ConvertJSON.loads` gets through every serialized key under `root`.
+    """
+    data = []
+    for pattern in ('*.agentInfo', '*.schedule', '*.offsiteSchedule'):
+        for path in glob.glob(os.path.join(estimator.KEYS, pattern)):
+            with open(path, 'rb') as keyFile:
+                data.append(keyFile.read())
+    size = sum(map(len, data))
+
+    seconds = best(lambda: [estimator.ConvertJSON.loads(keyData)
+                            for keyData in data], repeat)
+    return size / seconds / 1e6
+
+
+def benchmark(estimator: Any, agents: int, snapshots: int,
+              repeat: int) -> List[Dict[str, Any]]:
+    """
+    Make up an appliance of `agents` agents with `snapshots` snapshots each,
+    and time what we estimate with it.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        fixtures.makeAppliance(root, agents, snapshots)
+        estimator.setRoot(root)
+        os.environ['PATH'] = os.path.join(root, 'bin') + os.pathsep + PATH
+
+        def arguments() -> argparse.Namespace:
+            # Cold, so each run decodes and lists everything afresh.
+            return estimator.argumentParser().parse_args(
+                ['--no-cache', '--full-listing'])
+
+        timeline = estimator.Timeline(arguments())
+
+        case = {'agents': agents, 'snapshots': snapshots}
+        results = [
+            dict(case, case='decode', unit='MB/s',
+                 value=benchDecode(estimator, root, repeat)),
+            dict(case, case='timeline', unit='s',
+                 value=best(lambda: estimator.Timeline(arguments()), repeat)),
+            dict(case, case='simulate', unit='s',
+                 value=best(timeline.simulate, repeat))
+        ]
+
+    os.environ['PATH'] = PATH
+    return results
+
+
+def regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                tolerance: float) -> List[str]:
+    """
+    Describe every result more than `tolerance` worse than its `baseline`.
+    """
+    before = dict(((result['case'], result['agents'], result['snapshots']),
+                   result['value']) for result in baseline)
+    worse = []
+    for result in results:
+        key = (result['case'], result['agents'], result['snapshots'])
+        if key not in before:
+            continue
+        # Throughput should go up; times down.
+        change = result['value'] / before[key]
+        if result['unit'] == 's':
+            change = 1 / change
+        if change < 1 - tolerance:
+            worse.append('{} with {} agents x {} snapshots: {:.4g} {} '
+                         '(was {:.4g})'.format(*key, result['value'],
+                                               result['unit'], before[key]))
+    return worse
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark time.py against made up appliances.'
+    )
+
+    parser.add_argument('-n', '--agents', type=int, nargs='+',
+        default=[1, 10, 100], help='Numbers of agents to try.'
+    )
+
+    parser.add_argument('-m', '--snapshots', type=int, nargs='+',
+        default=[100, 1000], help='Numbers of snapshots per agent to try.'
+    )
+
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Take the best of this many runs of each.'
+    )
+
+    parser.add_argument('--json', metavar='FILE',
+        help='Write the results to FILE, to --compare against later.'
+    )
+
+    parser.add_argument('--compare', metavar='FILE',
+        help='Results of an earlier run to check for regressions against.'
+    )
+
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='How much worse than --compare counts as a regression.'
+    )
+
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', RuntimeWarning)
+    estimator = loadEstimator()
+
+    results = []
+    print('{:>8} {:>6} {:>10} {:>12}'.format('case', 'agents', 'snapshots',
+                                             'result'))
+    for agents in args.agents:
+        for snapshots in args.snapshots:
+            for result in benchmark(estimator, agents, snapshots,
+                                    args.repeat):
+                results.append(result)
+                print('{:>8} {:>6} {:>10} {:>9.4g} {}'.format(
+                    result['case'], agents, snapshots, result['value'],
+                    result['unit']))
+                sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            worse = regressions(results, json.load(baselineFile),
+                                args.tolerance)
+        for line in worse:
+            print('Regression: ' + line)
+        if worse:
+            sys.exit(1)
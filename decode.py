@@ -5,8 +5,10 @@
 Decode JSON serialized.
 """
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Tuple, Iterator, Iterable, IO, Union, Any
 
+import tempfile
+import math
 import os
 import re
 
@@ -22,97 +24,488 @@ class ConvertJSON:
     Methods for working on our (*ahem* horrid) JSON.
     """
 
-    # Match these 'tokens'
-    integer = r'^i:[0-9]+;?'
-    string  = r'^s:[0-9]+:\"[^\"]*\";?'
-    array   = r'^a:[0-9]+:{'
-    boolean = r'^b:[01];?'
-    endArr  = r'^}'
-
-    lexer = re.compile('({}|{}|{}|{}|{})'.format(integer, string, array, endArr,
-                                                 boolean))
-
-    # `:' between parentheses will break unpacking if we just `.split(':')`
-    colonStringSplit = re.compile(r'(?<=s):|:(?=")')
+    # Scalar 'tokens' we pick out of the buffer in place, without slicing it.
+    integer = re.compile(rb'-?[0-9]+')
+    double  = re.compile(rb'-?(?:[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?|INF|NAN)')
 
     def decode(self, key: str) -> Dict:
         """
-        Decode our JSON with regex into something a little nicer. In Python 3.5,
-        if I'm not mistaken, dictionaries don't necessarily keep their order, so
-        I've decided to use lists instead to unpack all of the keyData into.
-        Then a second pass converts this list of lists ... into a dictionary of
-        dictionaries ...
+        Decode our JSON into something a little nicer. The whole key is read
+        once, then handed off to `loads`.
         """
         if not os.path.isfile(key):
             raise FileNotFoundError('File {} does not exist'.format(key))
 
-        with open(key, 'r') as keykeyData:
-            keyData = keykeyData.readline().rstrip()
-
-        def nestLevel(currentList: Optional[List] =None) -> List:
-            """
-            Allow the traversal of all nested levels.
-            """
-            nonlocal keyData
-
-            if currentList is None:
-                currentList = []
-
-            while keyData:
-                # Can't wait till assignment expressions!
-                result = re.search(self.lexer, keyData)
-
-                if not result:
-                    # Show what it's stuck on so we can debug it
-                    raise InvalidArrayFormat(keyData)
-
-                start, end = result.span()
-                substring = keyData[:end]
-                keyData = keyData[end:]
-
-                if substring.endswith(';'):
-                    substring = substring[:-1]
-
-                # Parse. Everything comes in 2's
-                if substring.startswith('a'):
-                    currentList.append(nestLevel([]))
-                elif substring.startswith('i'):
-                    _, value = substring.split(':')
-                    currentList.append(int(value))
-                elif substring.startswith('s'):
-                    _, _, value = re.split(self.colonStringSplit, substring)
-                    value = value[1:len(value) - 1]
-                    currentList.append(value)
-                elif substring.startswith('b'):
-                    _, value = substring.split(':')
-                    currentList.append(bool(value))
-                elif substring.startswith('}'):
-                    return currentList
-            return currentList
-
-        def convert(multiLevelArray: List) -> Dict:
-            """
-            Convert our multi-level list to a dictionary of dictionaries ...
-            """
-            length = len(multiLevelArray)
-            currentDict = {}
-
-            for i, j in zip(range(0, length - 1, 2), range(1, length, 2)):
-                key, val = multiLevelArray[i], multiLevelArray[j]
-                if type(val) is list:
-                    currentDict[key] = convert(val)
+        with open(key, 'rb') as keyFile:
+            keyData = keyFile.read().rstrip()
+
+        return self.loads(keyData)
+
+    @classmethod
+    def loads(cls, keyData: Union[str, bytes]) -> Any:
+        """
+        Parse serialized data with a cursor in a single, linear pass. The
+        declared lengths of strings (`s:<len>:`) and arrays (`a:<count>:`) let
+        us jump straight to the end of each token, and dictionaries are built
+        as we go, so there's no intermediate list of lists to convert after.
+
+        Nesting is tracked with an explicit stack of frames, each being
+        [dictionary, items left to read, pending key], so deep arrays won't hit
+        the recursion limit.
+        """
+        if isinstance(keyData, str):
+            keyData = keyData.encode()
+
+        length = len(keyData)
+        pos = 0
+        stack = []  # type: List[List]
+
+        def fail(reason: str) -> InvalidArrayFormat:
+            # Show what it's stuck on so we can debug it
+            return InvalidArrayFormat('{} at offset {}: {!r}'.format(
+                reason, pos, keyData[pos:pos + 32]))
+
+        while pos < length:
+            tag = keyData[pos:pos + 2]
+            count = None
+
+            if tag == b'a:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0 or keyData[colon + 1:colon + 2] != b'{':
+                    raise fail('Malformed array')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                count = int(keyData[pos + 2:colon])
+                value = {}  # type: Any
+                pos = colon + 2
+            elif tag == b's:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0:
+                    raise fail('Malformed string')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                start = colon + 2
+                end = start + int(keyData[pos + 2:colon])
+                if keyData[colon + 1:start] != b'"' \
+                        or keyData[end:end + 1] != b'"':
+                    raise fail('String length mismatch')
+                value = keyData[start:end].decode('utf-8', 'surrogateescape')
+                pos = end + 1
+            elif tag == b'i:':
+                match = cls.integer.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed integer')
+                value = int(match.group())
+                pos = match.end()
+            elif tag == b'b:':
+                value = keyData[pos + 2:pos + 3]
+                if value not in (b'0', b'1'):
+                    raise fail('Malformed boolean')
+                value = value == b'1'
+                pos += 3
+            elif tag == b'd:':
+                match = cls.double.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed double')
+                value = float(match.group())
+                pos = match.end()
+            elif tag[:1] == b'N':
+                value = None
+                pos += 1
+            else:
+                raise fail('Unexpected token')
+
+            # Semicolons after scalars are optional.
+            if count is None and keyData[pos:pos + 1] == b';':
+                pos += 1
+
+            # Everything comes in 2's: even slots are keys, odd slots values.
+            if stack:
+                frame = stack[-1]
+                if frame[1] % 2:
+                    frame[0][frame[2]] = value
+                elif count is not None:
+                    raise fail('Array used as a key')
                 else:
-                    currentDict[key] = val
+                    frame[2] = value
+                frame[1] -= 1
+            elif count is None:
+                raise fail('Expected an array')
+            else:
+                root = value
+
+            if count is not None:
+                stack.append([value, 2 * count, None])
+
+            # Close every array whose declared count has been read.
+            while stack and not stack[-1][1]:
+                if keyData[pos:pos + 1] != b'}':
+                    raise fail('Expected end of array')
+                pos += 1
+                stack.pop()
+
+            if not stack:
+                if keyData[pos:].strip():
+                    raise fail('Trailing data')
+                return root
+
+        raise fail('Unexpected end of data')
+
+    def encode(self, key: str, value: Any) -> None:
+        """
+        Write `value` to the key file `key` in our format, atomically.
+        """
+        _writeAtomically(key, self.dumps(value))
+
+    @classmethod
+    def dumps(cls, value: Any) -> bytes:
+        """
+        Serialize `value` into our format in a single pass into one buffer;
+        the inverse of `loads`. Lists and tuples are written as arrays keyed
+        0, 1, ... Nesting is kept on an explicit stack of iterators over each
+        array's items, like `loads`, rather than recursion.
+        """
+        buffer = bytearray()
+        scalar = cls._dumpScalar
+        stack = [iter(((None, value),))]
+
+        while stack:
+            for key, item in stack[-1]:
+                # The outermost value is the only one without a key.
+                if len(stack) > 1:
+                    buffer += scalar(key)
+                if type(item) in (dict, list, tuple):
+                    buffer += b'a:%d:{' % len(item)
+                    stack.append(iter(item.items() if type(item) is dict
+                                      else enumerate(item)))
+                    break
+                buffer += scalar(item)
+            else:
+                stack.pop()
+                if stack:
+                    buffer += b'}'
+
+        return bytes(buffer)
+
+    @staticmethod
+    def _dumpScalar(value: Any) -> bytes:
+        """
+        Serialize anything but an array, with its trailing semicolon.
+        """
+        if value is None:
+            return b'N;'
+        if type(value) is bool:
+            return b'b:1;' if value else b'b:0;'
+        if type(value) is int:
+            return b'i:%d;' % value
+        if type(value) is float:
+            if math.isnan(value):
+                return b'd:NAN;'
+            if math.isinf(value):
+                return b'd:INF;' if value > 0 else b'd:-INF;'
+            return b'd:' + repr(value).encode() + b';'
+        if type(value) is str:
+            value = value.encode('utf-8', 'surrogateescape')
+        if type(value) is bytes:
+            return b's:%d:"' % len(value) + value + b'";'
+        raise TypeError('Can\'t serialize {!r}'.format(value))
+
+    def patch(self, key: str, changes: Dict[Union[Any, Tuple], Any]) -> bool:
+        """
+        Rewrite only the values at the paths in `changes` (tuples of keys, or
+        a bare key for the top level, e.g. `patch(f, {(1, 9): '0'})`) in the
+        key file `key`. The rest of the file is copied over byte for byte
+        without being decoded, and the result replaces it atomically. Paths
+        must already exist (a `KeyError` otherwise), so no array's count
+        changes. Returns whether anything was different and written.
+        """
+        changes = dict((path if type(path) is tuple else (path,), value)
+                       for path, value in changes.items())
+
+        with open(key, 'rb') as keyFile:
+            keyData = keyFile.read()
+
+        spans = self._spans(keyData, changes)
+        missing = [path for path in changes if path not in spans]
+        if missing:
+            raise KeyError('{} has no {}'.format(key, ', '.join(
+                map(repr, missing))))
+
+        pieces = []
+        pos = 0
+        changed = False
+        for path in sorted(changes, key=lambda path: spans[path][0]):
+            start, end = spans[path]
+            if start < pos:
+                raise ValueError('Overlapping paths in patch of {}: {!r}'
+                                 .format(key, path))
+            value = self.dumps(changes[path])
+            changed |= value != keyData[start:end]
+            pieces += [keyData[pos:start], value]
+            pos = end
+        pieces.append(keyData[pos:])
+
+        if changed:
+            _writeAtomically(key, b''.join(pieces))
+        return changed
+
+    def patchAll(self, keys: Iterable[str],
+                 changes: Dict[Union[Any, Tuple], Any]) -> List[str]:
+        """
+        `patch` every key file in `keys` with the same `changes`, returning
+        those that were rewritten. Meant for bulk edits across agents, e.g.
+        `patchAll(glob(KEYS + '*.schedule'), {(1, 9): '0'})`.
+        """
+        return [key for key in keys if self.patch(key, changes)]
+
+    @classmethod
+    def _spans(cls, keyData: bytes, paths: Iterable[Tuple]) \
+            -> Dict[Tuple, Tuple[int, int]]:
+        """
+        Find the values at `paths` in `keyData` as (start, end) offsets, the
+        way `loads` reads it but keeping nothing except the keys on the way
+        down to them; arrays off those paths are stepped over with their path
+        left as None. Scalars' spans take in their semicolon. Stops as soon as
+        every path's been found.
+        """
+        wanted = set(paths)
+        prefixes = set(path[:end] for path in wanted
+                       for end in range(len(path)))
+        spans = {}  # type: Dict[Tuple, Tuple[int, int]]
+        length = len(keyData)
+        pos = 0
+        # [path (None off the way to `paths`), items left to read, pending
+        # key, where the array starts, its path if wanted]
+        stack = []  # type: List[List]
+
+        def fail(reason: str) -> InvalidArrayFormat:
+            return InvalidArrayFormat('{} at offset {}: {!r}'.format(
+                reason, pos, keyData[pos:pos + 32]))
+
+        while pos < length and len(spans) < len(wanted):
+            start = pos
+            tag = keyData[pos:pos + 2]
+            count = None
+            value = None  # type: Any
+
+            if tag == b'a:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0 or keyData[colon + 1:colon + 2] != b'{':
+                    raise fail('Malformed array')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                count = int(keyData[pos + 2:colon])
+                pos = colon + 2
+            elif tag == b's:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0:
+                    raise fail('Malformed string')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                begin = colon + 2
+                end = begin + int(keyData[pos + 2:colon])
+                if keyData[colon + 1:begin] != b'"' \
+                        or keyData[end:end + 1] != b'"':
+                    raise fail('String length mismatch')
+                value = keyData[begin:end]
+                pos = end + 1
+            elif tag == b'i:':
+                match = cls.integer.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed integer')
+                value = int(match.group())
+                pos = match.end()
+            elif tag == b'b:' or tag == b'd:':
+                match = cls.double.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed scalar')
+                pos = match.end()
+            elif tag[:1] == b'N':
+                pos += 1
+            else:
+                raise fail('Unexpected token')
+
+            # Semicolons after scalars are optional.
+            if count is None and keyData[pos:pos + 1] == b';':
+                pos += 1
+
+            if stack:
+                frame = stack[-1]
+                frame[1] -= 1
+                if frame[1] % 2:
+                    if count is not None:
+                        raise fail('Array used as a key')
+                    if frame[0] is not None:
+                        frame[2] = value.decode('utf-8', 'surrogateescape') \
+                            if type(value) is bytes else value
+                    continue
+                path = None if frame[0] is None else frame[0] + (frame[2],)
+            elif count is None:
+                raise fail('Expected an array')
+            else:
+                path = ()
+
+            if count is None:
+                if path in wanted:
+                    spans[path] = (start, pos)
+            else:
+                stack.append([path if path in prefixes else None, 2 * count,
+                              None, start, path if path in wanted else None])
+
+            # Close every array whose declared count has been read.
+            while stack and not stack[-1][1]:
+                if keyData[pos:pos + 1] != b'}':
+                    raise fail('Expected end of array')
+                pos += 1
+                _, _, _, begin, found = stack.pop()
+                if found is not None:
+                    spans[found] = (begin, pos)
+
+            if not stack:
+                break
+
+        return spans
+
+    def iterDecode(self, keyFile: IO, chunkSize: int = 65536) \
+            -> Iterator[Tuple[Tuple, Any]]:
+        """
+        Stream (path, value) pairs out of a serialized key, reading it from
+        `keyFile` `chunkSize` bytes at a time. `path` is the tuple of keys
+        leading to `value` from the outermost array; empty arrays come out as
+        `{}` so nothing about the structure is lost.
+        """
+        for event, path, value in self._events(keyFile, chunkSize):
+            if event == 'scalar' or event == 'start' and not value:
+                yield path, ({} if event == 'start' else value)
+
+    def select(self, keyFile: IO, *paths: Union[Any, Tuple],
+               chunkSize: int = 65536) -> Dict[Tuple, Any]:
+        """
+        Lazily decode only the subtrees at `paths` (tuples of keys, or a bare
+        key for the top level, e.g. `select(f, 'hostName')`). Everything else is
+        skipped over without being built, and reading stops as soon as every
+        requested subtree has been seen. Paths that don't exist are left out of
+        the result.
+        """
+        wanted = {path if type(path) is tuple else (path,) for path in paths}
+        found = {}     # type: Dict[Tuple, Any]
+        building = {}  # type: Dict[Tuple, Dict]
+        done = set()
+
+        for event, path, value in self._events(keyFile, chunkSize):
+            if event == 'end':
+                if building.pop(path, None) is not None and path in wanted:
+                    done.add(path)
+            elif path in wanted or path and path[:-1] in building:
+                if event == 'start':
+                    value = building[path] = {}
+                if path and path[:-1] in building:
+                    building[path[:-1]][path[-1]] = value
+                if path in wanted:
+                    found[path] = value
+                    if event == 'scalar':
+                        done.add(path)
+
+            if len(done) == len(wanted):
+                break
+
+        return found
 
-            return currentDict
+    @classmethod
+    def _events(cls, keyFile: IO, chunkSize: int) \
+            -> Iterator[Tuple[str, Tuple, Any]]:
+        """
+        Tokenize a serialized key straight off a file object into
+        ('start', path, count), ('scalar', path, value) and ('end', path, None)
+        events. Only the unconsumed tail of the last chunk is held in memory,
+        and nesting is tracked on an explicit stack of
+        [path, items left to read, pending key] frames rather than recursion.
+        """
+        reader = _StreamReader(keyFile, chunkSize)
+        stack = []  # type: List[List]
+
+        while True:
+            tag = reader.peek(2)
+            if not tag:
+                if stack:
+                    raise reader.fail('Unexpected end of data')
+                return
+
+            count = None
+
+            if tag == b'a:':
+                reader.skip(2)
+                count = reader.readUntil(b':')
+                if not count.isdigit():
+                    raise reader.fail('Malformed length')
+                count = int(count)
+                reader.expect(b'{')
+            elif tag == b's:':
+                reader.skip(2)
+                length = reader.readUntil(b':')
+                if not length.isdigit():
+                    raise reader.fail('Malformed length')
+                length = int(length)
+                reader.expect(b'"')
+                value = reader.read(length).decode('utf-8', 'surrogateescape')
+                reader.expect(b'"')
+            elif tag == b'i:':
+                reader.skip(2)
+                value = int(reader.match(cls.integer))
+            elif tag == b'b:':
+                reader.skip(2)
+                value = reader.read(1)
+                if value not in (b'0', b'1'):
+                    raise reader.fail('Malformed boolean')
+                value = value == b'1'
+            elif tag == b'd:':
+                reader.skip(2)
+                value = float(reader.match(cls.double))
+            elif tag[:1] == b'N':
+                reader.skip(1)
+                value = None
+            else:
+                raise reader.fail('Unexpected token')
+
+            # Semicolons after scalars are optional.
+            if count is None and reader.peek(1) == b';':
+                reader.skip(1)
+
+            if stack:
+                frame = stack[-1]
+                frame[1] -= 1
+                if frame[1] % 2:
+                    if count is not None:
+                        raise reader.fail('Array used as a key')
+                    frame[2] = value
+                    continue
+                path = frame[0] + (frame[2],)
+            elif count is None:
+                raise reader.fail('Expected an array')
+            else:
+                path = ()
+
+            if count is None:
+                yield 'scalar', path, value
+            else:
+                yield 'start', path, count
+                stack.append([path, 2 * count, None])
 
-        return convert(nestLevel()[0])
+            # Close every array whose declared count has been read.
+            while stack and not stack[-1][1]:
+                reader.expect(b'}')
+                yield 'end', stack.pop()[0], None
+
+            if not stack:
+                if not reader.atEnd():
+                    raise reader.fail('Trailing data')
+                return
 
     @staticmethod
     def find(nestedDicts: Dict, key: Any) -> Any:
         """
         Return the first occurrence of value associated with `key`. O(n) for `n`
-        items in the flattened data.
+        items in the flattened data; use `index` for repeated lookups.
 
         (Iterable b => b -> a) so we can map over partial applications.
         """
@@ -124,17 +517,20 @@ class ConvertJSON:
                     return value
                 if type(value) is dict:
                     res = traverse(value)
-                    if res:
+                    if res is not missing:
                         return res
+            return missing
 
-        return traverse(nestedDicts)
+        missing = object()
+        res = traverse(nestedDicts)
+        return None if res is missing else res
 
     @staticmethod
     def findAll(nestedDicts: Dict, key: Any, byValue: bool = False) -> List:
         """
         Return all occurrences of values associated with `key`, if any. Again,
         O(n). If `byValue`, searches by value and returns the associated keys.
-        (Essentially a reverse lookup.)
+        (Essentially a reverse lookup.) Use `index` for repeated lookups.
         """
         occurrences = []
 
@@ -152,3 +548,207 @@ class ConvertJSON:
 
         traverse(nestedDicts)
         return occurrences
+
+    @staticmethod
+    def index(nestedDicts: Dict) -> 'KeyIndex':
+        """
+        Build a `KeyIndex` over `nestedDicts` for O(1) repeated lookups.
+        """
+        return KeyIndex(nestedDicts)
+
+
+class KeyIndex:
+    """
+    Lookup tables over a decoded document, built in one pass so repeated
+    `find`/`findAll` queries (by key, or in reverse by value) are O(1) instead
+    of a walk over the whole thing each time.
+    """
+
+    def __init__(self, nestedDicts: Dict) -> None:
+        self.paths = {}        # type: Dict[Any, List[Tuple]]
+        self.values = {}       # type: Dict[Any, List[Any]]
+        self.keysByValue = {}  # type: Dict[Any, List[Any]]
+
+        # Same (pre-)order as the recursive walk in `ConvertJSON.findAll`.
+        stack = [((), iter(nestedDicts.items()))]
+        while stack:
+            path, items = stack[-1]
+            for ky, value in items:
+                self.paths.setdefault(ky, []).append(path + (ky,))
+                self.values.setdefault(ky, []).append(value)
+                if type(value) is dict:
+                    stack.append((path + (ky,), iter(value.items())))
+                    break
+                try:
+                    self.keysByValue.setdefault(value, []).append(ky)
+                except TypeError:
+                    # Unhashable values can't be reverse-searched.
+                    pass
+            else:
+                stack.pop()
+
+    def find(self, *keys: Any, default: Any = None) -> Any:
+        """
+        Return the first value associated with the first of `keys` present,
+        or `default`. Falsy values like `0` and `''` are found like any other.
+        """
+        for key in keys:
+            if key in self.values:
+                return self.values[key][0]
+        return default
+
+    def findAll(self, *keys: Any, byValue: bool = False) -> List:
+        """
+        Return all values associated with any of `keys`, in document order per
+        key. If `byValue`, `keys` are values and their keys are returned.
+        """
+        table = self.keysByValue if byValue else self.values
+        occurrences = []
+        for key in keys:
+            occurrences.extend(table.get(key, ()))
+        return occurrences
+
+    def pathsOf(self, *keys: Any) -> List[Tuple]:
+        """
+        Return the paths (tuples of keys from the top level) to every
+        occurrence of `keys`.
+        """
+        occurrences = []
+        for key in keys:
+            occurrences.extend(self.paths.get(key, ()))
+        return occurrences
+
+
+def _writeAtomically(path: str, data: bytes) -> None:
+    """
+    Replace `path` with `data` so readers only ever see the old file or the
+    new one, keeping the old one's owner, group and permissions. The
+    directory is synced after, so the rename survives a crash too.
+    """
+    directory = os.path.dirname(path) or '.'
+    handle, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as keyFile:
+            keyFile.write(data)
+            keyFile.flush()
+            os.fsync(keyFile.fileno())
+            mine = os.fstat(keyFile.fileno())
+        try:
+            old = os.stat(path)
+        except FileNotFoundError:
+            os.chmod(temporary, 0o644)
+        else:
+            # Ownership first, as changing it can clear setuid/setgid bits.
+            if (old.st_uid, old.st_gid) != (mine.st_uid, mine.st_gid):
+                os.chown(temporary, old.st_uid, old.st_gid)
+            os.chmod(temporary, old.st_mode & 0o7777)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    handle = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+
+class _StreamReader:
+    """
+    Forward-only cursor over a file object for `ConvertJSON._events`. Keeps
+    just the unconsumed part of what's been read, topping it up a chunk at a
+    time as tokens need more bytes.
+    """
+
+    def __init__(self, keyFile: IO, chunkSize: int) -> None:
+        self.keyFile = keyFile
+        self.chunkSize = chunkSize
+        self.buffer = b''
+        self.pos = 0
+        self.offset = 0  # of `buffer[0]` in the file, for error messages
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        """
+        Ensure at least `size` unread bytes are buffered, unless we hit EOF.
+        """
+        while len(self.buffer) - self.pos < size and not self.eof:
+            chunk = self.keyFile.read(max(self.chunkSize, size))
+            if not chunk:
+                self.eof = True
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            # Drop what's been consumed before growing the buffer.
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+        return len(self.buffer) - self.pos >= size
+
+    def fail(self, reason: str) -> InvalidArrayFormat:
+        return InvalidArrayFormat('{} at offset {}: {!r}'.format(
+            reason, self.offset + self.pos,
+            self.buffer[self.pos:self.pos + 32]))
+
+    def peek(self, size: int) -> bytes:
+        self._fill(size)
+        return self.buffer[self.pos:self.pos + size]
+
+    def skip(self, size: int) -> None:
+        self.pos += size
+
+    def atEnd(self) -> bool:
+        """
+        Whether there's only whitespace left, reading on to EOF (a chunk at
+        a time) to be sure. Otherwise the cursor is left at what isn't.
+        """
+        while True:
+            rest = self.buffer[self.pos:]
+            if rest.strip():
+                self.pos += len(rest) - len(rest.lstrip())
+                return False
+            self.pos = len(self.buffer)
+            if not self._fill(1):
+                return True
+
+    def read(self, size: int) -> bytes:
+        if not self._fill(size):
+            raise self.fail('Unexpected end of data')
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def expect(self, token: bytes) -> None:
+        if self.peek(len(token)) != token:
+            raise self.fail('Expected {!r}'.format(token))
+        self.pos += len(token)
+
+    def readUntil(self, delimiter: bytes) -> bytes:
+        """
+        Read up to `delimiter`, consuming (but not returning) it.
+        """
+        searched = 0
+        while True:
+            index = self.buffer.find(delimiter, self.pos + searched)
+            if index >= 0:
+                data = self.buffer[self.pos:index]
+                self.pos = index + len(delimiter)
+                return data
+            searched = len(self.buffer) - self.pos
+            if not self._fill(searched + 1):
+                raise self.fail('Expected {!r}'.format(delimiter))
+
+    def match(self, pattern: Any) -> bytes:
+        """
+        Consume the longest run of bytes matching `pattern` at the cursor.
+        """
+        while True:
+            result = pattern.match(self.buffer, self.pos)
+            # A match running into the end of the buffer may continue.
+            if result and (result.end() < len(self.buffer) or self.eof):
+                self.pos = result.end()
+                return result.group()
+            if not result and self.eof:
+                raise self.fail('Malformed number')
+            self._fill(len(self.buffer) - self.pos + 1)
@@ -0,0 +1,256 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Make up an appliance for time.py to estimate: N agents' keys, sync options
+and a speed limit under some root directory, and a fake `zfs` in its bin/
+listing M hourly snapshots per agent.
+
+    ./fixtures.py /tmp/appliance -n 100 -m 1000
+    PATH=/tmp/appliance/bin:$PATH ./time.py --root /tmp/appliance
+"""
+
+from typing import List, Dict, Optional, Any
+
+import argparse
+import random
+import uuid
+import json
+import stat
+import time
+import os
+
+from decode import ConvertJSON
+
+
+POOL = 'homePool/home/agents'
+SYNC_DIRECTORY = 'homePool+home+agents+{}+agent'
+SPEED_LIMIT = 10240                 # KiB/s
+RETENTION = '24:168:720:8760'
+OFFSITE_RETENTION = '24:168:720:2160'
+
+# The fake `zfs`. Sizes are drawn once per agent and cycled through, so even
+# millions of snapshots list about as fast as the estimator can read them.
+ZFS = '''#! /usr/bin/env python3
+import random, sys
+
+AGENTS = {agents!r}
+SNAPSHOTS = {snapshots!r}
+LAST = {last!r}
+INTERVAL = {interval!r}
+SEED = {seed!r}
+
+arguments = sys.argv[1:]
+first = LAST - (SNAPSHOTS - 1) * INTERVAL
+
+
+def sizes(agent):
+    rng = random.Random('{{}}:{{}}'.format(SEED, agent))
+    return [(int(rng.lognormvariate(16, 1.5)), rng.uniform(1, 2.5))
+            for _ in range(1024)]
+
+
+if arguments[0] == 'get':
+    # zfs get -Hp -o name,property,value written,compressratio <snapshots>
+    drawn = {{}}
+    missing = False
+    for snapshot in arguments[5:]:
+        agent, _, epoch = snapshot.partition('@')
+        if (agent not in AGENTS or not epoch.isdigit()
+                or not first <= int(epoch) <= LAST
+                or (int(epoch) - first) % INTERVAL):
+            sys.stderr.write('cannot open \\'{{}}\\': dataset does not '
+                             'exist\\n'.format(snapshot))
+            missing = True
+            continue
+        if agent not in drawn:
+            drawn[agent] = sizes(agent)
+        written, ratio = drawn[agent][(int(epoch) - first) // INTERVAL % 1024]
+        sys.stdout.write('{{0}}\\twritten\\t{{1}}\\n{{0}}\\tcompressratio\\t'
+                         '{{2:.2f}}x\\n'.format(snapshot, written, ratio))
+    sys.exit(1 if missing else 0)
+
+if '-t' not in arguments:
+    # zfs list -H -o name [<datasets>]
+    named = arguments[arguments.index('-o') + 2:]
+    missing = [name for name in named
+               if name not in AGENTS and name != AGENTS[0].rpartition('/')[0]]
+    for name in missing:
+        sys.stderr.write('cannot open \\'{{}}\\': dataset does not '
+                         'exist\\n'.format(name))
+    sys.stdout.write(''.join(agent + '\\n' for agent in AGENTS
+                             if not named or agent in named
+                             or agent.rpartition('/')[0] in named))
+    sys.exit(1 if missing else 0)
+
+columns = arguments[arguments.index('-o') + 1]
+named = [argument for argument in arguments[arguments.index('-o') + 2:]]
+for agent in AGENTS:
+    if named and not any(agent == name or agent.startswith(name + '/')
+                         for name in named):
+        continue
+    if columns == 'name':
+        sys.stdout.write(''.join(
+            '{{}}@{{}}\\n'.format(agent, first + i * INTERVAL)
+            for i in range(SNAPSHOTS)
+        ))
+        continue
+    drawn = ['{{}}\\t{{:.2f}}x'.format(*size) for size in sizes(agent)]
+    sys.stdout.write(''.join(
+        '{{}}@{{}}\\t{{}}\\n'.format(agent, first + i * INTERVAL, drawn[i % 1024])
+        for i in range(SNAPSHOTS)
+    ))
+'''
+
+
+def schedule(hours: range, flag: str) -> Dict[int, Dict[int, str]]:
+    """
+    A week's schedule, day -> hour -> flag: `flag` ('0') in `hours` of
+    weekdays, '1' otherwise.
+    """
+    return dict(
+        (day, dict((hour, flag if 0 < day < 6 and hour in hours
+                    else str(1 - int(flag))) for hour in range(24)))
+        for day in range(7)
+    )
+
+
+def agentInfo(rng: random.Random, name: str) -> Dict[str, Any]:
+    """
+    Something shaped like an agent's `.agentInfo`, volumes and all.
+    """
+    volumes = []
+    for letter in 'CDEFGH'[:rng.randint(1, 4)]:
+        total = rng.randint(2 ** 36, 2 ** 41)
+        volumes.append({
+            'guid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'mountpoints': [letter + ':\\'],
+            'device': '\\Device\\HarddiskVolume{}'.format(rng.randint(1, 9)),
+            'spaceTotal': total,
+            'spaceFree': rng.randint(0, total),
+            'filesystem': 'NTFS',
+            'sectorSize': 512,
+            'clusterSizeInBytes': 4096,
+            'serialNumber': rng.getrandbits(32),
+            'label': 'Volume ' + letter,
+            'OSVolume': letter == 'C',
+            'mounted': True,
+            'readonly': False
+        })
+    return {
+        'hostname': name,
+        'name': name,
+        'os': 'Windows Server 2016 Standard',
+        'version': '2.0.{}.0'.format(rng.randint(0, 9)),
+        'lastSnapshot': None,
+        'volumes': volumes
+    }
+
+
+def makeAppliance(root: str, agents: int = 10, snapshots: int = 1000,
+                  backlog: float = 0.1, paused: float = 0.0, seed: int = 0,
+                  now: Optional[int] = None) -> List[str]:
+    """
+    Write an appliance of `agents` agents with `snapshots` hourly snapshots
+    apiece under `root`, the last `backlog` of them still to go offsite and
+    `paused` of the agents paused. Returns the agents' datasets.
+    """
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    last = now - now % 3600
+    interval = 3600
+    first = last - (snapshots - 1) * interval
+
+    config = os.path.join(root, 'datto', 'config')
+    keys = os.path.join(config, 'keys')
+    sync = os.path.join(config, 'sync')
+    bin = os.path.join(root, 'bin')
+    for directory in (keys, sync, os.path.join(config, 'local'), bin):
+        os.makedirs(directory, exist_ok=True)
+
+    def write(path: str, data: str) -> None:
+        with open(path, 'w') as keyFile:
+            keyFile.write(data)
+
+    def serialize(value: Any) -> str:
+        return ConvertJSON.dumps(value).decode()
+
+    def options(path: str, pause: bool) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write(path, json.dumps({'pauseZfs': False, 'pauseTransfer': pause,
+                                'priority': 'normal'}) + '\n')
+
+    options(os.path.join(sync, 'options'), False)
+    write(os.path.join(config, 'local', 'speedLimit'),
+          '{}\n'.format(SPEED_LIMIT))
+
+    datasets = []
+    for _ in range(agents):
+        name = uuid.UUID(int=rng.getrandbits(128)).hex
+        datasets.append(POOL + '/' + name)
+        key = os.path.join(keys, name)
+
+        # Offsite has everything but the backlog, sent a day at a time.
+        sent = first + int(snapshots * (1 - backlog)) * interval
+        points = list(range(first, sent, 24 * interval))
+        transfers = ''.join('{}:{}\n'.format(point + 600,
+                                             int(rng.lognormvariate(20, 1)))
+                            for point in points[-30:])
+
+        write(key + '.schedule', serialize(schedule(range(8, 18), '0')))
+        write(key + '.offsiteSchedule', serialize(schedule(range(8, 18), '1')))
+        write(key + '.retention', RETENTION)
+        write(key + '.offsiteRetention', OFFSITE_RETENTION)
+        write(key + '.interval', '60\n')
+        write(key + '.offSitePoints', ''.join('{}\n'.format(point)
+                                              for point in points))
+        write(key + '.transfers', transfers)
+        write(key + '.agentInfo', serialize(agentInfo(rng, name[:12])))
+        options(os.path.join(sync, SYNC_DIRECTORY.format(name), 'options'),
+                rng.random() < paused)
+
+    zfs = os.path.join(bin, 'zfs')
+    write(zfs, ZFS.format(agents=datasets, snapshots=snapshots, last=last,
+                          interval=interval, seed=seed))
+    os.chmod(zfs, os.stat(zfs).st_mode | stat.S_IXUSR | stat.S_IXGRP
+             | stat.S_IXOTH)
+
+    return datasets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Make up an appliance for time.py to estimate.'
+    )
+
+    parser.add_argument('root',
+        help='Directory to write the appliance under.'
+    )
+
+    parser.add_argument('-n', '--agents', type=int, default=10,
+        help='Number of agents.'
+    )
+
+    parser.add_argument('-m', '--snapshots', type=int, default=1000,
+        help='Hourly snapshots per agent.'
+    )
+
+    parser.add_argument('--backlog', type=float, default=0.1,
+        help='Fraction of snapshots yet to go offsite.'
+    )
+
+    parser.add_argument('--paused', type=float, default=0.0,
+        help='Fraction of agents whose sync is paused.'
+    )
+
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed, so the same arguments make the same appliance.'
+    )
+
+    args = parser.parse_args()
+
+    makeAppliance(args.root, args.agents, args.snapshots, args.backlog,
+                  args.paused, args.seed)
+    print('PATH={}:$PATH ./time.py --root {}'.format(
+        os.path.join(os.path.abspath(args.root), 'bin'),
+        os.path.abspath(args.root)))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared fixtures: time.py loaded as `estimator` (it can't be imported by
+name past the stdlib `time`), and a small appliance made up by fixtures.py
+for it to read.
+"""
+
+from typing import Any, List
+
+import sys
+import os
+
+import pytest
+
+# After the stdlib, so our time.py never shadows `time`.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures
+import bench
+
+AGENTS = 3
+SNAPSHOTS = 200
+# A Sunday midnight, so made up appliances don't depend on the clock.
+NOW = 1792281600
+
+
+@pytest.fixture(scope='session')
+def estimator() -> Any:
+    return bench.loadEstimator()
+
+
+@pytest.fixture(scope='session')
+def applianceRoot(tmp_path_factory: Any) -> str:
+    root = str(tmp_path_factory.mktemp('appliance'))
+    fixtures.makeAppliance(root, AGENTS, SNAPSHOTS, seed=1, now=NOW)
+    return root
+
+
+@pytest.fixture
+def appliance(estimator: Any, applianceRoot: str,
+              monkeypatch: Any) -> List[str]:
+    """
+    The appliance's agents' datasets, with `estimator` reading its config
+    and its `zfs` first on the PATH.
+    """
+    estimator.setRoot(applianceRoot)
+    monkeypatch.setenv('PATH', os.path.join(applianceRoot, 'bin')
+                       + os.pathsep + os.environ.get('PATH', ''))
+    return estimator.listAgents()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any
+
+import subprocess
+import json
+import sys
+import os
+
+import fixtures
+from conftest import NOW
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'time.py')
+
+
+def test_check_only(tmp_path: Any) -> None:
+    root = str(tmp_path)
+    datasets = fixtures.makeAppliance(root, 5, 10, seed=5, now=NOW)
+    agents = [os.path.basename(dataset) for dataset in datasets]
+    keys = os.path.join(root, 'datto', 'config', 'keys', '')
+    os.remove(keys + agents[1] + '.interval')
+    # Keys that aren't required can go without it mattering.
+    os.remove(keys + agents[2] + '.transfers')
+    with open(os.path.join(root, 'datto', 'config', 'sync',
+                           fixtures.SYNC_DIRECTORY.format(agents[3]),
+                           'options'), 'w') as options:
+        json.dump({'pauseTransfer': True}, options)
+    environment = dict(os.environ, PATH=os.path.join(root, 'bin')
+                       + os.pathsep + os.environ.get('PATH', ''))
+
+    def check(*argv: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, SCRIPT, '--root', root, '--check-only']
+            + list(argv), env=environment, stdout=subprocess.PIPE,
+            universal_newlines=True)
+
+    checked = check()
+    assert checked.returncode == 1
+    problems = dict(line.split(': ', 1)
+                    for line in checked.stdout.splitlines())
+    assert list(problems) == datasets
+    assert problems[datasets[0]] == problems[datasets[2]] == 'OK'
+    assert problems[datasets[1]].startswith('has unreadable keys (')
+    assert problems[datasets[3]] == 'is paused'
+
+    fine = check('-a', datasets[0], datasets[2])
+    assert (fine.returncode, fine.stdout) == (0, '{0}: OK\n{1}: OK\n'.format(
+        datasets[0], datasets[2]))
+    missing = check('-a', fixtures.POOL + '/nobody')
+    assert (missing.returncode, missing.stdout) == (
+        1, '{}/nobody: is not in the dataset\n'.format(fixtures.POOL))
+
+    # With offsite sync paused as a whole, every agent is.
+    with open(os.path.join(root, 'datto', 'config', 'sync', 'options'),
+              'w') as options:
+        json.dump({'pauseZfs': True}, options)
+    paused = check('-a', datasets[0])
+    assert paused.returncode == 1
+    assert not paused.stdout.endswith(': OK\n')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable
+
+import threading
+import json
+import time
+import os
+
+import pytest
+
+import fixtures
+from conftest import NOW
+
+
+def eventually(condition: Callable[[], bool], timeout: float = 20) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.mark.filterwarnings('ignore:.* is paused, excluding')
+def test_daemon_answers_and_reloads(estimator: Any, tmp_path: Any,
+                                    monkeypatch: Any) -> None:
+    # An appliance of its own, as the daemon outlives the test.
+    root = str(tmp_path / 'appliance')
+    datasets = fixtures.makeAppliance(root, 3, 100, seed=3, now=NOW)
+    agents = [os.path.basename(dataset) for dataset in datasets]
+    estimator.setRoot(root)
+    monkeypatch.setenv('PATH', os.path.join(root, 'bin') + os.pathsep
+                       + os.environ.get('PATH', ''))
+
+    socketPath = str(tmp_path / 'daemon.sock')
+    timeline = estimator.Timeline(estimator.argumentParser().parse_args(
+        ['--no-cache']))
+    daemon = estimator.EstimateDaemon(timeline, socketPath, refresh=3600,
+                                      settle=0.05)
+    threading.Thread(target=daemon.serve, daemon=True).start()
+    assert eventually(lambda: os.path.exists(socketPath))
+
+    report = estimator.queryDaemon(socketPath)
+    assert report.endswith('\n')
+    assert report.splitlines()[0].endswith('across 3 agents at {}/s'.format(
+        estimator.humanBytes(timeline.bandwidth / 3600)))
+    for agent in agents:
+        line = estimator.queryDaemon(socketPath, agent)
+        assert line.startswith(agent + ': ') and line in report
+    assert estimator.queryDaemon(socketPath, 'nobody') == 'Unknown agent\n'
+
+    # Pausing an agent is picked up as the file's written, without a relist.
+    options = os.path.join(root, 'datto', 'config', 'sync',
+                           fixtures.SYNC_DIRECTORY.format(agents[0]),
+                           'options')
+    with open(options, 'w') as optionsFile:
+        json.dump({'pauseZfs': False, 'pauseTransfer': True,
+                   'priority': 'normal'}, optionsFile)
+    assert eventually(lambda: estimator.queryDaemon(socketPath, agents[0])
+                      == 'Unknown agent\n')
+    assert 'across 2 agents' in estimator.queryDaemon(socketPath)
+    assert estimator.queryDaemon(socketPath, agents[1]).startswith(agents[1])
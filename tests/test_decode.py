@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List, Optional
+
+import shutil
+import glob
+import io
+import re
+import os
+
+import pytest
+
+from decode import ConvertJSON, InvalidArrayFormat
+
+
+def regexLoads(keyData: str) -> Any:
+    """
+    The regex decoder `ConvertJSON.loads` replaced, near enough verbatim, to
+    check against. It only knows integers, strings without quotes in them,
+    booleans and arrays.
+    """
+    lexer = re.compile(r'(^i:[0-9]+;?|^s:[0-9]+:\"[^\"]*\";?|^a:[0-9]+:{|^}'
+                       r'|^b:[01];?)')
+    colonStringSplit = re.compile(r'(?<=s):|:(?=")')
+
+    def nestLevel(currentList: Optional[List] = None) -> List:
+        nonlocal keyData
+        if currentList is None:
+            currentList = []
+        while keyData:
+            result = re.search(lexer, keyData)
+            if not result:
+                raise InvalidArrayFormat(keyData)
+            substring = keyData[:result.end()]
+            keyData = keyData[result.end():]
+            if substring.endswith(';'):
+                substring = substring[:-1]
+            if substring.startswith('a'):
+                currentList.append(nestLevel([]))
+            elif substring.startswith('i'):
+                currentList.append(int(substring.split(':')[1]))
+            elif substring.startswith('s'):
+                value = re.split(colonStringSplit, substring)[2]
+                currentList.append(value[1:len(value) - 1])
+            elif substring.startswith('b'):
+                currentList.append(bool(substring.split(':')[1]))
+            elif substring.startswith('}'):
+                return currentList
+        return currentList
+
+    def convert(multiLevelArray: List) -> Any:
+        return dict((key, convert(value) if type(value) is list else value)
+                    for key, value in zip(multiLevelArray[::2],
+                                          multiLevelArray[1::2]))
+
+    return convert(nestLevel()[0])
+
+
+def keyFiles(root: str, *suffixes: str) -> List[str]:
+    keys = os.path.join(root, 'datto', 'config', 'keys')
+    return sorted(path for suffix in suffixes
+                  for path in glob.glob(os.path.join(keys, '*' + suffix)))
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as keyFile:
+        return keyFile.read()
+
+
+def test_loads_matches_regex_decoder(applianceRoot: str,
+                                     estimator: Any) -> None:
+    schedules = keyFiles(applianceRoot, '.schedule', '.offsiteSchedule')
+    assert schedules
+    for path in schedules:
+        keyData = read(path)
+        decoded = ConvertJSON.loads(keyData)
+        assert decoded == regexLoads(keyData.decode().rstrip())
+        assert decoded == estimator.ConvertJSON.loads(keyData)
+
+
+def test_dumps_inverts_loads(applianceRoot: str) -> None:
+    for path in keyFiles(applianceRoot, '.schedule', '.offsiteSchedule',
+                         '.agentInfo'):
+        keyData = read(path)
+        assert ConvertJSON.dumps(ConvertJSON.loads(keyData)) == keyData
+
+
+@pytest.mark.parametrize('value', [
+    {}, {'a': None, 'b': True, 'c': False}, {0: -7, 1: 1.5, 2: 'x;"}y'},
+    {'nested': {0: {0: {}}}, 'é': 'ü'}
+])
+def test_dumps_round_trips(value: Any) -> None:
+    assert ConvertJSON.loads(ConvertJSON.dumps(value)) == value
+
+
+@pytest.mark.parametrize('keyData', [
+    b'a:x:{}', b'a:-1:{}', b's:1x:"a";', b'a:1:{i:0;s::"";}'
+])
+def test_loads_rejects_malformed_lengths(keyData: bytes) -> None:
+    with pytest.raises(InvalidArrayFormat):
+        ConvertJSON.loads(keyData)
+
+
+def test_patch_rewrites_only_the_paths(applianceRoot: str,
+                                       tmp_path: Any) -> None:
+    path = str(tmp_path / 'key.agentInfo')
+    shutil.copyfile(keyFiles(applianceRoot, '.agentInfo')[0], path)
+    os.chmod(path, 0o640)
+    before = read(path)
+    expected = ConvertJSON.loads(before)
+    expected['volumes'][0]['label'] = 'Renamed; "quoted"'
+    expected['hostname'] = None
+
+    assert ConvertJSON().patch(path, {('volumes', 0, 'label'):
+                                      'Renamed; "quoted"',
+                                      'hostname': None})
+    after = read(path)
+    assert ConvertJSON.loads(after) == expected
+    assert after == ConvertJSON.dumps(expected)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+    # Nothing different, nothing written.
+    assert not ConvertJSON().patch(path, {'hostname': None})
+    with pytest.raises(KeyError):
+        ConvertJSON().patch(path, {('volumes', 9): 0})
+    assert read(path) == after
+
+
+def flatten(value: Any, path: tuple = ()) -> List:
+    """
+    (path, value) pairs of `value`'s leaves, as `iterDecode` streams them.
+    """
+    if type(value) is not dict or not value:
+        return [(path, value)]
+    return [pair for key, item in value.items()
+            for pair in flatten(item, path + (key,))]
+
+
+@pytest.mark.parametrize('chunkSize', [1, 7, 65536])
+def test_iter_decode_streams_what_loads_decodes(applianceRoot: str,
+                                                chunkSize: int) -> None:
+    for path in keyFiles(applianceRoot, '.schedule', '.agentInfo'):
+        with open(path, 'rb') as keyFile:
+            streamed = list(ConvertJSON().iterDecode(keyFile, chunkSize))
+        assert streamed == flatten(ConvertJSON.loads(read(path)))
+
+
+def test_select_builds_only_whats_asked(applianceRoot: str) -> None:
+    path = keyFiles(applianceRoot, '.agentInfo')[0]
+    decoded = ConvertJSON.loads(read(path))
+    with open(path, 'rb') as keyFile:
+        selected = ConvertJSON().select(keyFile, 'hostname', ('volumes', 0),
+                                        ('volumes', 99), chunkSize=16)
+    assert selected == {('hostname',): decoded['hostname'],
+                        ('volumes', 0): decoded['volumes'][0]}
+
+
+def test_select_stops_reading_once_found() -> None:
+    keyData = ConvertJSON.dumps({'first': 1, 'rest': list(range(10000))})
+    keyFile = io.BytesIO(keyData)
+    assert ConvertJSON().select(keyFile, 'first', chunkSize=64) == {
+        ('first',): 1}
+    assert keyFile.tell() < len(keyData)
+
+
+@pytest.mark.parametrize('keyData', [
+    b'a:x:{}', b'a:-1:{}', b'a:1:{s:1x:"a";i:1;}', b'a:1:{i:0;s::"";}',
+    b'a:1:{i:0;i:1;', b'a:1:{i:0;b:2;}', b'i:1;',
+    # Trailing data well past the first chunk is still found.
+    b'a:0:{}' + b' ' * 100 + b'x'
+])
+def test_iter_decode_rejects_malformed_keys(keyData: bytes) -> None:
+    with pytest.raises(InvalidArrayFormat):
+        list(ConvertJSON().iterDecode(io.BytesIO(keyData), chunkSize=8))
+    with pytest.raises(InvalidArrayFormat):
+        ConvertJSON.loads(keyData)
+
+
+def test_key_index_matches_walks(applianceRoot: str) -> None:
+    for path in keyFiles(applianceRoot, '.agentInfo', '.schedule'):
+        decoded = ConvertJSON.loads(read(path))
+        index = ConvertJSON.index(decoded)
+        keys = set(key for key, _ in flatten(decoded) for key in key)
+        assert keys
+        for key in keys:
+            assert index.find(key) == ConvertJSON.find(decoded, key)
+            assert index.findAll(key) == ConvertJSON.findAll(decoded, key)
+            for found in index.pathsOf(key):
+                value = decoded
+                for step in found:
+                    value = value[step]
+                assert found[-1] == key and value in index.findAll(key)
+        for _, value in flatten(decoded):
+            assert index.findAll(value, byValue=True) == ConvertJSON.findAll(
+                decoded, value, byValue=True)
+
+
+def test_key_index_finds_falsy_values() -> None:
+    index = ConvertJSON.index({'a': {'zero': 0, 'empty': ''}, 'zero': 1})
+    assert index.find('zero') == 0 and index.find('empty') == ''
+    assert index.find('missing', 'empty', default=7) == ''
+    assert index.find('missing', default=7) == 7
+    assert index.findAll('zero') == [0, 1]
+    assert index.pathsOf('zero') == [('a', 'zero'), ('zero',)]
+    assert index.findAll(0, byValue=True) == ['zero']
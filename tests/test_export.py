@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import subprocess
+import sys
+import os
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'time.py')
+FIELDS = ('schedule', 'offsiteSchedule', 'retention', 'offsiteRetention',
+          'interval', 'offSitePoints', 'transfers')
+
+
+@pytest.mark.parametrize('name', ['export.npz', 'export'])
+def test_export_round_trips(estimator: Any, appliance: List[str],
+                            tmp_path: Any, name: str) -> None:
+    if estimator.numpy() is None:
+        pytest.skip('NumPy isn\'t installed')
+    if not name.endswith('.npz') and estimator.pyarrow() is None:
+        pytest.skip('PyArrow isn\'t installed')
+    parser = estimator.argumentParser()
+    timeline = estimator.Timeline(parser.parse_args(['--no-cache']))
+    path = estimator.exportTimeline(timeline, str(tmp_path / name))
+    assert estimator.isExport(path)
+
+    offline = estimator.Timeline.fromExport(path, parser.parse_args([]))
+    assert offline.now == timeline.now
+    assert offline.agents == timeline.agents
+    assert offline.agent_identifiers == timeline.agent_identifiers
+    assert offline.bandwidth == timeline.bandwidth
+    assert offline.speedLimit == timeline.speedLimit
+    assert [snaps.toDict() for snaps in offline.snaps] == [
+        snaps.toDict() for snaps in timeline.snaps]
+    for agent in timeline.agent_identifiers:
+        for field in FIELDS:
+            assert getattr(offline.keys[agent], field) == getattr(
+                timeline.keys[agent], field), field
+    assert estimator.estimateRecord(offline.simulate()) == \
+        estimator.estimateRecord(timeline.simulate())
+
+
+def test_offline_run_matches_live(estimator: Any, applianceRoot: str,
+                                  tmp_path: Any) -> None:
+    if estimator.numpy() is None:
+        pytest.skip('NumPy isn\'t installed')
+    path = str(tmp_path / 'export.npz')
+    environment = dict(os.environ, PATH=os.path.join(applianceRoot, 'bin')
+                       + os.pathsep + os.environ.get('PATH', ''))
+
+    def run(*argv: str) -> str:
+        return subprocess.run(
+            [sys.executable, SCRIPT, '--no-cache'] + list(argv),
+            env=environment, stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout
+
+    live = run('--root', applianceRoot, '--export', path)
+    # Nothing of the appliance is needed, only the export.
+    assert run('--root', str(tmp_path), '--offline', path) == live
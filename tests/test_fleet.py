@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import tarfile
+import shutil
+import os
+
+import pytest
+
+
+def arguments(estimator: Any, *argv: str) -> Any:
+    return estimator.argumentParser().parse_args(list(argv))
+
+
+def test_appliance_directory_and_tarball(estimator: Any, applianceRoot: str,
+                                         tmp_path: Any) -> None:
+    tarball = str(tmp_path / 'appliance.tgz')
+    with tarfile.open(tarball, 'w:gz') as archive:
+        for member in ('datto', 'bin'):
+            archive.add(os.path.join(applianceRoot, member), member)
+
+    state = str(tmp_path / 'state')
+    directory = estimator.estimateAppliance(applianceRoot,
+                                            arguments(estimator), state)
+    assert 'error' not in directory
+    assert len(directory['agents']) == 3 and directory['backlog'] > 0
+    extracted = estimator.estimateAppliance(tarball, arguments(estimator),
+                                            state)
+    assert 'error' not in extracted
+    assert (extracted['agents'].keys(), extracted['backlog']) == (
+        directory['agents'].keys(), directory['backlog'])
+
+
+def test_appliance_without_zfs_is_an_error(estimator: Any,
+                                           applianceRoot: str,
+                                           appliance: List[str],
+                                           tmp_path: Any) -> None:
+    # Even with another appliance's `zfs` first on the PATH, as the
+    # `appliance` fixture leaves it, it isn't used for this one.
+    root = str(tmp_path / 'appliance')
+    shutil.copytree(os.path.join(applianceRoot, 'datto'),
+                    os.path.join(root, 'datto'))
+    record = estimator.estimateAppliance(root, arguments(estimator),
+                                         str(tmp_path / 'state'))
+    assert 'bin/zfs' in record['error'] and 'agents' not in record
+
+
+def test_appliance_export(estimator: Any, appliance: List[str],
+                          tmp_path: Any, monkeypatch: Any) -> None:
+    if estimator.numpy() is None:
+        pytest.skip('NumPy isn\'t installed')
+    timeline = estimator.Timeline(arguments(estimator, '--no-cache'))
+    expected = estimator.estimateRecord(timeline.simulate())
+    path = estimator.exportTimeline(timeline, str(tmp_path / 'export.npz'))
+
+    # The export alone will do, with no zfs at all.
+    monkeypatch.setenv('PATH', '')
+    record = estimator.estimateAppliance(path, arguments(estimator),
+                                         str(tmp_path / 'state'))
+    assert 'error' not in record
+    assert record['agents'] == expected['agents']
+    assert record['hours'] == expected['hours']
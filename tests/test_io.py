@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import subprocess
+import sys
+
+import pytest
+
+
+def child(source: str) -> List[str]:
+    return [sys.executable, '-c', source]
+
+
+def test_iter_io_yields_lines_across_chunks(estimator: Any) -> None:
+    lines = estimator.iterIO(child(
+        'import sys; sys.stdout.write("a\\n\\nbb\\n" + "c" * 100)'),
+        chunkSize=7)
+    assert list(lines) == ['a', '', 'bb', 'c' * 100]
+
+
+def test_iter_io_drains_stderr(estimator: Any) -> None:
+    # Far more than a pipe holds, before anything on stdout.
+    with pytest.raises(estimator.CommandError) as raised:
+        list(estimator.iterIO(child(
+            'import sys; sys.stderr.write("x" * 10 ** 6 + "tail");'
+            'print("done"); sys.exit(3)'), maxStderr=16))
+    assert raised.value.returncode == 3
+    assert raised.value.stderr == 'x' * 12 + 'tail'
+
+
+def test_iter_io_times_out(estimator: Any) -> None:
+    with pytest.raises(subprocess.TimeoutExpired):
+        list(estimator.iterIO(child(
+            'import time; print("first", flush=True); time.sleep(60)'),
+            timeout=0.5))
+
+
+def test_iter_io_kills_the_child_when_stopped_early(estimator: Any) -> None:
+    started = estimator.monotonic()
+    lines = estimator.iterIO(child(
+        'import time; print("first", flush=True); time.sleep(60)'))
+    assert next(lines) == 'first'
+    lines.close()
+    assert estimator.monotonic() - started < 30
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any
+
+import os
+
+import fixtures
+from conftest import NOW
+
+
+def test_load_agent_keys_reports_errors(estimator: Any,
+                                        tmp_path: Any) -> None:
+    root = str(tmp_path)
+    agents = [os.path.basename(dataset) for dataset in
+              fixtures.makeAppliance(root, 5, 20, seed=2, now=NOW)]
+    keys = os.path.join(root, 'datto', 'config', 'keys', '')
+    with open(keys + agents[0] + '.retention', 'w') as keyFile:
+        keyFile.write('not:a:policy\n')
+    os.remove(keys + agents[1] + '.schedule')
+
+    estimator.setRoot(root)
+    try:
+        alone = estimator.loadAgentKeys(agents, processes=1)
+        # Enough agents for two processes to be worth it.
+        pooled = estimator.loadAgentKeys(agents, processes=2)
+    finally:
+        estimator.setRoot('/')
+
+    assert pooled == alone and list(alone) == agents
+    assert alone[agents[0]].retention is None
+    assert list(alone[agents[0]].errors) == ['retention']
+    assert alone[agents[0]].errors['retention'].startswith(
+        agents[0] + '.retention: ')
+    assert alone[agents[1]].schedule is None
+    assert list(alone[agents[1]].errors) == ['schedule']
+    assert alone[agents[1]].errors['schedule'].startswith(
+        agents[1] + '.schedule: ')
+
+    # One bad key doesn't keep the rest from being decoded.
+    assert alone[agents[0]].schedule is not None
+    assert alone[agents[1]].retention == [24, 168, 720, 8760]
+    for agent in agents[2:]:
+        assert not alone[agent].errors and alone[agent].parsed > 0
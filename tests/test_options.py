@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any
+
+import json
+import os
+
+import pytest
+
+import fixtures
+from conftest import NOW
+
+
+def test_load_sync_options(estimator: Any, tmp_path: Any) -> None:
+    root = str(tmp_path)
+    agents = [os.path.basename(dataset) for dataset in
+              fixtures.makeAppliance(root, 6, 10, seed=4, now=NOW)]
+    sync = os.path.join(root, 'datto', 'config', 'sync')
+
+    def options(agent: str, line: str) -> None:
+        with open(os.path.join(sync, fixtures.SYNC_DIRECTORY.format(agent),
+                               'options'), 'w') as optionsFile:
+            optionsFile.write(line)
+
+    options(agents[0], json.dumps({'pauseTransfer': True}) + '\n')
+    options(agents[1], '{"pauseZfs": tru\n')
+    options(agents[2], '')
+    options(agents[3], '[1, 2]\n')
+    os.remove(os.path.join(sync, fixtures.SYNC_DIRECTORY.format(agents[4]),
+                           'options'))
+    # Neither a directory nor anything to do with an agent.
+    with open(os.path.join(sync, fixtures.SYNC_DIRECTORY.format('stray')),
+              'w'):
+        pass
+
+    estimator.setRoot(root)
+    try:
+        with pytest.warns(RuntimeWarning, match=agents[1]):
+            everything = estimator.loadSyncOptions()
+        some = estimator.loadSyncOptions([agents[0], agents[5], 'nobody'])
+    finally:
+        estimator.setRoot('/')
+
+    assert sorted(everything) == sorted([agents[0], agents[5]])
+    assert everything[agents[0]] == {'pauseTransfer': True}
+    assert everything[agents[5]]['pauseTransfer'] is False
+    assert some == everything
+    assert estimator.pauseMask(agents, everything) == 0b011111
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any
+
+import os
+
+import pytest
+
+
+def write(path: Any, data: str) -> None:
+    with open(str(path), 'w') as keyFile:
+        keyFile.write(data)
+
+
+def test_cache_misses_once_a_key_changes(estimator: Any,
+                                         tmp_path: Any) -> None:
+    key = tmp_path / 'agent.interval'
+    write(key, '60\n')
+    decoded = []
+
+    def decoder(path: str) -> str:
+        decoded.append(path)
+        with open(path) as keyFile:
+            return keyFile.read().strip()
+
+    cache = estimator.DecodeCache(str(tmp_path / 'state' / 'cache'))
+    assert cache.fetch(str(key), decoder) == '60'
+    assert cache.fetch(str(key), decoder) == '60'
+    assert (cache.hits, cache.misses, len(decoded)) == (1, 1, 1)
+
+    write(key, '15\n')
+    assert cache.fetch(str(key), decoder) == '15'
+    assert len(decoded) == 2
+
+    # What's saved is what's loaded, and is still checked against the key.
+    cache.save()
+    cache = estimator.DecodeCache(str(tmp_path / 'state' / 'cache'))
+    assert cache.fetch(str(key), decoder) == '15'
+    assert len(decoded) == 2
+    os.remove(str(key))
+    assert cache.get(str(key), cache.signature(str(key))) is cache.MISS
+
+
+def test_cache_evicts_least_recently_used(estimator: Any,
+                                          tmp_path: Any) -> None:
+    cache = estimator.DecodeCache(str(tmp_path / 'cache'), maxEntries=2)
+    for name in 'abc':
+        cache.put(name, (1, 1, 1), name)
+        if name == 'b':
+            assert cache.get('a', (1, 1, 1)) == 'a'
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.evictions == 1
+
+
+def test_state_others_can_write_is_ignored(estimator: Any,
+                                           tmp_path: Any) -> None:
+    path = str(tmp_path / 'state' / 'cache')
+    cache = estimator.DecodeCache(path)
+    cache.put('key', (1, 1, 1), 'value')
+    cache.save()
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert estimator.DecodeCache(path).entries
+
+    os.chmod(path, 0o666)
+    with pytest.warns(RuntimeWarning):
+        assert not estimator.DecodeCache(path).entries
+    os.chmod(path, 0o600)
+    os.chmod(os.path.dirname(path), 0o777)
+    with pytest.warns(RuntimeWarning):
+        assert not estimator.DecodeCache(path).entries
+
+
+def test_state_directory_that_cant_be_made_is_skipped(estimator: Any,
+                                                      tmp_path: Any) -> None:
+    # A file where the directory should be fails like a read-only --root.
+    write(tmp_path / 'state', '')
+    cache = estimator.DecodeCache(str(tmp_path / 'state' / 'cache'))
+    cache.put('key', (1, 1, 1), 'value')
+    series = estimator.SnapshotState(str(tmp_path / 'state' / 'snapshots'))
+    series['agent'] = estimator.SnapshotSeries.fromDict({1: 2})
+
+    with pytest.warns(RuntimeWarning):
+        cache.save()
+    with pytest.warns(RuntimeWarning):
+        series.save()
+    with pytest.warns(RuntimeWarning):
+        estimator.ThroughputEstimator().save(
+            str(tmp_path / 'state' / 'throughput'))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import subprocess
+import pstats
+import json
+import sys
+import os
+import re
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'time.py')
+
+
+def test_run_stats_accumulate(estimator: Any, tmp_path: Any) -> None:
+    stats = estimator.RunStats()
+    for _ in range(2):
+        with stats.phase('phase'):
+            pass
+    with pytest.raises(KeyError):
+        with stats.phase('failed'):
+            raise KeyError
+    stats.command('zfs list', 0.5)
+    stats.command('zfs list', 0.25)
+    stats.count('agent', snapshots=3)
+    stats.count('agent', snapshots=2, keys=1)
+
+    cache = estimator.DecodeCache(str(tmp_path / 'cache'))
+    recorded = json.loads(json.dumps(stats.toDict(cache)))
+    assert [recorded['phases'][name]['calls'] for name in
+            ('phase', 'failed')] == [2, 1]
+    assert recorded['commands']['zfs list'] == {'seconds': 0.75, 'calls': 2}
+    assert recorded['agents'] == {'agent': {'snapshots': 5, 'keys': 1}}
+    assert recorded['cache'] == {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def run(applianceRoot: str, *argv: str) -> str:
+    environment = dict(os.environ, PATH=os.path.join(applianceRoot, 'bin')
+                       + os.pathsep + os.environ.get('PATH', ''))
+    return subprocess.run(
+        [sys.executable, SCRIPT, '--root', applianceRoot, '--no-cache']
+        + list(argv), env=environment, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+
+def test_profile_and_stats_json(applianceRoot: str, tmp_path: Any) -> None:
+    profile = str(tmp_path / 'run.pstats')
+    statsJson = str(tmp_path / 'stats.json')
+    assert 'All agents caught up' in run(
+        applianceRoot, '--profile', profile, '--stats-json', statsJson)
+
+    functions = [function for _, _, function in
+                 pstats.Stats(profile).stats]  # type: List[str]
+    assert 'simulate' in functions and 'loadAgentKeys' in functions
+    with open(statsJson) as statsFile:
+        stats = json.load(statsFile)
+    for phase in ('list agents', 'list snapshots', 'decode keys',
+                  'simulate'):
+        assert stats['phases'][phase]['calls'] >= 1
+    assert stats['commands'] and len(stats['agents']) == 3
+
+
+def test_profile_collapsed_stacks(applianceRoot: str, tmp_path: Any) -> None:
+    profile = str(tmp_path / 'run.collapsed')
+    run(applianceRoot, '--profile', profile, '--profile-format', 'collapsed',
+        '--monte-carlo', '200', '-j', '1')
+    with open(profile) as collapsed:
+        lines = collapsed.read().splitlines()
+    assert lines
+    for line in lines:
+        assert re.match(r'^\S.* \d+$', line)
+    assert any('main (time.py:' in line for line in lines)
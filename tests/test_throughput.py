@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import os
+
+import pytest
+
+from conftest import NOW
+
+HOUR = 3600
+
+
+def test_ewma_halves_toward_each_observation(estimator: Any) -> None:
+    throughput = estimator.ThroughputEstimator(halfLife=HOUR)
+    assert throughput.estimate() is None
+    throughput.update(NOW, 100 * 60, 60)
+    assert throughput.estimate() == 100
+
+    # A half-life on, a new rate counts for half.
+    throughput.update(NOW + HOUR, 300 * 60, 60)
+    assert throughput.estimate() == pytest.approx(200)
+    # Two on, three quarters.
+    throughput.update(NOW + 3 * HOUR, 0, 60)
+    assert throughput.estimate() == pytest.approx(50)
+
+    # Nothing sent over no time tells us nothing.
+    throughput.update(NOW + 4 * HOUR, 10 ** 9, 0)
+    assert throughput.estimate() == pytest.approx(50)
+
+
+def test_holt_follows_a_trend(estimator: Any) -> None:
+    ewma = estimator.ThroughputEstimator(halfLife=6 * HOUR)
+    holt = estimator.ThroughputEstimator(halfLife=6 * HOUR, holt=True)
+    for hour in range(200):
+        for throughput in (ewma, holt):
+            throughput.update(NOW + hour * HOUR, (1000 + 10 * hour) * HOUR,
+                              HOUR)
+
+    # 1000 + 10 * 199 is the last rate; an hour on, the trend says 10 more.
+    last = NOW + 199 * HOUR
+    assert holt.estimate(last + HOUR) == pytest.approx(3000, rel=0.01)
+    assert holt.trend * HOUR == pytest.approx(10, rel=0.01)
+    assert ewma.estimate(last + HOUR) < 2990 - 50
+
+
+def test_state_round_trips(estimator: Any, tmp_path: Any) -> None:
+    path = str(tmp_path / 'throughput')
+    throughput = estimator.ThroughputEstimator(holt=True)
+    throughput.update(NOW, 100, 10)
+    throughput.update(NOW + HOUR, 300, 10)
+    throughput.watermarks = {'agent': {'points': NOW}}
+    throughput.save(path)
+
+    loaded = estimator.ThroughputEstimator.load(path, holt=True)
+    assert (loaded.level, loaded.trend, loaded.updated, loaded.watermarks) \
+        == (throughput.level, throughput.trend, throughput.updated,
+            throughput.watermarks)
+
+    with open(path, 'w') as stateFile:
+        stateFile.write('{"version": 1}')
+    assert estimator.ThroughputEstimator.load(path).level is None
+
+
+def test_observe_reads_history_once(estimator: Any,
+                                    appliance: List[str]) -> None:
+    agents = [os.path.basename(dataset) for dataset in appliance]
+    keys = estimator.loadAgentKeys(agents, processes=1)
+    snaps = estimator.getAllSnapshots(appliance)
+    histories = [(agent, keys[agent],
+                  estimator.SnapshotSeries.fromDict(snaps[dataset]))
+                 for agent, dataset in zip(agents, appliance)]
+
+    throughput = estimator.ThroughputEstimator()
+    assert throughput.observe(histories) > 0
+    level = throughput.estimate()
+    assert level > 0
+    assert throughput.observe(histories) == 0
+    assert throughput.estimate() == level
+
+    # However the agents come in.
+    backwards = estimator.ThroughputEstimator()
+    backwards.observe(histories[::-1])
+    assert backwards.estimate() == pytest.approx(level)
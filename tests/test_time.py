@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import functools
+import operator
+import random
+
+import pytest
+
+from conftest import NOW, SNAPSHOTS
+
+HOUR = 3600
+
+
+def hourly(estimator: Any, start: int, sizes: List[int]) -> Any:
+    return estimator.SnapshotSeries.fromDict(dict(
+        (start + hour * HOUR, size) for hour, size in enumerate(sizes)))
+
+
+def test_series_windows(estimator: Any) -> None:
+    series = hourly(estimator, NOW, list(range(1, 11)))
+    assert len(series.between()) == 10
+    assert series.between(NOW + 2 * HOUR, NOW + 5 * HOUR).toDict() == dict(
+        (NOW + hour * HOUR, hour + 1) for hour in range(2, 5))
+    # Half-open, and clamped past either end.
+    assert series.total(NOW + 2 * HOUR, NOW + 5 * HOUR) == 3 + 4 + 5
+    assert series.total(NOW + 2 * HOUR + 1, NOW + 5 * HOUR + 1) == 4 + 5 + 6
+    assert series.total(NOW - HOUR, NOW + 99 * HOUR) == 55
+    assert series.total(NOW + 5 * HOUR, NOW + 2 * HOUR) == 0
+    assert not len(series.between(NOW + 10 * HOUR))
+
+    # Windows of windows share the parent's buffers but not its offsets.
+    window = series.between(NOW + 3 * HOUR)
+    assert window.total(None, NOW + 5 * HOUR) == 4 + 5
+    assert list(window.totalsBefore([NOW, NOW + 4 * HOUR, NOW + 99 * HOUR])) \
+        == [0, 4, 4 + 5 + 6 + 7 + 8 + 9 + 10]
+
+    expected = series.toDict()
+    del expected[NOW + HOUR]
+    expected.update({NOW: 100, NOW + 20 * HOUR: 7})
+    updated = series.updated({NOW + 20 * HOUR: 7, NOW: 100}, [NOW + HOUR])
+    assert updated.toDict() == expected
+    assert updated.total() == 55 - 1 - 2 + 100 + 7
+
+
+def test_pruner_backlog_and_culls(estimator: Any) -> None:
+    # Two days of hourly backups from midnight, 150 bytes of them sent;
+    # retention keeps each for a day, then the last of each day.
+    history = hourly(estimator, NOW, [100] * 48)
+    policy = [24, 168, 720, 8760]
+    pruner = estimator.RetentionPruner(history, history, [policy], sent=150)
+    assert pruner.backlog == 48 * 100 - 150
+    assert pruner.inFlight == NOW + HOUR
+
+    # A day on, the first day's snapshots but its last are culled, bar the
+    # one in flight, and never sent.
+    culled = pruner.cull(NOW + 24 * HOUR + 22 * HOUR)
+    assert culled == 21 * 100
+    assert pruner.backlog == 48 * 100 - 150 - 21 * 100
+    assert NOW + HOUR in pruner.unsent and NOW + 23 * HOUR in pruner.unsent
+    assert NOW + 2 * HOUR not in pruner.unsent
+
+    # Sending skips what's culled.
+    pruner.send(50 + 50)
+    assert pruner.inFlight == NOW + 23 * HOUR
+    assert pruner.unsent[NOW + 23 * HOUR] == 50
+
+    pruner.send(pruner.backlog)
+    assert pruner.done and pruner.backlog == 0
+
+
+def test_pruner_culls_out_of_the_ledger(estimator: Any) -> None:
+    # Only the first day is pending; the second's backups follow it.
+    history = hourly(estimator, NOW, [100] * 48)
+    pending = history.between(None, NOW + 24 * HOUR)
+    pruner = estimator.RetentionPruner(pending, history,
+                                       [None, [1, 1, 1, 1]])
+    assert pruner.backlog == 24 * 100
+
+    # Everything pending goes, the last as the backups after it are made.
+    assert pruner.cull(NOW + 25 * HOUR) == 24 * 100
+    assert pruner.done and pruner.backlog == 0
+
+
+def pruners(estimator: Any, rng: random.Random, agents: int) -> List[Any]:
+    """
+    Pruners of a week of hourly backups of random sizes for every other
+    agent, some of them sent, culled after a day and keeping the last of
+    each day.
+    """
+    made = []
+    for agent in range(agents):
+        if agent % 2:
+            made.append(None)
+            continue
+        history = hourly(estimator, NOW - 168 * HOUR, [
+            rng.randrange(1, 10 ** 9) for _ in range(168)])
+        made.append(estimator.RetentionPruner(
+            history, history, [[24, 168, 720, 8760]],
+            rng.randrange(0, 10 ** 10)))
+    return made
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_culls_come_off_the_queue(estimator: Any, seed: int) -> None:
+    rng = random.Random(seed)
+    agents, horizon = 6, 400
+    local = [[True] * estimator.HOURS_PER_WEEK] * agents
+    made = pruners(estimator, rng, agents)
+    backlog = [pruner.backlog if pruner is not None else 10 ** 10
+               for pruner in made]
+    rates = [10 ** 8] * agents
+    bandwidth = 2 * 10 ** 9
+
+    def run(loop: bool, culling: bool) -> Any:
+        simulate = estimator._simulateSyncLoop if loop \
+            else estimator.simulateSync
+        return simulate(backlog, local, local, rates, bandwidth, 0, horizon,
+                        [pruner.copy() if pruner is not None else None
+                         for pruner in made] if culling else None, NOW)
+
+    hours, agentHours, pruned = run(True, True)
+    if estimator.numpy() is not None:
+        assert run(False, True) == (hours, agentHours, pytest.approx(pruned))
+    baseline = run(True, False)
+    assert all(pruned[agent] > 0 for agent in range(0, agents, 2))
+    assert hours < baseline[0]
+    for agent in range(agents):
+        if agent % 2 == 0:
+            assert agentHours[agent] < baseline[1][agent]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_simulate_sync_matches_loop(estimator: Any, seed: int) -> None:
+    if estimator.numpy() is None:
+        pytest.skip('NumPy isn\'t installed')
+    rng = random.Random(seed)
+    agents = 8
+    horizon = estimator.NUMPY_THRESHOLD // agents + 1
+    local = [[rng.random() < 0.5 for _ in range(estimator.HOURS_PER_WEEK)]
+             for _ in range(agents)]
+    offsite = [[rng.random() < 0.7 for _ in range(estimator.HOURS_PER_WEEK)]
+               for _ in range(agents)]
+    backlog = [rng.choice([0, rng.lognormvariate(22, 1)])
+               for _ in range(agents)]
+    rates = [rng.lognormvariate(18, 1) for _ in range(agents)]
+    bandwidth = sum(rates) * rng.uniform(0.8, 2)
+
+    hours, agentHours, _ = estimator.simulateSync(
+        backlog, local, offsite, rates, bandwidth, seed * 13, horizon)
+    assert (hours, agentHours) == estimator._simulateSyncLoop(
+        backlog, local, offsite, rates, bandwidth, seed * 13, horizon)[:2]
+
+
+def test_trials_match_one_at_a_time(estimator: Any) -> None:
+    np = estimator.numpy()
+    if np is None:
+        pytest.skip('NumPy isn\'t installed')
+    rng = np.random.default_rng(0)
+    agents, trials, horizon = 12, 40, 400
+    local = rng.random((agents, estimator.HOURS_PER_WEEK)) < 0.5
+    offsite = rng.random((agents, estimator.HOURS_PER_WEEK)) < 0.6
+    backlog = rng.lognormal(22, 1, agents)
+    backlog[3] = 0
+    unit = estimator._arrivals(local.tolist(), offsite.tolist(),
+                               [1.0] * agents, 5, horizon)
+    rates = rng.lognormal(18, 1, (trials, agents))
+    bandwidth = rng.lognormal(21.8, 0.5, trials)
+
+    hours, agentHours = estimator._drainTrials(backlog, unit, rates,
+                                               bandwidth, horizon)
+    for trial in range(trials):
+        alone, agentAlone, _ = estimator._drainQueues(
+            backlog, unit * rates[trial], bandwidth[trial], horizon)
+        assert hours[trial] == (-1 if alone is None else alone)
+        assert agentHours[trial].tolist() == [
+            -1 if taken is None else taken for taken in agentAlone]
+
+
+def test_trials_with_culls_match_one_at_a_time(estimator: Any) -> None:
+    np = estimator.numpy()
+    if np is None:
+        pytest.skip('NumPy isn\'t installed')
+    rng = np.random.default_rng(1)
+    agents, trials, horizon = 8, 30, 400
+    made = pruners(estimator, random.Random(1), agents)
+    backlog = np.array([pruner.backlog if pruner is not None else 10 ** 10
+                        for pruner in made])
+    local = rng.random((agents, estimator.HOURS_PER_WEEK)) < 0.7
+    unit = estimator._arrivals(local.tolist(), local.tolist(),
+                               [1.0] * agents, 0, horizon)
+    rates = rng.lognormal(18, 1, (trials, agents))
+    bandwidth = rng.lognormal(21, 0.5, trials)
+    culls = estimator._cullSchedule(made, NOW, horizon)
+
+    hours, agentHours = estimator._drainTrials(backlog, unit, rates,
+                                               bandwidth, horizon, culls)
+    for trial in range(trials):
+        alone, agentAlone, _ = estimator._drainQueues(
+            backlog, unit * rates[trial], bandwidth[trial], horizon,
+            [pruner.copy() if pruner is not None else None
+             for pruner in made], NOW)
+        assert hours[trial] == (-1 if alone is None else alone)
+        assert agentHours[trial].tolist() == [
+            -1 if taken is None else taken for taken in agentAlone]
+
+
+def test_incremental_matches_full_listing(estimator: Any, appliance: List[str],
+                                          tmp_path: Any) -> None:
+    full = estimator.getAllSnapshots(appliance)
+    state = estimator.SnapshotState(str(tmp_path / 'snapshots'))
+
+    # The first run of an agent is a full listing.
+    first = estimator.getAllSnapshotsIncremental(appliance, state)
+    for agent in appliance:
+        assert first[agent].toDict() == full[agent]
+
+    # Make the state stale: some snapshots not made yet, one since
+    # destroyed, and one whose size has changed since.
+    agent = appliance[0]
+    epochs = sorted(full[agent])
+    stale = dict((epochInt, size) for epochInt, size in full[agent].items()
+                 if epochInt < epochs[-20])
+    stale[epochs[10] + 1800] = 12345
+    stale[epochs[11]] += 1
+    state[agent] = estimator.SnapshotSeries.fromDict(stale)
+    state.save()
+
+    state = estimator.SnapshotState(str(tmp_path / 'snapshots'))
+    assert state.watermark(agent) == epochs[-21]
+    second = estimator.getAllSnapshotsIncremental(appliance, state)
+    for dataset in appliance:
+        assert second[dataset].toDict() == full[dataset]
+    assert len(second[agent]) == SNAPSHOTS
+
+
+def test_sizes_skip_destroyed_snapshots(estimator: Any,
+                                        appliance: List[str]) -> None:
+    agent = appliance[0]
+    epochs = sorted(estimator.getAllSnapshots([agent])[agent])
+    names = ['{}@{}'.format(agent, epochInt) for epochInt in epochs[:3]]
+    sizes = estimator.getSnapshotSizes(names[:1] + [agent + '@1'] + names[1:])
+    assert sorted(sizes) == names
+
+
+def test_water_fill_splits_evenly(estimator: Any) -> None:
+    np = estimator.numpy()
+    if np is None:
+        pytest.skip('NumPy isn\'t installed')
+    queue = np.array([5.0, 1.0, 9.0, 3.0])
+    assert estimator._waterFill(queue, 10.0).tolist() == [3.0, 1.0, 3.0, 3.0]
+    assert estimator._waterFill(queue, 100.0).tolist() == queue.tolist()
+
+    # Summed in this order it's 3.3000000000000003; sorted, 3.3.
+    queue = np.array([0.1, 3.0, 0.2])
+    assert estimator._waterFill(queue, 3.3).tolist() == queue.tolist()
+    rows = estimator._waterFillRows(queue[None, :], np.array([3.3]))
+    assert rows.tolist() == [queue.tolist()]
+
+
+def test_trials_center_on_the_point_estimate(estimator: Any) -> None:
+    # A skewed spread of hourly throughput, scaled to average the point
+    # estimate's bandwidth as `monteCarlo` does; the trials' median should
+    # land on the point estimate, and per-hour draws still spread them.
+    np = estimator.numpy()
+    rng = random.Random(0)
+    observed = [rng.lognormvariate(0, 1) for _ in range(168)]
+    bandwidth = 10 ** 9
+    throughput = [value * bandwidth / (sum(observed) / len(observed))
+                  for value in observed]
+    horizon = 400
+    backlog = [100 * bandwidth, 150 * bandwidth]
+    never = [[False] * estimator.HOURS_PER_WEEK] * 2
+    point = estimator.simulateSync(backlog, never, never, [0.0, 0.0],
+                                   bandwidth, 0, horizon)[0]
+
+    model = estimator.MonteCarloModel(
+        backlog=backlog, rates=[0.0, 0.0], sizes=[None, None],
+        perHour=[0.0, 0.0],
+        throughput=np.asarray(throughput) if np is not None else throughput,
+        bandwidth=float(bandwidth), speedLimit=float('inf'), local=never,
+        offsite=never, startHour=0, horizon=horizon,
+        arrivals=estimator._arrivals(never, never, [1.0, 1.0], 0, horizon)
+        if np is not None else None,
+        pruners=[None, None], startEpoch=NOW, culls=None)
+    seed = np.random.SeedSequence(1) if np is not None else '1'
+    hours = sorted(taken for taken, _ in estimator._simulateTrials(
+        model, seed, 200))
+    assert point == 250
+    assert abs(hours[len(hours) // 2] - point) <= 0.05 * point
+    assert hours[-1] - hours[0] >= 5
+
+
+@pytest.mark.parametrize('agents', [5, 400])
+def test_schedule_masks_match_bitwise(estimator: Any, agents: int) -> None:
+    # 400 agents is past NUMPY_THRESHOLD, so they're packed if NumPy's here.
+    rng = random.Random(agents)
+    full = estimator.ScheduleMasks.FULL
+    masks = [rng.getrandbits(estimator.HOURS_PER_WEEK)
+             for _ in range(agents)]  # type: List[Any]
+    masks[1] = None
+    schedules = estimator.ScheduleMasks(masks)
+    plain = [full if mask is None else mask for mask in masks]
+
+    assert len(schedules) == agents and schedules[1] == full
+    assert schedules.union() == functools.reduce(operator.or_, plain)
+    assert schedules.intersection() == functools.reduce(operator.and_, plain)
+    assert schedules.popcount() == [bin(mask).count('1') for mask in plain]
+    assert schedules.histogram() == [
+        sum(mask >> hour & 1 for mask in plain)
+        for hour in range(estimator.HOURS_PER_WEEK)]
+    assert [list(map(bool, row)) for row in schedules.flags()] == [
+        [bool(mask >> hour & 1) for hour in range(estimator.HOURS_PER_WEEK)]
+        for mask in plain]
+
+    shifted = estimator.ScheduleMasks(plain[1:] + plain[:1])
+    assert (schedules & shifted).masks == [
+        mine & theirs for mine, theirs in zip(plain, shifted.masks)]
+    assert (schedules | shifted).masks == [
+        mine | theirs for mine, theirs in zip(plain, shifted.masks)]
+    assert estimator.ScheduleMasks.hours(masks[0]) == [
+        hour for hour in range(estimator.HOURS_PER_WEEK)
+        if masks[0] >> hour & 1]
+
+    empty = estimator.ScheduleMasks([])
+    assert (empty.union(), empty.intersection()) == (0, full)
+
+
+def test_schedule_masks_flags_are_weekly_hours(
+        estimator: Any, appliance: List[str]) -> None:
+    schedules = []
+    for dataset in appliance:
+        for suffix in ('.schedule', '.offsiteSchedule'):
+            path = estimator.KEYS + dataset.rsplit('/', 1)[-1] + suffix
+            with open(path, 'rb') as keyFile:
+                schedules.append(estimator.ConvertJSON.loads(keyFile.read()))
+    masks = estimator.ScheduleMasks([estimator.scheduleMask(schedule)
+                                     for schedule in schedules] + [None])
+    assert [list(map(bool, row)) for row in masks.flags()] == [
+        estimator.weeklyHours(schedule) for schedule in schedules + [None]]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize('argv', [['--no-cache', '--full-listing'], []])
+def test_create_matches_constructor(estimator: Any, appliance: List[str],
+                                    argv: List[str]) -> None:
+    parser = estimator.argumentParser()
+    expected = estimator.Timeline(parser.parse_args(argv))
+
+    # On a loop of its own that was never made the current one, as the
+    # running loop is what's used.
+    loop = asyncio.new_event_loop()
+    try:
+        timeline = loop.run_until_complete(estimator.Timeline.create(
+            parser.parse_args(argv), concurrency=2))
+    finally:
+        loop.close()
+
+    assert timeline.agents == expected.agents
+    assert timeline.agent_identifiers == expected.agent_identifiers
+    assert [snaps.toDict() for snaps in timeline.snaps] == [
+        snaps.toDict() for snaps in expected.snaps]
+    # Bar how much was parsed, which is none of what the cache had.
+    assert dict((agent, key._replace(parsed=0))
+                for agent, key in timeline.keys.items()) == dict(
+        (agent, key._replace(parsed=0)) for agent, key in expected.keys.items())
+    assert timeline.bandwidth == expected.bandwidth
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Dict, List, Optional
+
+import subprocess
+import json
+import sys
+import os
+
+import voltab
+from decode import ConvertJSON
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'voltab.py')
+AGENT = 'a' * 32
+
+
+def makeAgent(root: Any, voltabs: Dict[int, Optional[List[str]]]) -> str:
+    """
+    An agent with a snapshot per entry of `voltabs` (epoch -> mountpoints,
+    or None for no voltab) under `root`, as on an appliance.
+    """
+    snapshots = os.path.join(str(root), 'home', 'agents', AGENT, '.zfs',
+                             'snapshot')
+    for epoch, mountpoints in voltabs.items():
+        directory = os.path.join(snapshots, str(epoch))
+        os.makedirs(directory)
+        if mountpoints is None:
+            continue
+        with open(os.path.join(directory, 'voltab'), 'w') as voltabFile:
+            if mountpoints:
+                json.dump(dict((str(index), {'mountpoint': mountpoint,
+                                             'guid': index})
+                               for index, mountpoint in
+                               enumerate(mountpoints)), voltabFile)
+    keys = os.path.join(str(root), 'datto', 'config', 'keys')
+    os.makedirs(keys)
+    with open(os.path.join(keys, AGENT + '.agentInfo'), 'wb') as keyFile:
+        keyFile.write(ConvertJSON.dumps({'os': 'Windows',
+                                         'hostName': 'host-a'}))
+    return str(root)
+
+
+VOLTABS = {300: ['C:\\', 'D:\\'], 100: ['C:\\'], 200: ['C:\\'], 400: None,
+           500: []}
+
+
+def test_scan_agents_in_order(tmp_path: Any, monkeypatch: Any) -> None:
+    root = makeAgent(tmp_path, VOLTABS)
+    monkeypatch.setattr(voltab, 'AGENTS',
+                        os.path.join(root, 'home', 'agents', ''))
+    monkeypatch.setattr(voltab, 'KEYS',
+                        os.path.join(root, 'datto', 'config', 'keys', ''))
+
+    assert voltab.listSnapshots(AGENT) == [100, 200, 300, 400, 500]
+    assert voltab.listSnapshots('missing') == []
+    assert list(voltab.scanAgents([AGENT, 'missing'], threads=2)) == [
+        (AGENT, 100, ['C:\\']), (AGENT, 200, ['C:\\']),
+        (AGENT, 300, ['C:\\', 'D:\\']), (AGENT, 400, None), (AGENT, 500, [])]
+    assert voltab.getHostName(AGENT) == 'host-a'
+    assert voltab.getHostName('missing') is None
+    assert voltab.formatSnapshot(0, None).endswith('voltab doesn\'t exist')
+    assert voltab.formatSnapshot(0, []).endswith('No volumes included in '
+                                                 'voltab')
+
+
+def test_changes_as_json(tmp_path: Any) -> None:
+    root = makeAgent(tmp_path, VOLTABS)
+    lines = subprocess.run(
+        [sys.executable, SCRIPT, '--root', root, '--changes', '--json'],
+        stdout=subprocess.PIPE, check=True,
+        universal_newlines=True).stdout.splitlines()
+    assert [(record['epoch'], record['volumes'], record['hostName'])
+            for record in map(json.loads, lines)] == [
+        (100, ['C:\\'], 'host-a'), (300, ['C:\\', 'D:\\'], 'host-a'),
+        (400, None, 'host-a'), (500, [], 'host-a')]
+
+    printed = subprocess.run(
+        [sys.executable, SCRIPT, '--root', root, AGENT, 'nobody'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True)
+    assert printed.stdout.splitlines()[0] == AGENT + ' host-a'
+    assert len(printed.stdout.splitlines()) == 1 + len(VOLTABS)
+    assert '"nobody" doesn\'t exist' in printed.stderr
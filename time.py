@@ -11,9 +11,6 @@ current settings/bandwidth, to catch up, so that they can make that decision.
 © Brandon Doyle, 2018
 """
 
-# TODO: Take modifications of retention and backups into account
-# TODO: Implement EWMA to upload series
-
 import sys
 
 major = sys.version_info.major
@@ -25,17 +22,28 @@ elif minor < 5:
     raise Exception('Must use Python 3.5+, you\'re using Python 3.{}'\
             .format(minor))
 
-from typing import List, Dict, Optional, Any
-from subprocess import Popen
-from functools import partial
+from typing import List, Dict, Set, Tuple, NamedTuple, Iterator, \
+    Iterable, Sequence, Optional, Callable, Union, IO, Any
+from time import monotonic, gmtime, sleep
+from functools import partial, reduce
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from itertools import accumulate, chain, repeat
+from bisect import bisect_left
+from array import array
 from os.path import basename
-from glob import glob
 
+# Only what's cheap, or that `typing` imports anyway, is imported up here;
+# everything else is imported where it's used, so a quick query of a single
+# agent doesn't pay for asyncio, subprocess, json and the rest.
 import warnings
-import json
-import argparse
+import struct
+import copy
+import heapq
+import operator
 import os
 import datetime
+import math
 import re
 
 # Regexes
@@ -44,15 +52,22 @@ newlines = re.compile(r'\n+')
 epoch    = re.compile(r'(?<=@)[0-9]+')
 schedule = re.compile(r'\"0\";i:[0-9]{1,3};') # pluck out hours of backups
 transfer = re.compile(r'[0-9]+(?=:)')
+numbers  = re.compile(r'[0-9]+')
 pauses   = re.compile(r'pause')
+agentDatasets = re.compile(r'agents/')
+syncAgent = re.compile(r'\+([^+/]+)\+agent(?:/|$)')
 
 # Shell
-ZFS_agent_list = 'zfs list -H -o name | awk \'/(agents\/)/\''
+ZFS_agent_list = 'zfs list -H -o name'   # filtered by `agentDatasets`
 ZFS_list_snapshots = 'zfs list -t snapshot -Hrp -o name,written,compressratio'
+ZFS_list_snapshot_names = 'zfs list -t snapshot -Hr -o name'  # cheaper
+ZFS_get_sizes = 'zfs get -Hp -o name,property,value written,compressratio'
 SS_Options = 'speedsync options'
+ZFS_TIMEOUT = 15 * 60   # seconds any one `zfs` may take; see --zfs-timeout
 
 # Key path and extensions
 KEYS = '/datto/config/keys/'
+SYNC = '/datto/config/sync/'
 SPEEDSYNC_OPTIONS_AGENT = '/datto/config/sync/*+{}+agent/options' # glob
 SPEEDSYNC_OPTIONS = '/datto/config/sync/options'
 
@@ -67,9 +82,56 @@ OFFSITE_SCHEDULE  = '.offsiteSchedule'  # `schedule`
 OFFSITE_POINTS    = '.offSitePoints'    # Just numbers
 TRANSFERS_DONE    = '.transfers'        # `transfer`
 
+# Other keys
+AGENT_INFO        = '.agentInfo'        # Serialized, like schedules
+
 # Other configs
 SPEED_LIMIT = '/datto/config/local/speedLimit' # Upload speed limit
 
+# Speed limits are in KiB/s
+SPEED_LIMIT_UNIT = 1024
+
+# Simulation
+HOURS_PER_WEEK = 168
+NUMPY_THRESHOLD = 65536            # elements of work worth importing NumPy for
+HORIZON = 24 * 365                 # hours simulated ahead, by default
+BACKUP_HOUR = '0'                  # schedule flag of hours backups are taken
+_EPSILON = 0.5                     # bytes; anything less is caught up
+
+# Our own state between runs, in a directory only we can write to (see
+# `_stateDirectory`); some of it is pickled.
+STATE_DIR = '/var/lib/offsiteEstimate/'
+DECODE_CACHE = STATE_DIR + 'decode.cache'       # Pickled `DecodeCache`
+THROUGHPUT_STATE = STATE_DIR + 'throughput.json' # `ThroughputEstimator`
+DAEMON_SOCKET = STATE_DIR + 'estimate.sock'     # `EstimateDaemon`
+SNAPSHOT_STATE = STATE_DIR + 'snapshots.state'  # `SnapshotState`
+
+# `Timeline.monteCarlo`
+MONTE_CARLO_TRIALS = 2000
+MONTE_CARLO_STREAMS = 64           # batches, each with its own RNG stream
+PERCENTILES = (50, 90, 99)
+
+# Bumped whenever `exportTimeline`'s tables change.
+EXPORT_VERSION = 1
+
+# Gaps between transfers longer than this (seconds) are idle time, not
+# throughput.
+MAX_TRANSFER_GAP = 24 * 3600
+
+# Seconds of transfers totalled across agents into each observation of the
+# link's throughput (see `linkThroughput`).
+TRANSFER_WINDOW = 3600
+
+# Paths above that `setRoot` moves under another root
+_ROOTED = ('KEYS', 'SYNC', 'SPEEDSYNC_OPTIONS_AGENT', 'SPEEDSYNC_OPTIONS',
+           'SPEED_LIMIT', 'STATE_DIR', 'DECODE_CACHE', 'THROUGHPUT_STATE',
+           'DAEMON_SOCKET', 'SNAPSHOT_STATE')
+_ROOT_PATHS = dict((name, globals()[name]) for name in _ROOTED)
+
+# Those of them that are our own state, which `setStateDir` moves
+_STATE = ('STATE_DIR', 'DECODE_CACHE', 'THROUGHPUT_STATE', 'DAEMON_SOCKET',
+          'SNAPSHOT_STATE')
+
 NOW = datetime.datetime.now()
 _WARN = partial(warnings.warn, stacklevel=2, category=RuntimeWarning)
 
@@ -79,91 +141,156 @@ class ConvertJSON:
     Methods for working on our (*ahem* horrid) JSON.
     """
 
-    # Match these 'tokens'
-    integer = r'^i:[0-9]+;?'
-    string  = r'^s:[0-9]+:\"[^\"]*\";?'
-    array   = r'^a:[0-9]+:{'
-    boolean = r'^b:[01];?'
-    endArr  = r'^}'
+    # Scalar 'tokens' we pick out of the buffer in place, without slicing it;
+    # compiled the first time there's something to decode (see `tokens`).
+    integer = None  # type: Any
+    double = None  # type: Any
 
-    lexer = re.compile('({}|{}|{}|{}|{})'.format(integer, string, array, endArr,
-                                                 boolean))
+    def __init__(self, cache: Optional['DecodeCache'] = None) -> None:
+        self.cache = cache
 
-    # `:' between parentheses will break unpacking if we just `.split(':')`
-    colonStringSplit = re.compile(r'(?<=s):|:(?=")')
+    @classmethod
+    def tokens(cls) -> Tuple[Any, Any]:
+        """
+        The `integer` and `double` patterns, compiling them if need be.
+        """
+        if cls.integer is None:
+            cls.integer = re.compile(rb'-?[0-9]+')
+            cls.double = re.compile(
+                rb'-?(?:[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?|INF|NAN)')
+        return cls.integer, cls.double
 
     def decode(self, key: str) -> Dict:
         """
-        Decode our JSON with regex into something a little nicer. In Python 3.5,
-        if I'm not mistaken, dictionaries don't necessarily keep their order, so
-        I've decided to use lists instead to unpack all of the keyData into.
-        Then a second pass converts this list of lists ... into a dictionary of
-        dictionaries ...
+        Decode our JSON into something a little nicer, going through `cache`
+        (if we have one) so unchanged keys aren't parsed again.
+        """
+        if self.cache is not None:
+            return self.cache.fetch(key, self._decode)
+        return self._decode(key)
+
+    def _decode(self, key: str) -> Dict:
+        """
+        Read the whole key once and hand it off to `loads`.
         """
         if not os.path.isfile(key):
             raise FileNotFoundError('File {} does not exist'.format(key))
 
-        with open(key, 'r') as keyData:
-            keyData = keyData.readline().rstrip()
-
-        def nestLevel(currentList: Optional[List] =None) -> List:
-            """
-            Allow the traversal of all nested levels.
-            """
-            nonlocal keyData
-
-            if currentList is None:
-                currentList = []
-
-            while keyData:
-                # Can't wait till assignment expressions!
-                result = re.search(self.lexer, keyData)
-
-                if not result:
-                    # Show what it's stuck on so we can debug it
-                    raise InvalidArrayFormat(keyData)
-
-                start, end = result.span()
-                substring = keyData[:end]
-                keyData = keyData[end:]
-
-                if substring.endswith(';'):
-                    substring = substring[:-1]
-
-                # Parse. Everything comes in 2's
-                if substring.startswith('a'):
-                    currentList.append(nestLevel([]))
-                elif substring.startswith('i'):
-                    _, value = substring.split(':')
-                    currentList.append(int(value))
-                elif substring.startswith('s'):
-                    _, _, value = re.split(self.colonStringSplit, substring)
-                    value = value[1:len(value) - 1]
-                    currentList.append(value)
-                elif substring.startswith('b'):
-                    _, value = substring.split(':')
-                    currentList.append(bool(value))
-                elif substring.startswith('}'):
-                    return currentList
-            return currentList
-
-        def convert(multiLevelArray: List) -> Dict:
-            """
-            Convert our multi-level list to a dictionary of dictionaries ...
-            """
-            length = len(multiLevelArray)
-            currentDict = {}
-
-            for i, j in zip(range(0, length - 1, 2), range(1, length, 2)):
-                key, val = multiLevelArray[i], multiLevelArray[j]
-                if type(val) is list:
-                    currentDict[key] = convert(val)
+        with open(key, 'rb') as keyFile:
+            keyData = keyFile.read().rstrip()
+
+        return self.loads(keyData)
+
+    @classmethod
+    def loads(cls, keyData: Union[str, bytes]) -> Any:
+        """
+        Parse serialized data with a cursor in a single, linear pass. The
+        declared lengths of strings (`s:<len>:`) and arrays (`a:<count>:`) let
+        us jump straight to the end of each token, and dictionaries are built
+        as we go, so there's no intermediate list of lists to convert after.
+
+        Nesting is tracked with an explicit stack of frames, each being
+        [dictionary, items left to read, pending key], so deep arrays won't hit
+        the recursion limit.
+        """
+        if isinstance(keyData, str):
+            keyData = keyData.encode()
+
+        integer, double = cls.tokens()
+        length = len(keyData)
+        pos = 0
+        stack = []  # type: List[List]
+
+        def fail(reason: str) -> InvalidArrayFormat:
+            # Show what it's stuck on so we can debug it
+            return InvalidArrayFormat('{} at offset {}: {!r}'.format(
+                reason, pos, keyData[pos:pos + 32]))
+
+        while pos < length:
+            tag = keyData[pos:pos + 2]
+            count = None
+
+            if tag == b'a:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0 or keyData[colon + 1:colon + 2] != b'{':
+                    raise fail('Malformed array')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                count = int(keyData[pos + 2:colon])
+                value = {}  # type: Any
+                pos = colon + 2
+            elif tag == b's:':
+                colon = keyData.find(b':', pos + 2)
+                if colon < 0:
+                    raise fail('Malformed string')
+                if not keyData[pos + 2:colon].isdigit():
+                    raise fail('Malformed length')
+                start = colon + 2
+                end = start + int(keyData[pos + 2:colon])
+                if keyData[colon + 1:start] != b'"' \
+                        or keyData[end:end + 1] != b'"':
+                    raise fail('String length mismatch')
+                value = keyData[start:end].decode('utf-8', 'surrogateescape')
+                pos = end + 1
+            elif tag == b'i:':
+                match = integer.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed integer')
+                value = int(match.group())
+                pos = match.end()
+            elif tag == b'b:':
+                value = keyData[pos + 2:pos + 3]
+                if value not in (b'0', b'1'):
+                    raise fail('Malformed boolean')
+                value = value == b'1'
+                pos += 3
+            elif tag == b'd:':
+                match = double.match(keyData, pos + 2)
+                if not match:
+                    raise fail('Malformed double')
+                value = float(match.group())
+                pos = match.end()
+            elif tag[:1] == b'N':
+                value = None
+                pos += 1
+            else:
+                raise fail('Unexpected token')
+
+            # Semicolons after scalars are optional.
+            if count is None and keyData[pos:pos + 1] == b';':
+                pos += 1
+
+            # Everything comes in 2's: even slots are keys, odd slots values.
+            if stack:
+                frame = stack[-1]
+                if frame[1] % 2:
+                    frame[0][frame[2]] = value
+                elif count is not None:
+                    raise fail('Array used as a key')
                 else:
-                    currentDict[key] = val
+                    frame[2] = value
+                frame[1] -= 1
+            elif count is None:
+                raise fail('Expected an array')
+            else:
+                root = value
+
+            if count is not None:
+                stack.append([value, 2 * count, None])
 
-            return currentDict
+            # Close every array whose declared count has been read.
+            while stack and not stack[-1][1]:
+                if keyData[pos:pos + 1] != b'}':
+                    raise fail('Expected end of array')
+                pos += 1
+                stack.pop()
 
-        return convert(nestLevel()[0])
+            if not stack:
+                if keyData[pos:].strip():
+                    raise fail('Trailing data')
+                return root
+
+        raise fail('Unexpected end of data')
 
     @staticmethod
     def find(nestedDicts: Dict, key: Any) -> Any:
@@ -181,10 +308,13 @@ class ConvertJSON:
                     return value
                 if type(value) is dict:
                     res = traverse(value)
-                    if res:
+                    if res is not missing:
                         return res
+            return missing
 
-        return traverse(nestedDicts)
+        missing = object()
+        res = traverse(nestedDicts)
+        return None if res is missing else res
 
     @staticmethod
     def findAll(nestedDicts: Dict, key: Any, byValue: bool =False) -> List:
@@ -211,246 +341,4106 @@ class ConvertJSON:
         return occurrences
 
 
-class Timeline:
+def _trusted(stat: os.stat_result, path: str) -> bool:
     """
-    Primary class for acquiring data and managing the loop.
+    Whether `path`, as `stat`ed, can only have been written by us: it's owned
+    by our effective user and nobody else can write to it. Warns if not.
     """
-    JSONdecoder = ConvertJSON()
+    if stat.st_uid == os.geteuid() and not stat.st_mode & 0o022:
+        return True
+    _WARN('Not using {}, as it\'s owned by uid {} with mode {:o}; only we '
+          'should be able to write to it'.format(path, stat.st_uid,
+                                                  stat.st_mode & 0o7777))
+    return False
 
-    def __init__(self, arguments: argparse.Namespace) -> None:
-        # Get a master list of ZFS datasets/agents.
-        self.masterAgents = getIO(ZFS_agent_list)
 
-        # Check the requested agents against master list of agents
-        if arguments.agents:
-            arguments.agents = flatten(arguments.agents)
-            for uuid in arguments.agents:
-                if uuid not in self.masterAgents:
-                    _WARN(uuid + ' is not in the dataset, excluding')
-                    arguments.agents.remove(uuid)
-            if not arguments.agents:
-                _WARN('Defaulting to complete dataset')
-                arguments.agents = self.masterAgents
+def _stateDirectory(path: str) -> Optional[str]:
+    """
+    The directory our state at `path` goes in, made private (0700) if it
+    isn't there yet, or None if it's someone else's or anyone else can write
+    to it, as they could then plant state for us to load. Also None, with a
+    warning, if we can't make it (say, we aren't root); the state just isn't
+    kept.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        stat = os.stat(directory)
+    except OSError as error:
+        _WARN('Not saving {}, as {} can\'t be made: {}'.format(
+            path, directory, error))
+        return None
+    return directory if _trusted(stat, directory) else None
+
+
+def _openState(path: str) -> IO:
+    """
+    Open our saved state at `path` to read, if it and its directory are
+    `_trusted`: unpickling something planted there would run whatever it
+    likes, as us. Raises `PermissionError` if they aren't.
+    """
+    directory = os.path.dirname(path) or '.'
+    if not _trusted(os.stat(directory), directory):
+        raise PermissionError('{} isn\'t trusted'.format(directory))
+    stateFile = open(path, 'rb')
+    if not _trusted(os.fstat(stateFile.fileno()), path):
+        stateFile.close()
+        raise PermissionError('{} isn\'t trusted'.format(path))
+    return stateFile
+
+
+class DecodeCache:
+    """
+    Persistent cache of decoded key files, so repeated runs (e.g. from a poll
+    loop) only parse keys that changed since. Entries are keyed by path and
+    validated against the file's (inode, size, mtime) signature, kept in LRU
+    order and capped at `maxEntries`. The lot is pickled to a single file.
+    """
+
+    # Returned by `get` when there's no valid entry.
+    MISS = object()
+
+    # Bumped whenever what keys decode into changes, to drop older entries.
+    VERSION = 3
+
+    def __init__(self, path: Optional[str] = None, maxEntries: int = 4096) \
+            -> None:
+        import pickle
+
+        path = path or DECODE_CACHE
+        self.path = path
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dirty = False
+
+        # path -> (signature, decoded value), least recently used first
+        self.entries = OrderedDict()  # type: OrderedDict
+        try:
+            with _openState(path) as cacheFile:
+                version, entries = pickle.load(cacheFile)
+            if version == self.VERSION and type(entries) is OrderedDict:
+                self.entries = entries
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, ValueError, TypeError):
+            # Missing, unreadable or out of date; start over.
+            pass
+
+    @staticmethod
+    def signature(path: str) -> Optional[Tuple[int, int, int]]:
+        """
+        Stat signature of `path`, or None if it can't be stat'd.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def get(self, path: str, signature: Optional[Tuple[int, int, int]]) \
+            -> Any:
+        """
+        Return the cached value of `path` if it was stored under `signature`,
+        otherwise `MISS`.
+        """
+        entry = self.entries.get(path)
+        if entry is None or signature is None or entry[0] != signature:
+            self.misses += 1
+            return self.MISS
+        self.hits += 1
+        self.entries.move_to_end(path)
+        return entry[1]
+
+    def put(self, path: str, signature: Optional[Tuple[int, int, int]],
+            value: Any) -> None:
+        """
+        Store `value` for `path`, evicting the least recently used entries
+        past `maxEntries`.
+        """
+        if signature is None:
+            return
+        self.entries[path] = (signature, value)
+        self.entries.move_to_end(path)
+        self._dirty = True
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def fetch(self, path: str, decoder: Callable[[str], Any]) -> Any:
+        """
+        Return the cached value of `path`, decoding it with `decoder` first if
+        it's missing or stale. The signature is taken before decoding so a
+        write racing with us just misses next time.
+        """
+        signature = self.signature(path)
+        value = self.get(path, signature)
+        if value is self.MISS:
+            value = decoder(path)
+            self.put(path, signature, value)
+        return value
+
+    def save(self) -> None:
+        """
+        Atomically write the cache back to disk, if anything changed.
+        """
+        import tempfile
+        import pickle
+
+        directory = _stateDirectory(self.path) if self._dirty else None
+        if directory is None:
+            return
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as cacheFile:
+                pickle.dump((self.VERSION, self.entries), cacheFile,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._dirty = False
+
+
+class SnapshotSeries:
+    """
+    An agent's snapshots as two parallel columns, epoch and transfer size,
+    sorted by epoch. Columns are NumPy arrays when NumPy is installed and
+    memoryviews over `array('q')` otherwise; either way that's 16 bytes a
+    snapshot. Prefix sums of sizes are kept alongside, so the total over any
+    window is two binary searches and a subtraction, and slices are views
+    sharing the same buffers.
+    """
+
+    __slots__ = ('epochs', 'sizes', 'cumulative')
+
+    def __init__(self, epochs: Any, sizes: Any, cumulative: Any) -> None:
+        # Use `fromPairs`/`fromColumns`; these must already be consistent.
+        self.epochs = epochs
+        self.sizes = sizes
+        self.cumulative = cumulative
+
+    @classmethod
+    def fromColumns(cls, epochs: Sequence[int], sizes: Sequence[int]) \
+            -> 'SnapshotSeries':
+        """
+        Build a series from parallel sequences already sorted by epoch.
+        """
+        np = numpy(len(epochs))
+        if np is not None:
+            epochs = np.asarray(epochs, dtype=np.int64)
+            sizes = np.asarray(sizes, dtype=np.int64)
+            cumulative = np.zeros(len(sizes) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=cumulative[1:])
         else:
-            arguments.agents = self.masterAgents
+            epochs = memoryview(array('q', epochs))
+            sizes = memoryview(array('q', sizes))
+            cumulative = memoryview(array('q', accumulate(chain((0,), sizes))))
+        return cls(epochs, sizes, cumulative)
 
-        self.agents = arguments.agents
-        self.agent_identifiers = list(map(basename, arguments.agents))
+    @classmethod
+    def fromPairs(cls, pairs: Iterable[Tuple[int, int]]) -> 'SnapshotSeries':
+        """
+        Build a series from (epoch, size) pairs in any order.
+        """
+        pairs = sorted(pairs)
+        return cls.fromColumns([epochInt for epochInt, _ in pairs],
+                               [size for _, size in pairs])
 
-        # Grab data about snapshots and retention policies.
-        self.snaps = list(map(self.getSnapshots, self.agents))
-        self._checkSnaps()
+    @classmethod
+    def fromDict(cls, snapshots: Dict[int, int]) -> 'SnapshotSeries':
+        """
+        Build a series from a dictionary of epoch -> size, like those
+        `getAllSnapshots` returns.
+        """
+        return cls.fromPairs(snapshots.items())
 
-        # Grab retention policies.
-        self.local_ret_policies = list(map(
-            self.decodeRetention,
-            self.agent_identifiers
-        ))
-        self.offsite_ret_policies = list(map(
-            partial(self.decodeRetention, offsite=True),
-            self.agent_identifiers
-        ))
+    @classmethod
+    def fromBytes(cls, epochs: bytes, sizes: bytes) -> 'SnapshotSeries':
+        """
+        Rebuild a series from what `toBytes` gave.
+        """
+        np = numpy(len(epochs) // 8)
+        if np is not None:
+            return cls.fromColumns(np.frombuffer(epochs, dtype=np.int64),
+                                   np.frombuffer(sizes, dtype=np.int64))
+        return cls.fromColumns(array('q', epochs), array('q', sizes))
 
-        # Decode schedules and store them in a list.
-        self.schedules = self._acquireSchedules()
+    def toBytes(self) -> Tuple[bytes, bytes]:
+        """
+        The epoch and size columns' raw (native int64) bytes.
+        """
+        return self.epochs.tobytes(), self.sizes.tobytes()
 
-        # Map these schedules to a function that'll find all the hours we're
-        # taking backups. This is the same as
-        # cat /datto/config/keys/*.schedule | grep -oP "[0-9]+(?=;s:1:\"0\")"
-        self.backupHours = list(map(
-            partial(self.JSONdecoder.findAll, key='0', byValue=True),
-            self.schedules
-        ))
+    def updated(self, sizes: Dict[int, int],
+                deleted: Iterable[int] = ()) -> 'SnapshotSeries':
+        """
+        A copy with the snapshots taken at `deleted` epochs dropped, and
+        those in `sizes` (epoch -> size) added, or resized if already here.
+        With NumPy, what's kept is masked out in one pass rather than
+        rebuilt a snapshot at a time.
+        """
+        drop = set(deleted) | set(sizes)
+        if not drop:
+            return self
+        if isinstance(self.epochs, memoryview):
+            return self.fromPairs(chain(
+                ((epochInt, size) for epochInt, size in self
+                 if epochInt not in drop), sizes.items()))
 
-        # Collect intervals of backups.
-        self.intervals = self._acquireIntervals()
+        np = numpy()
+        keep = ~np.isin(self.epochs, np.fromiter(drop, np.int64, len(drop)))
+        epochs = np.concatenate((self.epochs[keep], np.fromiter(
+            sizes.keys(), np.int64, len(sizes))))
+        sizes = np.concatenate((self.sizes[keep], np.fromiter(
+            sizes.values(), np.int64, len(sizes))))
+        order = np.argsort(epochs, kind='stable')
+        return self.fromColumns(epochs[order], sizes[order])
 
-        # Ensure offsite sync isn't paused locally.
-        self.checkGlobalOptions()
-        self.checkAllAgentOptions()
+    def __reduce__(self) -> Tuple:
+        return self.fromColumns, (self.epochs.tolist(), self.sizes.tolist())
 
+    def __len__(self) -> int:
+        return len(self.epochs)
 
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.epochs.tolist(), self.sizes.tolist())
 
-        # Now we've collected the following information:
-        #   . Interval of backups
-        #   . Local and offsite backup schedules (list of each hour)
-        #   . A list of agents to work with that are
-        #       . not paused,
-        #       . exist,
-        #       . and have snapshots.
-        #   . Current offsite bandwidth and throttling.
+    def __getitem__(self, item: Union[int, slice]) \
+            -> Union[Tuple[int, int], 'SnapshotSeries']:
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                raise ValueError('SnapshotSeries slices must be contiguous')
+            stop = max(start, stop)
+            return SnapshotSeries(self.epochs[start:stop],
+                                  self.sizes[start:stop],
+                                  self.cumulative[start:stop + 1])
+        return int(self.epochs[item]), int(self.sizes[item])
 
-    def _checkSnaps(self) -> None:
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, SnapshotSeries):
+            return NotImplemented
+        return self.epochs.tolist() == other.epochs.tolist() \
+            and self.sizes.tolist() == other.sizes.tolist()
+
+    def __repr__(self) -> str:
+        return 'SnapshotSeries({} snapshots)'.format(len(self))
+
+    def bounds(self, start: Optional[int] = None,
+               end: Optional[int] = None) -> Tuple[int, int]:
         """
-        Exclude agents that don't have snapshots.
+        Indices delimiting the snapshots taken in [start, end).
         """
-        for agent, snap in zip(self.agents, self.snaps):
-            if not len(snap):
-                _WARN(agent + ' has no snapshots, excluding')
-                self.agent_identifiers.remove(agent)
+        i = 0 if start is None else self._search(start)
+        j = len(self) if end is None else self._search(end)
+        return i, max(i, j)
+
+    def _search(self, epochInt: int) -> int:
+        if isinstance(self.epochs, memoryview):
+            return bisect_left(self.epochs, epochInt)
+        return int(self.epochs.searchsorted(epochInt))
 
-    def _acquireSchedules(self) -> List[Dict[int, int]]:
+    def between(self, start: Optional[int] = None,
+                end: Optional[int] = None) -> 'SnapshotSeries':
         """
-        Get a list of schedules, which are dictionaries of Hour -> True/False.
+        The snapshots taken in [start, end), as a view.
         """
-        schedules = []
-        for agent in self.agent_identifiers:
-            self.schedules.append(
-                self.JSONdecoder.decode(KEYS + agent + LOCAL_SCHEDULE)
-            )
-        return schedules
+        i, j = self.bounds(start, end)
+        return self[i:j]
 
-    def _acquireIntervals(self) -> List[int]:
+    def total(self, start: Optional[int] = None,
+              end: Optional[int] = None) -> int:
         """
-        Get a list of intervals over which backups are taken during hours
-        backups are acquired.
+        Sum of the sizes of snapshots taken in [start, end).
         """
-        intervals = []
-        for agent in self.agent_identifiers:
-            intervalPath = KEYS + agent + BACKUP_INTERVAL
-            with open(intervalPath, 'r') as intervalFile:
-                intervals.append(int(intervalFile.readline().rstrip()))
-        return intervals
+        i, j = self.bounds(start, end)
+        return int(self.cumulative[j] - self.cumulative[i])
 
-    def checkGlobalOptions(self) -> None:
+    def totalsBefore(self, epochs: Sequence[int]) -> Sequence[int]:
         """
-        If `speedsync options` are paused, raise an exception.
+        For each of (sorted) `epochs`, the summed size of every snapshot taken
+        before it. With NumPy this is a single vectorized search.
         """
-        with open(SPEEDSYNC_OPTIONS, 'r') as global_options:
-            options = json.loads(global_options.readline().rstrip())
-            if options['pauseZfs'] or options['pauseTransfer']:
-                raise PausedTransfers('Sync options are paused')
+        offset = self.cumulative[0]
+        if isinstance(self.epochs, memoryview):
+            return [self.cumulative[bisect_left(self.epochs, epochInt)] - offset
+                    for epochInt in epochs]
+        return self.cumulative[self.epochs.searchsorted(epochs)] - offset
 
-    def checkAgentOptions(self, agentBasename: str) -> bool:
+    def toDict(self) -> Dict[int, int]:
+        return dict(self)
+
+
+class SnapshotState:
+    """
+    Every agent's snapshots as of the last run, persisted as the raw bytes
+    of their `SnapshotSeries` columns, so the next run only has to size the
+    snapshots made since. Each agent's watermark is its newest epoch here.
+    See `getAllSnapshotsIncremental`. An agent's series is only built from
+    its bytes when it's asked for.
+    """
+
+    # Bumped whenever the format changes, to drop older state.
+    VERSION = 1
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        import pickle
+
+        self.path = path or SNAPSHOT_STATE
+        self.series = {}  # type: Dict[str, SnapshotSeries]
+        # agent -> (epochs, sizes) bytes, of those not in `series` yet
+        self.columns = {}  # type: Dict[str, Tuple[bytes, bytes]]
+        self._dirty = False
+        try:
+            with _openState(self.path) as stateFile:
+                version, columns = pickle.load(stateFile)
+            if version == self.VERSION:
+                self.columns = dict(columns)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, ValueError, TypeError):
+            # Missing, unreadable or out of date; start over.
+            pass
+
+    def __contains__(self, agent: str) -> bool:
+        return agent in self.series or agent in self.columns
+
+    def __getitem__(self, agent: str) -> SnapshotSeries:
+        if agent not in self.series:
+            self.series[agent] = SnapshotSeries.fromBytes(
+                *self.columns.pop(agent))
+        return self.series[agent]
+
+    def __setitem__(self, agent: str, series: SnapshotSeries) -> None:
+        if self.series.get(agent) is not series:
+            self.columns.pop(agent, None)
+            self.series[agent] = series
+            self._dirty = True
+
+    def watermark(self, agent: str) -> Optional[int]:
         """
-        Check a single agent's sync options.
+        The newest epoch we've seen of `agent`, if any.
         """
-        # Check a single agent
-        file = glob(SPEEDSYNC_OPTIONS_AGENT.format(agentBasename))[0]
-        with open(file, 'r') as options:
-            options = json.loads(options.readline().rstrip())
-            return options['pauseZfs'] or options['pauseTransfer']
+        if agent not in self:
+            return None
+        series = self[agent]
+        return int(series.epochs[-1]) if len(series) else None
 
-    def checkAllAgentOptions(self) -> None:
+    def save(self) -> None:
         """
-        Check all agents' sync options.
+        Atomically write the state back to disk, if anything changed.
         """
-        for agent in self.agent_identifiers:
-            file = glob(SPEEDSYNC_OPTIONS_AGENT.format(agent))[0]
-            with open(file, 'r') as options:
-                # Valid Python dictionary format (immutable : value)
-                options = json.loads(options.readline().rstrip())
-                if options['pauseZfs'] or options['pauseTransfer']:
-                    _WARN(agent + ' is paused, excluding')
-                    self.agent_identifiers.remove(agent)
+        import tempfile
+        import pickle
 
-        # If global check has not been run, we'll check just in case
-        if not self.agent_identifiers:
-            raise PausedTransfers('Agents are all individually paused')
+        directory = _stateDirectory(self.path) if self._dirty else None
+        if directory is None:
+            return
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as stateFile:
+                columns = dict(self.columns)
+                columns.update((agent, series.toBytes())
+                               for agent, series in self.series.items())
+                pickle.dump((self.VERSION, columns), stateFile,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._dirty = False
 
-    def run(self) -> str:
+
+class ThroughputEstimator:
+    """
+    Exponentially weighted moving average of offsite throughput (bytes/s),
+    optionally with a Holt trend, updated in O(1) per window of the link's
+    observed throughput (see `linkThroughput`).
+
+    Observations are irregularly spaced, so rather than a fixed smoothing
+    factor each one is weighted by how much time has passed since the last:
+    older estimates lose half their weight every `halfLife` seconds. State,
+    including how far into each agent's history we've read, is saved between
+    runs so history is only ever read once.
+    """
+
+    # Bumped whenever what's observed changes, to drop older state.
+    VERSION = 2
+
+    def __init__(self, halfLife: float = 24 * 3600, holt: bool = False) \
+            -> None:
+        self.halfLife = halfLife
+        self.holt = holt
+        self.level = None  # type: Optional[float]
+        self.trend = 0.0
+        self.updated = None  # type: Optional[int]
+        # agent -> source -> last epoch consumed
+        self.watermarks = {}  # type: Dict[str, Dict[str, int]]
+
+    @classmethod
+    def load(cls, path: str, halfLife: float = 24 * 3600,
+             holt: bool = False) -> 'ThroughputEstimator':
         """
-        Run the hourly loop and make the determination as to when
+        Restore saved state from `path`, or start fresh.
         """
+        import json
 
-    @staticmethod
-    def decodeRetention(agent: str, offsite: bool = False) -> List[int]:
+        estimator = cls(halfLife, holt)
+        try:
+            with open(path, 'r') as stateFile:
+                state = json.load(stateFile)
+            if state['version'] != cls.VERSION:
+                return estimator
+            estimator.level = state['level']
+            estimator.trend = state['trend']
+            estimator.updated = state['updated']
+            estimator.watermarks = state['watermarks']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return estimator
+
+    def save(self, path: str) -> None:
         """
-        Read the retention policy for an agent from file.
+        Atomically write state to `path`.
         """
-        # There's offsite and local retention policies on our appliances.
-        with open(KEYS + agent + (OFFSITE_RETENTION if offsite
-        else LOCAL_RETENTION)) as cryptic_policy:
-            policy = cryptic_policy.readline().split(':')
+        import tempfile
+        import json
+
+        directory = _stateDirectory(path)
+        if directory is None:
+            return
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as stateFile:
+                json.dump({'version': self.VERSION,
+                           'level': self.level, 'trend': self.trend,
+                           'updated': self.updated,
+                           'watermarks': self.watermarks}, stateFile)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
 
-        # Now let's decode what's _really_ going to happen to this data.
-        # everything is dependent upon the last number in the 4-tuple.
-        intra, daily, weekly, total = policy
+    def update(self, timestamp: int, size: float, seconds: float) -> None:
+        """
+        Fold in `size` bytes sent over `seconds`, finishing at `timestamp`.
+        """
+        if seconds <= 0:
+            return
+        rate = size / seconds
 
-        # intra: 1d - 31d
-        # daily: 1w - 26w
-        # weekly: 1m - 24m, or up to ~27 years (maxes out at 240000hrs)
-        # total: 1w - 7y, or up to ~27 years, again
+        if self.level is None:
+            self.level, self.updated = rate, timestamp
+            return
 
-        return [intra, daily, weekly, total]
+        elapsed = max(0, timestamp - self.updated)
+        alpha = 1 - 0.5 ** (elapsed / self.halfLife) if elapsed else \
+            1 - 0.5 ** (seconds / self.halfLife)
 
-    @staticmethod
-    def getSnapshots(agent: str) -> Dict[int, str]:
+        if self.holt:
+            forecast = self.level + self.trend * elapsed
+            level = forecast + alpha * (rate - forecast)
+            if elapsed:
+                self.trend += alpha * ((level - self.level) / elapsed
+                                       - self.trend)
+            self.level = level
+        else:
+            self.level += alpha * (rate - self.level)
+        self.updated = max(self.updated, timestamp)
+
+    def estimate(self, at: Optional[int] = None) -> Optional[float]:
         """
-        Get a list of snapshots from a particular agent.
+        Expected throughput in bytes/s (at epoch `at`, if following a trend).
+        """
+        if self.level is None:
+            return None
+        if self.holt and at is not None:
+            return max(0.0, self.level + self.trend * (at - self.updated))
+        return max(0.0, self.level)
+
+    def observe(self, histories: Iterable[Tuple[str, 'AgentKeys',
+                                                'SnapshotSeries']]) -> int:
         """
-        snapshots = getIO(ZFS_list_snapshots + ' ' + agent)[:-1]
+        Fold in whatever of every agent's history (agent, keys, snapshots)
+        is new since last time, as the link's throughput across all of them
+        window by window, oldest first. Windows no later than the last one
+        folded in are dropped, so the result doesn't depend on the order
+        agents' histories come in. Returns the number of windows used.
+        """
+        windows = [window for window in linkThroughput(
+            transferObservations(keys, snaps,
+                                 self.watermarks.setdefault(agent, {}))
+            for agent, keys, snaps in histories
+        ) if self.updated is None or window[0] > self.updated]
+        for window in windows:
+            self.update(*window)
+        return len(windows)
+
 
-        for i, snapshot in enumerate(snapshots):
-            snapshots[i] = re.split(spaces, snapshot)
+def transferObservations(keys: 'AgentKeys', snaps: 'SnapshotSeries',
+                         marks: Optional[Dict[str, int]] = None) \
+        -> Dict[str, List[Tuple[int, int, int]]]:
+    """
+    An agent's offsite transfers by source, as (epoch, bytes, seconds)
+    finishing at `epoch`, in order: each `.transfers` record over the gap
+    since the one before it ('transfers'), and the snapshotted bytes between
+    consecutive offsite points ('points'). Only what's past `marks` (source
+    -> last epoch consumed) is returned, and `marks` is moved on.
+    """
+    marks = {} if marks is None else marks
+    observations = OrderedDict((source, []) for source in
+                               ('transfers', 'points'))  # type: Dict
 
-            # Pull out relevant data for readability
-            epochInt = int(re.search(epoch, snapshot).group())
-            compressRatio = float(snapshots[i][2][:-1])
-            epochSize = int(snapshots[i][1])
+    last = marks.get('transfers')
+    for epochInt in sorted(keys.transfers or ()):
+        if last is not None and epochInt <= last:
+            continue
+        if last is not None and epochInt - last <= MAX_TRANSFER_GAP:
+            observations['transfers'].append(
+                (epochInt, keys.transfers[epochInt], epochInt - last))
+        last = epochInt
+    if last is not None:
+        marks['transfers'] = last
 
-            # Reorganize this list as [epoch, transfer size]
-            snapshots[i] = [epochInt, int(epochSize * compressRatio)]
+    last = marks.get('points')
+    for point in keys.offSitePoints or ():
+        if last is not None and point <= last:
+            continue
+        if last is not None and point - last <= MAX_TRANSFER_GAP:
+            observations['points'].append(
+                (point, snaps.total(last + 1, point + 1), point - last))
+        last = point
+    if last is not None:
+        marks['points'] = last
 
-        return dict(snapshots)
+    return observations
 
 
-def getIO(command: str) -> List[str]:
+def linkThroughput(agents: Iterable[Dict[str, List[Tuple[int, int, int]]]],
+                   window: int = TRANSFER_WINDOW) \
+        -> List[Tuple[int, int, float]]:
     """
-    Get results from terminal commands as lists of lines of text.
+    The offsite link's throughput, from every agent's `transferObservations`
+    at once, as (epoch, bytes, seconds) per `window` seconds it was busy in,
+    oldest first: the bytes in flight across agents in the window, over the
+    seconds anything was.
+
+    Each source's observations are merged across agents in time order, and
+    each one's bytes spread evenly back to when the one before it finished,
+    from whichever agent (or its own gap, if that's shorter). So one agent's
+    idle time between its transfers isn't taken for transfer time, and its
+    share of the link isn't taken for the whole of it. Both sources count
+    the same bytes sent, so each window takes whichever saw more.
     """
-    with Popen(command, shell=True) as proc:
-        stdout, stderr = proc.communicate()
+    merged = {}  # type: Dict[str, List[Tuple[int, int, int]]]
+    for observations in agents:
+        for source, observed in observations.items():
+            merged.setdefault(source, []).extend(observed)
 
-    if stderr:
-        raise ValueError('Command exited with errors: {}'.format(stderr))
+    # window index -> (bytes, busy seconds), of whichever source saw more
+    windows = {}  # type: Dict[int, Tuple[float, float]]
+    for observed in merged.values():
+        observed.sort()
+        events = []  # type: List[Tuple[int, float]]
+        finished = None
+        for end, size, seconds in observed:
+            if finished is not None and finished < end:
+                seconds = min(seconds, end - finished)
+            if size > 0 and seconds > 0:
+                events.append((end - seconds, size / seconds))
+                events.append((end, -size / seconds))
+            if finished is None or finished < end:
+                finished = end
+        events.sort()
 
-    # Further processing
-    if stdout:
-        stdout = re.split(newlines, stdout.decode())
+        totals = {}  # type: Dict[int, List[float]]
+        rate = 0.0
+        for (moment, change), (following, _) in zip(events, events[1:]):
+            rate += change
+            while moment < following and rate * (following - moment) \
+                    > _EPSILON:
+                index = moment // window
+                until = min(following, (index + 1) * window)
+                total = totals.setdefault(index, [0.0, 0.0])
+                total[0] += rate * (until - moment)
+                total[1] += until - moment
+                moment = until
 
-    return stdout
+        for index, (size, seconds) in totals.items():
+            if index not in windows or size > windows[index][0]:
+                windows[index] = (size, seconds)
 
+    return [((index + 1) * window, int(size), seconds)
+            for index, (size, seconds) in sorted(windows.items())]
 
-def flatten(inList: List[List]) -> List:
+
+class RetentionPruner:
     """
-    Similar to Haskell's `concat :: [[a]] -> [a]`.
+    A ledger of an agent's snapshots pending offsite, tracked against its
+    retention policies so those culled before they're sent drop out of the
+    backlog: a culled point is never sent. The ledger is the agent's backlog
+    (see `backlog`); backups made later aren't in it, so retention can't cull
+    them.
+
+    A retention policy is [intra, daily, weekly, total] hours: every snapshot
+    is kept for `intra` hours, then only the last of each day until `daily`,
+    the last of each week until `weekly`, and the last of each month until
+    `total`. From that, each pending snapshot's cull time is worked out once
+    up front (the sooner of the local and offsite policies) and kept in a
+    heap, so each simulated hour only pops the k snapshots culled in it, for
+    O(k log n). Snapshots are sent oldest first; one partially sent is in
+    flight and no longer culled.
+
+    `pending` is a contiguous run of `history`, as `SnapshotSeries.between`
+    gives, of which `sent` bytes have been sent already (oldest first, as
+    `pendingBacklog` takes them off).
     """
-    flatList = []
-    for subList in inList:
-        for string in subList:
-            flatList.append(string)
-    return flatList
 
+    def __init__(self, pending: 'SnapshotSeries', history: 'SnapshotSeries',
+                 policies: List[Optional[List[int]]], sent: float = 0.0) \
+            -> None:
+        self.queue = deque()  # type: deque
+        self.unsent = {}      # type: Dict[int, float]
+        self.culls = []       # type: List[Tuple[int, int]]
+        self.inFlight = None  # type: Optional[int]
+        # epoch -> bytes of the ledger ahead of it, less `sent`
+        self.ahead = {}       # type: Dict[int, float]
+        policies = [policy for policy in policies if policy]
 
-class InvalidArrayFormat(SyntaxError):
+        # The snapshot after each decides which buckets it's the last of.
+        epochs = pending.epochs.tolist()
+        following = epochs[1:]  # type: List[Optional[int]]
+        if epochs:
+            index = history.bounds(epochs[-1] + 1)[0]
+            following.append(history[index][0] if index < len(history)
+                             else None)
+
+        ahead = -float(sent)
+        for epochInt, size, after in zip(epochs, pending.sizes.tolist(),
+                                         following):
+            if size <= 0:
+                continue
+            self.queue.append(epochInt)
+            self.unsent[epochInt] = float(size)
+            self.ahead[epochInt] = ahead
+            ahead += size
+            if policies:
+                self.culls.append((min(self.cullTime(epochInt, after, policy)
+                                       for policy in policies), epochInt))
+
+        heapq.heapify(self.culls)
+        self.send(sent)
+
+    @staticmethod
+    def cullTime(epochInt: int, following: Optional[int],
+                 policy: List[int]) -> int:
+        """
+        When `policy` culls the snapshot at `epochInt`, given the epoch of the
+        snapshot taken after it (if any).
+        """
+        intra, daily, weekly, total = [hours * 3600 for hours in policy]
+        for age, bucket in ((intra, _day), (daily, _week), (weekly, _month)):
+            if age >= total:
+                break
+            if following is not None and bucket(following) == bucket(epochInt):
+                return epochInt + age
+        return epochInt + total
+
+    @property
+    def done(self) -> bool:
+        return not self.unsent
+
+    @property
+    def backlog(self) -> float:
+        """
+        Bytes still to send of the snapshots in the ledger.
+        """
+        return sum(self.unsent.values())
+
+    def copy(self) -> 'RetentionPruner':
+        """
+        A copy to simulate with, leaving this one as it is.
+        """
+        pruner = copy.copy(self)
+        pruner.queue = deque(self.queue)
+        pruner.unsent = dict(self.unsent)
+        pruner.culls = list(self.culls)
+        return pruner
+
+    def schedule(self, startEpoch: int) -> List[Tuple[int, int, float, float]]:
+        """
+        Every snapshot that could yet be culled, as (hour from `startEpoch`
+        it's culled in, position in the ledger, bytes, bytes of the ledger
+        ahead of it), in the order `cull` takes them. Whether each is culled
+        depends only on whether sending has reached it by then, so this can
+        be worked out once for any number of simulations.
+        """
+        position = dict((epochInt, index)
+                        for index, epochInt in enumerate(self.queue))
+        return [(max(0, -(-(when - startEpoch) // 3600)), position[epochInt],
+                 self.unsent[epochInt], self.ahead[epochInt])
+                for when, epochInt in sorted(self.culls)
+                if epochInt in self.unsent and epochInt != self.inFlight]
+
+    def cull(self, until: int) -> float:
+        """
+        Drop every unsent snapshot retention culls by epoch `until`, returning
+        how many bytes that takes off the backlog.
+        """
+        culled = 0.0
+        while self.culls and self.culls[0][0] <= until:
+            _, epochInt = heapq.heappop(self.culls)
+            if epochInt in self.unsent and epochInt != self.inFlight:
+                culled += self.unsent.pop(epochInt)
+        return culled
+
+    def send(self, size: float) -> None:
+        """
+        Mark `size` bytes sent, oldest snapshots first.
+        """
+        while size > 0 and self.queue:
+            epochInt = self.queue[0]
+            if epochInt not in self.unsent:
+                self.queue.popleft()
+                continue
+            sent = min(size, self.unsent[epochInt])
+            size -= sent
+            self.unsent[epochInt] -= sent
+            self.inFlight = epochInt
+            if self.unsent[epochInt] <= _EPSILON:
+                del self.unsent[epochInt]
+                self.queue.popleft()
+
+
+class ScheduleMasks:
     """
-    Raised when the input "compressed" JSON format is invalid.
+    Agents' weekly schedules as 168-bit masks, with bit `hourOfWeek` set in
+    hours the schedule's on (see `scheduleMask`). With NumPy they're also
+    packed into an agents x 21 byte array, so set algebra and counts across
+    every agent are single reductions over it.
     """
 
+    BYTES = HOURS_PER_WEEK // 8
+    FULL = (1 << HOURS_PER_WEEK) - 1
 
-class PausedTransfers(Exception):
+    def __init__(self, masks: Sequence[Optional[int]]) -> None:
+        # Having no schedule means every hour, like `weeklyHours`.
+        self.masks = [self.FULL if mask is None else mask for mask in masks]
+        np = numpy(len(self.masks) * HOURS_PER_WEEK)
+        self.packed = None if np is None else np.frombuffer(
+            b''.join(mask.to_bytes(self.BYTES, 'little')
+                     for mask in self.masks), dtype=np.uint8
+        ).reshape(len(self.masks), self.BYTES)
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def __getitem__(self, agent: int) -> int:
+        return self.masks[agent]
+
+    def __and__(self, other: 'ScheduleMasks') -> 'ScheduleMasks':
+        """
+        Each agent's hours in both its schedules.
+        """
+        return ScheduleMasks([mine & theirs for mine, theirs
+                              in zip(self.masks, other.masks)])
+
+    def __or__(self, other: 'ScheduleMasks') -> 'ScheduleMasks':
+        """
+        Each agent's hours in either of its schedules.
+        """
+        return ScheduleMasks([mine | theirs for mine, theirs
+                              in zip(self.masks, other.masks)])
+
+    def union(self) -> int:
+        """
+        Hours any agent's schedule is on.
+        """
+        if self.packed is None:
+            return reduce(operator.or_, self.masks, 0)
+        return int.from_bytes(
+            numpy().bitwise_or.reduce(self.packed, axis=0).tobytes(), 'little')
+
+    def intersection(self) -> int:
+        """
+        Hours every agent's schedule is on.
+        """
+        if self.packed is None or not len(self.masks):
+            return reduce(operator.and_, self.masks, self.FULL)
+        return int.from_bytes(
+            numpy().bitwise_and.reduce(self.packed, axis=0).tobytes(),
+            'little')
+
+    def popcount(self) -> List[int]:
+        """
+        Hours a week each agent's schedule is on.
+        """
+        if self.packed is None:
+            return [bin(mask).count('1') for mask in self.masks]
+        return self.flags().sum(axis=1).tolist()
+
+    def histogram(self) -> List[int]:
+        """
+        Number of agents whose schedules are on in each hour of the week.
+        """
+        if self.packed is None:
+            return [sum(mask >> hour & 1 for mask in self.masks)
+                    for hour in range(HOURS_PER_WEEK)]
+        return self.flags().sum(axis=0).tolist()
+
+    def flags(self) -> Any:
+        """
+        Agents x `HOURS_PER_WEEK` flags, as `weeklyHours` gives for each
+        schedule; a bool array with NumPy, lists of bools without.
+        """
+        if self.packed is None:
+            return [[bool(mask >> hour & 1) for hour in range(HOURS_PER_WEEK)]
+                    for mask in self.masks]
+        np = numpy()
+        return np.unpackbits(self.packed, axis=1, bitorder='little') \
+            .astype(bool)
+
+    @staticmethod
+    def hours(mask: int) -> List[int]:
+        """
+        The hours of the week set in `mask`.
+        """
+        return [hour for hour in range(HOURS_PER_WEEK) if mask >> hour & 1]
+
+
+class Timeline:
     """
-    Raised when Speedsync options are paused.
+    Primary class for acquiring data and managing the loop.
     """
+    JSONdecoder = ConvertJSON()
 
+    def __init__(self, arguments: 'argparse.Namespace') -> None:
+        # Get a master list of ZFS datasets/agents (just those asked about,
+        # if they all exist).
+        with STATS.phase('list agents'):
+            self.masterAgents = listAgents(flatten(arguments.agents or []),
+                                           arguments.zfs_timeout)
+        self._selectAgents(arguments)
 
-def main(args: argparse.Namespace) -> None:
-    time = Timeline(args)
-    sys.stdout.write(time.run())
+        # Grab data about snapshots and retention policies.
+        with STATS.phase('list snapshots'):
+            allSnaps = self._listSnapshots(self.agents, self._parents())
 
+        # Decode every agent's key files in one batch, reusing whatever
+        # hasn't changed since the last run.
+        with STATS.phase('decode keys'):
+            keys = loadAgentKeys(list(map(basename, self.agents)),
+                                 arguments.processes, self.cache)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(
-        description='Estimate the amount of time it\'s going to take to '
-                    'complete offsite sync.'
-    )
+        self._assemble(allSnaps, keys)
 
-    # It's okay to list arguments following `-a`, or use multiple `-a`'s.
-    # They'll be `flattened` into the same list anyway.
-    parser.add_argument('-a', '--agents', type=str, action='append', 
-        nargs='+', help='Specific agents to test offsite sync.'
-    )
+    @classmethod
+    async def create(cls, arguments: 'argparse.Namespace',
+                     concurrency: int = 16) -> 'Timeline':
+        """
+        Build a `Timeline` like the constructor does, but with the `zfs`
+        calls run as asyncio subprocesses and every agent's key files read
+        concurrently with them, at most `concurrency` at a time. Startup then
+        takes about as long as the slowest of those, not all of them end to
+        end.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import asyncio
+
+        self = cls.__new__(cls)
+        limit = asyncio.Semaphore(concurrency)
+
+        with STATS.phase('list agents'):
+            self.masterAgents = await listAgentsAsync(
+                flatten(arguments.agents or []), limit, arguments.zfs_timeout)
+        self._selectAgents(arguments)
+
+        # Listing snapshots and decoding keys overlap, so they're timed as one.
+        with STATS.phase('list snapshots and decode keys'), \
+                ThreadPoolExecutor(max_workers=concurrency) as readers:
+            if self.snapshotState is None:
+                snapshots = getAllSnapshotsAsync(self.agents, self._parents(),
+                                                 limit, self.timeout)
+            else:
+                # Incremental listing makes a few calls in turn; keep it to
+                # one of the readers.
+                snapshots = _runningLoop().run_in_executor(
+                    readers, self._listSnapshots, self.agents,
+                    self._parents())
+            allSnaps, keys = await asyncio.gather(
+                snapshots,
+                loadAgentKeysAsync(list(map(basename, self.agents)), limit,
+                                   readers, self.cache)
+            )
+
+        self._assemble(allSnaps, keys)
+        return self
 
+    @classmethod
+    def fromExport(cls, path: str, arguments: 'argparse.Namespace') \
+            -> 'Timeline':
+        """
+        Build a `Timeline` from what `exportTimeline` wrote to `path`, without
+        touching ZFS, keys, sync options or any state, to simulate offline.
+        Snapshot columns are views of the memory-mapped export. Agents are
+        estimated as they were when exported, at the bandwidth they were
+        (unless `arguments.bandwidth`), from the time they were exported.
+        """
+        self = cls.__new__(cls)
+        tables = loadExport(path)
+        meta, agents = tables['meta'], tables['agents']
+
+        self.masterAgents = [str(dataset) for dataset in agents['dataset']]
+        selected = set(flatten(arguments.agents or [])) & \
+            set(self.masterAgents)
+        for uuid in set(flatten(arguments.agents or [])) - selected:
+            _WARN(uuid + ' is not in the export, excluding')
+        self.agents = [dataset for dataset in self.masterAgents
+                       if not selected or dataset in selected]
+        self.arguments = arguments
+        self.now = datetime.datetime.fromtimestamp(float(meta['now'][0]))
+        self.cache = self.snapshotState = None
+        self.throughput = ThroughputEstimator(
+            arguments.half_life * 3600, arguments.holt)
+        self.horizon = arguments.horizon
+
+        index = dict((dataset, position)
+                     for position, dataset in enumerate(self.masterAgents))
+        snapshots = _splitRows(tables['snapshots'], len(self.masterAgents))
+        self.snaps = [SnapshotSeries.fromColumns(
+            snapshots[index[dataset]]['epoch'],
+            snapshots[index[dataset]]['size']) for dataset in self.agents]
+        self.details = dict(
+            (dataset, (snapshots[index[dataset]]['written'],
+                       snapshots[index[dataset]]['compressratio']))
+            for dataset in self.agents)
+
+        self.keys = importKeys(tables)
+        estimated = agents['estimated']
+        self.agent_identifiers = [basename(dataset)
+                                  for dataset in self.agents
+                                  if estimated[index[dataset]]]
+        self._derive()
+
+        limit = float(meta['speedLimit'][0]) if 'speedLimit' in meta \
+            else math.nan
+        self.speedLimit = None if math.isnan(limit) else limit
+        if arguments.bandwidth:
+            self.bandwidth = self._acquireBandwidth(arguments)
+        else:
+            bandwidth = float(meta['bandwidth'][0])
+            self.bandwidth = None if math.isnan(bandwidth) else bandwidth
+        return self
+
+    def _selectAgents(self, arguments: 'argparse.Namespace') -> None:
+        """
+        Check the requested agents against `masterAgents` and set up what
+        doesn't depend on any agent's data.
+        """
+        self.requested = flatten(arguments.agents or [])
+        arguments.agents = self._pickAgents()
+
+        self.agents = arguments.agents
+        self.arguments = arguments
+        self.timeout = arguments.zfs_timeout
+        self.now = NOW
+        self.details = None
+        self.speedLimit = None  # type: Optional[float]
+
+        self.cache = DecodeCache(maxEntries=arguments.cache_size) \
+            if arguments.cache else None
+        self.snapshotState = SnapshotState() if arguments.incremental \
+            else None
+        self.JSONdecoder = ConvertJSON(self.cache)
+        self.throughput = ThroughputEstimator.load(
+            THROUGHPUT_STATE, arguments.half_life * 3600, arguments.holt)
+        self.horizon = arguments.horizon
+
+    def _parents(self) -> Optional[List[str]]:
+        """
+        Listing the parents of the whole dataset at once saves naming every
+        agent to `zfs`.
+        """
+        if self.agents is not self.masterAgents:
+            return None
+        return sorted(set(map(os.path.dirname, self.agents)))
+
+    def _listSnapshots(self, agents: List[str],
+                       parents: Optional[List[str]] = None) \
+            -> Dict[str, Union[Dict[int, int], SnapshotSeries]]:
+        """
+        Snapshots of `agents`, incrementally if we're keeping a
+        `snapshotState`.
+        """
+        if self.snapshotState is None:
+            return getAllSnapshots(agents, parents, self.timeout)
+        return getAllSnapshotsIncremental(agents, self.snapshotState, parents,
+                                          self.timeout)
+
+    def _assemble(self, allSnaps: Dict[str, Union[Dict[int, int],
+                                                  SnapshotSeries]],
+                  keys: Dict[str, 'AgentKeys']) -> None:
+        """
+        Take in every agent's snapshots and keys, however they were gathered.
+        """
+        with STATS.phase('index snapshots'):
+            self.snaps = [asSeries(allSnaps[agent]) for agent in self.agents]
+        self.keys = keys
+        self._count(self.agents)
+        self._saveState()
+        self._collect()
+
+    def _saveState(self) -> None:
+        """
+        Persist what we've cached for next time.
+        """
+        with STATS.phase('save cache'):
+            if self.cache is not None:
+                self.cache.save()
+            if self.snapshotState is not None:
+                self.snapshotState.save()
+
+    def _count(self, agents: List[str]) -> None:
+        """
+        Add what was just read for `agents` to their counters.
+        """
+        snaps = dict(zip(self.agents, self.snaps))
+        for agent in agents:
+            record = self.keys[basename(agent)]
+            STATS.count(basename(agent), snapshots=len(snaps[agent]),
+                        keyBytes=record.parsed)
+
+    def _collect(self) -> None:
+        """
+        Work out which agents we can estimate, and gather what we need about
+        them from the snapshots and keys loaded. Run again whenever those
+        change.
+        """
+        self.agent_identifiers = list(map(basename, self.agents))
+        self._checkSnaps()
+        self._checkKeys()
+
+        # Ensure offsite sync isn't paused locally.
+        with STATS.phase('check sync options'):
+            self.checkGlobalOptions()
+            self.checkAllAgentOptions()
+
+        self._derive()
+
+        # Current offsite bandwidth and throttling, learned from what's been
+        # sent so far.
+        with STATS.phase('observe throughput'):
+            snaps = dict(zip(map(basename, self.agents), self.snaps))
+            self.throughput.observe(
+                (agent, self.keys[agent], snaps[agent])
+                for agent in self.agent_identifiers)
+            self.throughput.save(THROUGHPUT_STATE)
+            self.bandwidth = self._acquireBandwidth(self.arguments)
+
+        # Now we've collected the following information:
+        #   . Interval of backups
+        #   . Local and offsite backup schedules (list of each hour)
+        #   . A list of agents to work with that are
+        #       . not paused,
+        #       . exist,
+        #       . and have snapshots.
+        #   . Current offsite bandwidth and throttling.
+
+    def _derive(self) -> None:
+        """
+        Work out what the simulation needs from the keys of the agents in
+        `agent_identifiers`.
+        """
+        # Grab retention policies.
+        self.local_ret_policies = self._acquireKeys('retention')
+        self.offsite_ret_policies = self._acquireKeys('offsiteRetention')
+
+        # Collect intervals of backups.
+        self.intervals = self._acquireIntervals()
+
+        # Schedules of the agents left, as masks of the hours of the week
+        # they're on.
+        self.schedules = self._acquireSchedules()
+        self.localMasks = ScheduleMasks(self.schedules)
+        self.offsiteMasks = ScheduleMasks(self._acquireKeys('offsiteSchedule'))
+
+        # All the hours of the week we're taking backups, for each agent.
+        self.backupHours = list(map(ScheduleMasks.hours,
+                                    self.localMasks.masks))
+
+    def _pickAgents(self) -> List[str]:
+        """
+        The agents `requested` that are in `masterAgents` (warning about the
+        rest), or all of them if none were or none are.
+        """
+        if not self.requested:
+            return self.masterAgents
+
+        # Check the requested agents against master list of agents
+        agents = []
+        for uuid in self.requested:
+            if uuid in self.masterAgents:
+                agents.append(uuid)
+            else:
+                _WARN(uuid + ' is not in the dataset, excluding')
+        if not agents:
+            _WARN('Defaulting to complete dataset')
+            return self.masterAgents
+        return agents
+
+    def relist(self) -> None:
+        """
+        List the agents again, picking up those made since and dropping those
+        destroyed, then `refresh` every one of them.
+        """
+        with STATS.phase('list agents'):
+            self.masterAgents = listAgents(self.requested, self.timeout)
+        agents = self._pickAgents()
+
+        snaps = dict(zip(self.agents, self.snaps))
+        self.agents = agents
+        self.snaps = [snaps.get(agent, SnapshotSeries.fromDict({}))
+                      for agent in agents]
+        self.keys = OrderedDict((basename(agent), self.keys[basename(agent)])
+                                for agent in agents
+                                if basename(agent) in self.keys)
+        self.refresh()
+
+    def refresh(self, agents: Optional[Iterable[str]] = None,
+                snapshots: bool = True) -> None:
+        """
+        Reload the keys, and snapshots if `snapshots`, of `agents` (basenames,
+        or every agent if None), then `_collect` again.
+        """
+        if agents is not None:
+            agents = set(agents)
+        datasets = [dataset for dataset in self.agents
+                    if agents is None or basename(dataset) in agents]
+
+        if snapshots and datasets:
+            with STATS.phase('list snapshots'):
+                allSnaps = self._listSnapshots(
+                    datasets, self._parents() if agents is None else None)
+            with STATS.phase('index snapshots'):
+                self.snaps = [asSeries(allSnaps[dataset])
+                              if dataset in allSnaps else snap
+                              for dataset, snap in zip(self.agents,
+                                                       self.snaps)]
+
+        with STATS.phase('decode keys'):
+            self.keys.update(loadAgentKeys(list(map(basename, datasets)),
+                                           self.arguments.processes,
+                                           self.cache))
+        self._count(datasets)
+        self._saveState()
+        self._collect()
+
+    def _checkSnaps(self) -> None:
+        """
+        Exclude agents that don't have snapshots.
+        """
+        for agent, snap in zip(self.agents, self.snaps):
+            if not len(snap):
+                _WARN(agent + ' has no snapshots, excluding')
+                self.agent_identifiers.remove(basename(agent))
+
+    def _checkKeys(self) -> None:
+        """
+        Exclude agents missing any of the key files we can't estimate without.
+        """
+        for agent in list(self.agent_identifiers):
+            errors = self.keys[agent].errors
+            missing = [field for field in REQUIRED_KEYS if field in errors]
+            if missing:
+                _WARN('{} has unreadable keys ({}), excluding'.format(
+                    agent, '; '.join(errors[field] for field in missing)))
+                self.agent_identifiers.remove(agent)
+
+    def _acquireKeys(self, field: str) -> List[Any]:
+        """
+        Get a list of one decoded key, in the order of `agent_identifiers`.
+        """
+        return [getattr(self.keys[agent], field)
+                for agent in self.agent_identifiers]
+
+    def _acquireSchedules(self) -> List[Optional[int]]:
+        """
+        Get a list of schedules, as `scheduleMask`s (None where there isn't
+        one).
+        """
+        return self._acquireKeys('schedule')
+
+    def _acquireIntervals(self) -> List[int]:
+        """
+        Get a list of intervals over which backups are taken during hours
+        backups are acquired.
+        """
+        return self._acquireKeys('interval')
+
+    @staticmethod
+    def checkGlobalOptions() -> None:
+        """
+        If `speedsync options` are paused, raise an exception.
+        """
+        import json
+
+        with open(SPEEDSYNC_OPTIONS, 'r') as global_options:
+            options = json.loads(global_options.readline().rstrip())
+            if options['pauseZfs'] or options['pauseTransfer']:
+                raise PausedTransfers('Sync options are paused')
+
+    def checkAgentOptions(self, agentBasename: str) -> bool:
+        """
+        Check a single agent's sync options.
+        """
+        options = loadSyncOptions([agentBasename])
+        if agentBasename not in options:
+            raise FileNotFoundError(
+                '{} has no sync options'.format(agentBasename))
+        return isPaused(options[agentBasename])
+
+    def checkAllAgentOptions(self) -> None:
+        """
+        Check all agents' sync options, excluding those that are paused (or
+        have none).
+        """
+        options = loadSyncOptions(self.agent_identifiers)
+        paused = pauseMask(self.agent_identifiers, options)
+
+        agents = []
+        for index, agent in enumerate(self.agent_identifiers):
+            if not paused >> index & 1:
+                agents.append(agent)
+            elif agent in options:
+                _WARN(agent + ' is paused, excluding')
+            else:
+                _WARN(agent + ' has no sync options, excluding')
+        self.agent_identifiers = agents
+
+        # If global check has not been run, we'll check just in case
+        if not self.agent_identifiers:
+            raise PausedTransfers('Agents are all individually paused')
+
+    def _acquireBandwidth(self, arguments: 'argparse.Namespace') \
+            -> Optional[float]:
+        """
+        Offsite bandwidth in bytes/hour: `--bandwidth` if given, otherwise
+        the throughput we've observed, capped at the appliance's speed limit.
+        """
+        if arguments.bandwidth:
+            return float(arguments.bandwidth) * SPEED_LIMIT_UNIT * 3600
+
+        limit = readSpeedLimit()
+        observed = self.throughput.estimate(int(self.now.timestamp()))
+        if limit:
+            limit = float(limit) * SPEED_LIMIT_UNIT
+            observed = limit if observed is None else min(observed, limit)
+        self.speedLimit = limit or None
+
+        if not observed:
+            _WARN('No offsite throughput observed or speed limit set; '
+                  'pass --bandwidth')
+            return None
+        return observed * 3600
+
+    def simulate(self, horizon: Optional[int] = None) -> 'SyncEstimate':
+        """
+        Simulate offsite sync hour by hour from the top of the current hour
+        until every agent's backlog is cleared, or `horizon` hours pass.
+        """
+        with STATS.phase('simulate'):
+            return self._simulate(horizon or self.horizon)
+
+    def _simulate(self, horizon: int) -> 'SyncEstimate':
+        """
+        The body of `simulate`.
+        """
+        start = self.now.replace(minute=0, second=0, microsecond=0)
+        agents = self.agent_identifiers
+        backlog, rates, pruners = self._simulationInputs()
+
+        hours, agentHours, pruned = simulateSync(
+            backlog,
+            self.localMasks.flags(),
+            self.offsiteMasks.flags(),
+            rates, self.bandwidth, hourOfWeek(start), horizon,
+            pruners, int(start.timestamp())
+        )
+
+        return SyncEstimate(start, list(agents), backlog, self.bandwidth,
+                            horizon, hours, agentHours, pruned)
+
+    def _simulationInputs(self) \
+            -> Tuple[List[int], List[float], List[Optional[RetentionPruner]]]:
+        """
+        Each agent in `agent_identifiers`' backlog, backup rate and (fresh)
+        `RetentionPruner`, as of now.
+        """
+        now = int(self.now.timestamp())
+        snaps = dict(zip(map(basename, self.agents), self.snaps))
+
+        agents = self.agent_identifiers
+        keys = [self.keys[agent] for agent in agents]
+        rates = [backupRate(snaps[agent], key.interval, now)
+                 for agent, key in zip(agents, keys)]
+
+        # Which snapshots retention culls before they're sent, from a ledger
+        # of them that's also the backlog.
+        backlog = []
+        pruners = []  # type: List[Optional[RetentionPruner]]
+        for agent, key in zip(agents, keys):
+            if not key.retention and not key.offsiteRetention:
+                backlog.append(pendingBacklog(snaps[agent], key))
+                pruners.append(None)
+                continue
+            pruner = RetentionPruner(
+                snaps[agent].between(sinceOffsite(key)), snaps[agent],
+                [key.retention, key.offsiteRetention], sentOffsite(key))
+            backlog.append(int(pruner.backlog))
+            pruners.append(pruner)
+
+        return backlog, rates, pruners
+
+    def monteCarlo(self, trials: int = MONTE_CARLO_TRIALS,
+                   jobs: Optional[int] = None, seed: Optional[int] = None,
+                   percentiles: Sequence[float] = PERCENTILES,
+                   horizon: Optional[int] = None) -> 'SyncDistribution':
+        """
+        Simulate `trials` times, drawing each agent's backup rate and the
+        bandwidth afresh for each, and take `percentiles` of when agents are
+        caught up. Backup rates are the mean of a bootstrap resample of the
+        agent's recent snapshot sizes (those `backupRate` averages).
+
+        Bandwidth, unless it was given with `--bandwidth`, is drawn around
+        the same estimate `simulate` uses: the link's recent hourly windows
+        of throughput (`linkThroughput`) are scaled to average it, each trial
+        scales them again by how a bootstrap resample's mean differs from
+        theirs, for how uncertain the estimate is, and each hour of it is
+        sent one of them at random, capped at the speed limit, for how much
+        throughput varies. Retention culls the same snapshots as in
+        `simulate`, when sending hasn't reached them by then.
+
+        Trials are split into `MONTE_CARLO_STREAMS` batches run across `jobs`
+        processes, each with its own random stream spawned from `seed`, so
+        the same seed gives the same answer however many jobs there are.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        horizon = horizon or self.horizon
+        start = self.now.replace(minute=0, second=0, microsecond=0)
+        now = int(self.now.timestamp())
+        snaps = dict(zip(map(basename, self.agents), self.snaps))
+        agents = self.agent_identifiers
+        keys = [self.keys[agent] for agent in agents]
+        backlog, rates, pruners = self._simulationInputs()
+
+        np = numpy()
+        column = (lambda values: np.asarray(values, dtype=np.float64)) \
+            if np is not None else list
+
+        sizes = []
+        for agent, key in zip(agents, keys):
+            recent = snaps[agent].between(now - 7 * 24 * 3600) \
+                or snaps[agent]
+            sizes.append(column(recent.sizes.tolist())
+                         if len(recent) and key.interval else None)
+
+        throughput = []  # type: List[float]
+        if not self.arguments.bandwidth:
+            observations = linkThroughput(
+                transferObservations(self.keys[agent], snaps[agent])
+                for agent in agents)
+            recent = [observation for observation in observations
+                      if observation[0] >= now - 7 * 24 * 3600] \
+                or observations
+            throughput = [3600 * min(size / seconds,
+                                     self.speedLimit or math.inf)
+                          for _, size, seconds in recent]
+            if throughput:
+                scale = self.bandwidth / (sum(throughput) / len(throughput))
+                throughput = [observed * scale for observed in throughput]
+
+        # Arrivals scale with the rates, and when each snapshot is culled
+        # doesn't depend on them, so both are laid out just the once, for
+        # every trial.
+        unit = culls = None
+        if np is not None and agents:
+            unit = _arrivals(self.localMasks.flags(),
+                             self.offsiteMasks.flags(), [1.0] * len(agents),
+                             hourOfWeek(start), horizon)
+            culls = _cullSchedule(pruners, int(start.timestamp()), horizon)
+            pruners = []
+
+        model = MonteCarloModel(
+            backlog=backlog, rates=rates, sizes=sizes,
+            perHour=[60 / key.interval if key.interval else 0.0
+                     for key in keys],
+            throughput=column(throughput), bandwidth=self.bandwidth,
+            speedLimit=3600 * (self.speedLimit or math.inf),
+            local=self.localMasks.flags(), offsite=self.offsiteMasks.flags(),
+            startHour=hourOfWeek(start), horizon=horizon, arrivals=unit,
+            pruners=pruners, startEpoch=int(start.timestamp()), culls=culls
+        )
+
+        seed = int.from_bytes(os.urandom(16), 'little') if seed is None \
+            else seed
+        batches = [trials // MONTE_CARLO_STREAMS
+                   + (batch < trials % MONTE_CARLO_STREAMS)
+                   for batch in range(MONTE_CARLO_STREAMS)]
+        batches = [batch for batch in batches if batch]
+        if np is not None:
+            streams = np.random.SeedSequence(seed).spawn(len(batches))
+        else:
+            streams = ['{}:{}'.format(seed, stream)
+                       for stream in range(len(batches))]
+
+        with STATS.phase('monte carlo'):
+            if jobs == 1:
+                outcomes = list(map(_simulateTrials, repeat(model), streams,
+                                    batches))
+            else:
+                # A chunk of batches a process, so the model (arrivals and
+                # all) is only pickled over once for each.
+                chunk = -(-len(batches) // (jobs or os.cpu_count() or 1))
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    outcomes = list(pool.map(_simulateTrials, repeat(model),
+                                             streams, batches,
+                                             chunksize=chunk))
+        outcomes = list(chain.from_iterable(outcomes))
+
+        hours = [hoursTaken for hoursTaken, _ in outcomes]
+        return SyncDistribution(
+            start, list(agents), len(outcomes), seed, horizon,
+            list(percentiles),
+            [percentile(hours, percent) for percent in percentiles],
+            [[percentile([agentHours[agent] for _, agentHours in outcomes],
+                         percent) for percent in percentiles]
+             for agent in range(len(agents))]
+        )
+
+    def scheduleLoad(self) -> str:
+        """
+        How many agents back up, and may sync offsite, in each hour of the
+        week, and how many do both.
+        """
+        lines = []
+        for title, masks in (
+                ('Agents backing up', self.localMasks),
+                ('Agents syncing offsite', self.offsiteMasks),
+                ('Agents doing both', self.localMasks & self.offsiteMasks)):
+            lines.append('{} ({} hours a week between them):'.format(
+                title, bin(masks.union()).count('1')))
+            lines.extend(formatWeek(masks.histogram()))
+        return '\n'.join(lines) + '\n'
+
+    def run(self) -> str:
+        """
+        Run the hourly loop and make the determination as to when offsite
+        sync will have caught up.
+        """
+        if not self.bandwidth:
+            return 'Can\'t estimate offsite sync without a bandwidth\n'
+
+        return '\n'.join(formatEstimate(self.simulate())) + '\n'
+
+    def runMonteCarlo(self, trials: int = MONTE_CARLO_TRIALS,
+                      jobs: Optional[int] = None, seed: Optional[int] = None,
+                      percentiles: Sequence[float] = PERCENTILES) -> str:
+        """
+        Like `run`, but report percentiles of `monteCarlo`.
+        """
+        if not self.bandwidth:
+            return 'Can\'t estimate offsite sync without a bandwidth\n'
+
+        return '\n'.join(formatDistribution(
+            self.monteCarlo(trials, jobs, seed, percentiles))) + '\n'
+
+    @staticmethod
+    def decodeRetention(agent: str, offsite: bool = False) -> List[int]:
+        """
+        Read the retention policy for an agent from file.
+        """
+        # There's offsite and local retention policies on our appliances.
+        return decodeRetentionKey(KEYS + agent + (OFFSITE_RETENTION if offsite
+                                                  else LOCAL_RETENTION))
+
+    @staticmethod
+    def getSnapshots(agent: str) -> SnapshotSeries:
+        """
+        Get a list of snapshots from a particular agent.
+        """
+        return SnapshotSeries.fromDict(
+            getAllSnapshots([agent], timeout=ZFS_TIMEOUT)[agent])
+
+
+class DirectoryWatcher:
+    """
+    Report files changed in a set of directories (and their immediate
+    subdirectories) with inotify, or by polling modification times where
+    inotify can't be had.
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    # | IN_CREATE | IN_DELETE
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+    IN_CREATE_OR_MOVED_TO = 0x100 | 0x80
+    IN_ISDIR = 0x40000000
+    event = struct.Struct('iIII')
+
+    def __init__(self, directories: List[str]) -> None:
+        import ctypes
+        import ctypes.util
+
+        self.directories = directories
+        self.watches = {}  # type: Dict[int, str]
+        self.fd = None  # type: Optional[int]
+
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                    use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        except (OSError, AttributeError):
+            pass
+
+        if self.fd is None:
+            self.signatures = self._scan()
+        else:
+            for directory in directories:
+                self._watch(directory)
+                for entry in self._subdirectories(directory):
+                    self._watch(entry)
+
+    @staticmethod
+    def _subdirectories(directory: str) -> List[str]:
+        try:
+            return [entry.path for entry in os.scandir(directory)
+                    if entry.is_dir()]
+        except OSError:
+            return []
+
+    def _watch(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                         self.MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        signatures = {}
+        for directory in self.directories:
+            for path in [directory] + self._subdirectories(directory):
+                try:
+                    for entry in os.scandir(path):
+                        if entry.is_file():
+                            stat = entry.stat()
+                            signatures[entry.path] = (stat.st_mtime_ns,
+                                                      stat.st_size)
+                except OSError:
+                    continue
+        return signatures
+
+    def wait(self, timeout: float) -> Set[str]:
+        """
+        Wait up to `timeout` seconds for changes, returning the changed paths.
+        """
+        import select
+
+        if self.fd is None:
+            sleep(max(0, timeout))
+            signatures = self._scan()
+            changed = {path for path in set(signatures) | set(self.signatures)
+                       if signatures.get(path) != self.signatures.get(path)}
+            self.signatures = signatures
+            return changed
+
+        changed = set()
+        if not select.select([self.fd], [], [], max(0, timeout))[0]:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.event.unpack_from(data, offset)
+                offset += self.event.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if wd not in self.watches:
+                    continue
+                path = os.path.join(self.watches[wd], os.fsdecode(name))
+                if mask & self.IN_ISDIR \
+                        and mask & self.IN_CREATE_OR_MOVED_TO:
+                    self._watch(path)
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class EstimateDaemon:
+    """
+    Keep a `Timeline` resident, apply changes to agents' keys and sync options
+    as they're made, and serve the latest estimate over a Unix socket.
+
+    Estimates are rendered whenever something changes rather than when
+    they're asked for, so answering a request is just a dictionary lookup and
+    a write. Agents and their snapshots aren't files we can watch, so they're
+    relisted every `refresh` seconds.
+    """
+
+    def __init__(self, timeline: Timeline, socketPath: Optional[str] = None,
+                 refresh: float = 300, settle: float = 1) -> None:
+        self.timeline = timeline
+        self.socketPath = socketPath or DAEMON_SOCKET
+        self.refresh = refresh
+        self.settle = settle
+        # request -> reply; b'' for the full report, agent names for theirs.
+        self.replies = {}  # type: Dict[bytes, bytes]
+
+    def render(self) -> None:
+        """
+        Simulate from now and swap in the replies to serve.
+        """
+        self.timeline.now = datetime.datetime.now()
+        replies = {}
+        try:
+            if not self.timeline.bandwidth:
+                lines = [self.timeline.run().rstrip('\n')]
+            else:
+                estimate = self.timeline.simulate()
+                lines = formatEstimate(estimate)
+                for agent, line in zip(estimate.agents, lines[1:]):
+                    replies[agent.encode()] = line.encode() + b'\n'
+        except (PausedTransfers, OSError, ValueError) as error:
+            lines = [str(error)]
+        replies[b''] = '\n'.join(lines).encode() + b'\n'
+        self.replies = replies
+
+    @staticmethod
+    def changedAgents(paths: Set[str]) -> Tuple[Set[str], bool]:
+        """
+        Agents (basenames) whose keys or sync options are among `paths`, and
+        whether the global sync options changed.
+        """
+        agents = set()
+        options = False
+        for path in paths:
+            if path.startswith(KEYS):
+                agents.add(basename(path).partition('.')[0])
+            elif path == SPEEDSYNC_OPTIONS:
+                options = True
+            else:
+                match = syncAgent.search(path)
+                if match:
+                    agents.add(match.group(1))
+        return agents, options
+
+    def watch(self) -> None:
+        """
+        Apply changes to the resident `Timeline` as they come in, forever.
+        Whatever goes wrong with one refresh is warned about, and the next
+        is tried all the same.
+        """
+        from subprocess import TimeoutExpired
+        import traceback
+
+        watcher = DirectoryWatcher([KEYS, SYNC])
+        due = monotonic() + self.refresh
+        while True:
+            changed = watcher.wait(due - monotonic())
+
+            # Writes tend to come in bursts; let them settle first.
+            while changed:
+                more = watcher.wait(self.settle)
+                if not more:
+                    break
+                changed |= more
+
+            try:
+                if monotonic() >= due:
+                    due = monotonic() + self.refresh
+                    self.timeline.relist()
+                else:
+                    agents, options = self.changedAgents(changed)
+                    if not agents and not options:
+                        continue
+                    self.timeline.refresh(agents)
+            except (PausedTransfers, TimeoutExpired, OSError,
+                    ValueError) as error:
+                _WARN('Refresh failed: {}'.format(error))
+            except Exception:
+                _WARN('Refresh failed:\n' + traceback.format_exc())
+
+            try:
+                self.render()
+            except Exception:
+                _WARN('Rendering failed:\n' + traceback.format_exc())
+
+    def serve(self) -> None:
+        """
+        Serve estimates on `socketPath` until interrupted. Send a line with
+        an agent's name for just that agent, or an empty line for the lot.
+        """
+        import socketserver
+        import threading
+
+        self.render()
+        threading.Thread(target=self.watch, daemon=True).start()
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                request = self.rfile.readline().strip()
+                self.wfile.write(daemon.replies.get(
+                    request, b'Unknown agent\n'))
+
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        os.makedirs(os.path.dirname(self.socketPath) or '.', mode=0o700,
+                    exist_ok=True)
+        # Not `with`; servers are only context managers from Python 3.6.
+        server = socketserver.ThreadingUnixStreamServer(self.socketPath,
+                                                        Handler)
+        try:
+            server.daemon_threads = True
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+def queryDaemon(socketPath: Optional[str] = None, agent: str = '') -> str:
+    """
+    Ask a running `EstimateDaemon` for its estimate (of `agent`, or all).
+    """
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socketPath or DAEMON_SOCKET)
+        connection.sendall(agent.encode() + b'\n')
+        reply = []
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            reply.append(data)
+    return b''.join(reply).decode()
+
+
+class RunStats:
+    """
+    Where a run's time goes: wall-clock seconds per phase, per subprocess
+    command, and counters per agent. Phases and commands that run more than
+    once (say, on every `EstimateDaemon` refresh) accumulate.
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.datetime.now()
+        # name -> [seconds, calls]
+        self.phases = OrderedDict()    # type: Dict[str, List[float]]
+        self.commands = OrderedDict()  # type: Dict[str, List[float]]
+        # agent -> counter -> value
+        self.agents = OrderedDict()    # type: Dict[str, Dict[str, int]]
+
+    @staticmethod
+    def _add(timings: Dict[str, List[float]], name: str,
+             seconds: float) -> None:
+        timing = timings.setdefault(name, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the body of a `with` block as phase `name`.
+        """
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self._add(self.phases, name, monotonic() - started)
+
+    def command(self, name: str, seconds: float) -> None:
+        """
+        Record a subprocess `name` that ran for `seconds`.
+        """
+        self._add(self.commands, name, seconds)
+
+    def count(self, agent: str, **counters: int) -> None:
+        """
+        Add to the `counters` of `agent`.
+        """
+        totals = self.agents.setdefault(agent, {})
+        for counter, value in counters.items():
+            totals[counter] = totals.get(counter, 0) + value
+
+    def toDict(self, cache: Optional[DecodeCache] = None) -> Dict[str, Any]:
+        """
+        Everything recorded so far, as something `json.dump` can take.
+        """
+        def timings(recorded: Dict[str, List[float]]) -> Dict[str, Dict]:
+            return OrderedDict(
+                (name, {'seconds': round(seconds, 6), 'calls': calls})
+                for name, (seconds, calls) in recorded.items()
+            )
+
+        stats = OrderedDict([
+            ('started', self.started.isoformat()),
+            ('seconds', round(
+                (datetime.datetime.now() - self.started).total_seconds(), 6)),
+            ('phases', timings(self.phases)),
+            ('commands', timings(self.commands)),
+            ('agents', self.agents)
+        ])
+        if cache is not None:
+            stats['cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                              'evictions': cache.evictions}
+        return stats
+
+    def save(self, path: str, cache: Optional[DecodeCache] = None) -> None:
+        """
+        Write `toDict` to `path` as JSON, or to stderr if `path` is '-'.
+        """
+        import json
+
+        if path == '-':
+            json.dump(self.toDict(cache), sys.stderr, indent=2)
+            sys.stderr.write('\n')
+            return
+        with open(path, 'w') as statsFile:
+            json.dump(self.toDict(cache), statsFile, indent=2)
+
+
+STATS = RunStats()
+
+
+class StackSampler:
+    """
+    A sampling profiler with the same `enable`/`disable`/`dump_stats` calls as
+    `cProfile.Profile`, whose output is instead the collapsed stacks (one
+    `frame;frame;frame count` line per distinct stack) that flamegraph.pl and
+    speedscope read. Only the thread that enables it is sampled; work handed
+    to worker processes doesn't show up.
+    """
+
+    def __init__(self, interval: float = 0.001) -> None:
+        import threading
+
+        self.interval = interval
+        self.stacks = {}  # type: Dict[str, int]
+        self._target = None  # type: Optional[int]
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def enable(self) -> None:
+        import threading
+
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def disable(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(
+                    code.co_name, basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stack = ';'.join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def dump_stats(self, path: str) -> None:
+        with open(path, 'w') as collapsed:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed.write('{} {}\n'.format(stack, count))
+
+
+AgentKeys = NamedTuple('AgentKeys', [
+    ('agent', str),
+    ('schedule', Optional[int]),           # `scheduleMask`s
+    ('offsiteSchedule', Optional[int]),
+    ('retention', Optional[List[int]]),
+    ('offsiteRetention', Optional[List[int]]),
+    ('interval', Optional[int]),
+    ('offSitePoints', Optional[List[int]]),
+    ('transfers', Optional[Dict[int, int]]),
+    ('agentInfo', Optional[Dict]),
+    ('errors', Dict[str, str]),
+    ('parsed', int)                        # bytes of key files decoded
+])
+
+
+def decodeRetentionKey(path: str) -> List[int]:
+    """
+    Decode a `.retention` or `.offsiteRetention` key.
+    """
+    with open(path, 'r') as cryptic_policy:
+        policy = cryptic_policy.readline().split(':')
+
+    # Now let's decode what's _really_ going to happen to this data.
+    # everything is dependent upon the last number in the 4-tuple.
+    intra, daily, weekly, total = map(int, policy)
+
+    # intra: 1d - 31d
+    # daily: 1w - 26w
+    # weekly: 1m - 24m, or up to ~27 years (maxes out at 240000hrs)
+    # total: 1w - 7y, or up to ~27 years, again
+
+    return [intra, daily, weekly, total]
+
+
+def decodeScheduleKey(path: str) -> int:
+    """
+    Decode a `.schedule` or `.offsiteSchedule` key straight into its
+    `scheduleMask`.
+    """
+    return scheduleMask(ConvertJSON().decode(path))
+
+
+def decodeIntervalKey(path: str) -> int:
+    """
+    Decode a `.interval` key; just a number of minutes.
+    """
+    with open(path, 'r') as intervalFile:
+        return int(intervalFile.readline().rstrip())
+
+
+def decodePointsKey(path: str) -> List[int]:
+    """
+    Decode a `.offSitePoints` key; just numbers (epochs).
+    """
+    with open(path, 'r') as pointsFile:
+        return sorted(map(int, re.findall(numbers, pointsFile.read())))
+
+
+def decodeTransfersKey(path: str) -> Dict[int, int]:
+    """
+    Decode a `.transfers` key into a dictionary of epoch -> bytes sent, one
+    `<epoch>:<bytes>` record per line.
+    """
+    transfers = {}
+    with open(path, 'r') as transferFile:
+        for line in transferFile:
+            fields = re.findall(numbers, line)
+            if fields:
+                transfers[int(fields[0])] = int(fields[1]) \
+                    if len(fields) > 1 else 0
+    return transfers
+
+
+# AgentKeys field -> (key extension, decoder)
+KEY_DECODERS = OrderedDict([
+    ('schedule',         (LOCAL_SCHEDULE,    decodeScheduleKey)),
+    ('offsiteSchedule',  (OFFSITE_SCHEDULE,  decodeScheduleKey)),
+    ('retention',        (LOCAL_RETENTION,   decodeRetentionKey)),
+    ('offsiteRetention', (OFFSITE_RETENTION, decodeRetentionKey)),
+    ('interval',         (BACKUP_INTERVAL,   decodeIntervalKey)),
+    ('offSitePoints',    (OFFSITE_POINTS,    decodePointsKey)),
+    ('transfers',        (TRANSFERS_DONE,    decodeTransfersKey)),
+    ('agentInfo',        (AGENT_INFO,        ConvertJSON().decode))
+])
+
+# Keys decoded unless others are asked for. Nothing here reads `agentInfo`,
+# the largest of them, so it's only decoded when it's asked for.
+DEFAULT_KEYS = tuple(field for field in KEY_DECODERS if field != 'agentInfo')
+
+# Keys an agent can't be estimated without.
+REQUIRED_KEYS = ('schedule', 'retention', 'offsiteRetention', 'interval')
+
+
+def _loadAgentKeys(agent: str, fields: Optional[List[str]] = None,
+                   keys: Optional[str] = None) -> AgentKeys:
+    """
+    Decode the key files of a single agent (`DEFAULT_KEYS`, unless `fields`
+    is given) from `keys` (`KEYS` by default; workers are handed it, as they
+    needn't share our `setRoot`). Failures are recorded in `errors` (field ->
+    message) rather than raised, so one bad file doesn't take down a whole
+    batch.
+    """
+    keys = keys or KEYS
+    fields = DEFAULT_KEYS if fields is None else fields
+    record = {'agent': agent, 'errors': {}, 'parsed': 0}
+    for field, (extension, decoder) in KEY_DECODERS.items():
+        if field not in fields:
+            record[field] = None
+            continue
+        try:
+            record[field] = decoder(keys + agent + extension)
+            record['parsed'] += os.path.getsize(keys + agent + extension)
+        except (OSError, ValueError, SyntaxError) as error:
+            record[field] = None
+            record['errors'][field] = '{}: {}'.format(
+                agent + extension, error)
+    return AgentKeys(**record)
+
+
+def loadAgentKeys(agents: List[str], processes: Optional[int] = None,
+                  cache: Optional[DecodeCache] = None) -> Dict[str, AgentKeys]:
+    """
+    Decode all key files for `agents` (basenames) across a process pool,
+    returning a record per agent. With a `cache`, only files that changed
+    since they were cached are sent out to be decoded. Small batches are
+    decoded in-process, where spinning up workers would cost more than it
+    saves.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    known, signatures, stale = _checkKeyCache(agents, cache)
+
+    if processes < 2 or len(stale) < 2 * processes:
+        decoded = map(_loadAgentKeys, stale, stale.values())
+        records = OrderedDict((record.agent, record) for record in decoded)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            decoded = pool.map(_loadAgentKeys, stale, stale.values(),
+                               repeat(KEYS, len(stale)),
+                               chunksize=max(1, len(stale) // (4 * processes)))
+            records = OrderedDict((record.agent, record) for record in decoded)
+
+    return _mergeKeys(known, signatures, stale, records, cache)
+
+
+def _runningLoop() -> 'asyncio.AbstractEventLoop':
+    """
+    The event loop running the calling coroutine. Before Python 3.7 there's
+    no `get_running_loop`, but then `get_event_loop` in a coroutine is it.
+    """
+    import asyncio
+
+    if hasattr(asyncio, 'get_running_loop'):
+        return asyncio.get_running_loop()
+    return asyncio.get_event_loop()
+
+
+async def loadAgentKeysAsync(agents: List[str], limit: 'asyncio.Semaphore',
+                             readers: 'concurrent.futures.Executor',
+                             cache: Optional[DecodeCache] = None) \
+        -> Dict[str, AgentKeys]:
+    """
+    `loadAgentKeys` for asyncio: each agent's stale keys are read on
+    `readers`, with no more than `limit` allows in flight at once.
+    """
+    import asyncio
+
+    known, signatures, stale = _checkKeyCache(agents, cache)
+    loop = _runningLoop()
+
+    async def load(agent: str, fields: List[str]) -> AgentKeys:
+        async with limit:
+            return await loop.run_in_executor(readers, _loadAgentKeys, agent,
+                                              fields)
+
+    decoded = await asyncio.gather(*(load(agent, fields)
+                                     for agent, fields in stale.items()))
+    records = OrderedDict((record.agent, record) for record in decoded)
+    return _mergeKeys(known, signatures, stale, records, cache)
+
+
+def _checkKeyCache(agents: List[str], cache: Optional[DecodeCache]) \
+        -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any],
+                 Dict[str, List[str]]]:
+    """
+    Split the keys of `agents` into those `cache` already has (agent ->
+    field -> value) and those that need decoding (agent -> fields), noting
+    the signatures of the files checked along the way.
+    """
+    known = OrderedDict((agent, {}) for agent in agents)
+    signatures = {}  # path -> signature, taken before decoding
+    stale = OrderedDict()  # type: Dict[str, List[str]]
+
+    for agent in agents:
+        for field in DEFAULT_KEYS:
+            if cache is not None:
+                path = KEYS + agent + KEY_DECODERS[field][0]
+                signatures[path] = cache.signature(path)
+                value = cache.get(path, signatures[path])
+                if value is not cache.MISS:
+                    known[agent][field] = value
+                    continue
+            stale.setdefault(agent, []).append(field)
+
+    return known, signatures, stale
+
+
+def _mergeKeys(known: Dict[str, Dict[str, Any]], signatures: Dict[str, Any],
+               stale: Dict[str, List[str]], records: Dict[str, AgentKeys],
+               cache: Optional[DecodeCache]) -> Dict[str, AgentKeys]:
+    """
+    Combine what `_checkKeyCache` found cached with freshly decoded
+    `records`, caching the latter.
+    """
+    for agent, fields in stale.items():
+        record = records[agent]
+        for field in fields:
+            value = getattr(record, field)
+            known[agent][field] = value
+            if cache is not None and field not in record.errors:
+                path = KEYS + agent + KEY_DECODERS[field][0]
+                cache.put(path, signatures[path], value)
+
+    return OrderedDict(
+        (agent, AgentKeys(
+            agent=agent,
+            errors=records[agent].errors if agent in records else {},
+            parsed=records[agent].parsed if agent in records else 0,
+            **dict((field, fields.get(field)) for field in KEY_DECODERS)
+        )) for agent, fields in known.items()
+    )
+
+
+def loadSyncOptions(agents: Optional[Iterable[str]] = None) \
+        -> Dict[str, Dict[str, Any]]:
+    """
+    Sync options of every agent (basename -> options), or just of `agents`.
+    `SYNC` is listed once, agents are picked out of its directories' names
+    (like `SPEEDSYNC_OPTIONS_AGENT`), and all the options read are parsed
+    as one JSON array. Agents without readable options are left out.
+    """
+    import json
+
+    wanted = None if agents is None else set(agents)
+    found = []  # type: List[str]
+    lines = []  # type: List[str]
+
+    try:
+        entries = list(os.scandir(SYNC))
+    except FileNotFoundError:
+        return {}
+    for entry in entries:
+        match = syncAgent.search(entry.name)
+        if not match or wanted is not None and match.group(1) not in wanted:
+            continue
+        try:
+            with open(os.path.join(entry.path, 'options'), 'r') as options:
+                line = options.readline().strip()
+        except (NotADirectoryError, FileNotFoundError):
+            continue
+        if line:
+            found.append(match.group(1))
+            lines.append(line)
+
+    try:
+        parsed = json.loads('[' + ','.join(lines) + ']')
+    except ValueError:
+        # Find the bad one(s), and keep the rest.
+        parsed = []
+        for agent, line in zip(found, lines):
+            try:
+                parsed.append(json.loads(line))
+            except ValueError as error:
+                _WARN('{} has unreadable sync options: {}'.format(agent,
+                                                                  error))
+                parsed.append(None)
+
+    return dict((agent, options) for agent, options in zip(found, parsed)
+                if type(options) is dict)
+
+
+def isPaused(options: Dict[str, Any]) -> bool:
+    """
+    Whether sync `options` have transfers paused.
+    """
+    return bool(options.get('pauseZfs') or options.get('pauseTransfer'))
+
+
+def pauseMask(agents: List[str], options: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Bitmap of `agents` that are paused (or missing from `options`), bit `i`
+    for `agents[i]`.
+    """
+    mask = 0
+    for index, agent in enumerate(agents):
+        if agent not in options or isPaused(options[agent]):
+            mask |= 1 << index
+    return mask
+
+
+SyncEstimate = NamedTuple('SyncEstimate', [
+    ('start', datetime.datetime),          # top of the hour simulated from
+    ('agents', List[str]),
+    ('backlog', List[int]),                # bytes pending offsite at `start`
+    ('bandwidth', float),                  # bytes/hour
+    ('horizon', int),                      # hours simulated
+    ('hours', Optional[int]),              # until everything's caught up
+    ('agentHours', List[Optional[int]]),   # until each agent's caught up
+    ('pruned', List[float])                # bytes culled before being sent
+])
+
+SyncDistribution = NamedTuple('SyncDistribution', [
+    ('start', datetime.datetime),
+    ('agents', List[str]),
+    ('trials', int),
+    ('seed', int),                         # to run the same trials again
+    ('horizon', int),
+    ('percentiles', List[float]),
+    ('hours', List[Optional[int]]),        # at each percentile
+    ('agentHours', List[List[Optional[int]]])
+])
+
+# What `_simulateTrials` draws from; sizes and throughput are NumPy arrays
+# when there's NumPy.
+MonteCarloModel = NamedTuple('MonteCarloModel', [
+    ('backlog', List[int]),
+    ('rates', List[float]),                # used where there are no sizes
+    ('sizes', List[Optional[Sequence[float]]]),   # recent snapshots' sizes
+    ('perHour', List[float]),              # backups an hour
+    ('throughput', Sequence[float]),       # observed, bytes/hour, scaled
+                                           # to average `bandwidth`
+    ('bandwidth', float),                  # bytes/hour, the point estimate
+    ('speedLimit', float),                 # bytes/hour
+    ('local', Any),
+    ('offsite', Any),
+    ('startHour', int),
+    ('horizon', int),
+    ('arrivals', Any),                     # `_arrivals` at rates of 1
+    ('pruners', List[Optional[RetentionPruner]]),  # without NumPy
+    ('startEpoch', int),
+    ('culls', Optional['CullSchedule'])    # with NumPy
+])
+
+# The snapshots `RetentionPruner`s could cull, laid out for `_drainTrials`.
+CullSchedule = NamedTuple('CullSchedule', [
+    ('agents', Any),                       # each snapshot's agent,
+    ('sizes', Any),                        # bytes,
+    ('ahead', Any),                        # bytes of the ledger ahead of it
+    ('first', Any),                        # its agent's first snapshot here
+    ('hours', List[Tuple[int, Any]])       # (hour, snapshots culled in it)
+])
+
+
+def weeklyHours(schedule: Optional[Dict]) -> List[bool]:
+    """
+    Flatten a decoded schedule into `HOURS_PER_WEEK` flags, from Sunday 00:00,
+    that are True where backups are taken (hours mapped to `BACKUP_HOUR`).
+    Schedules are day -> hour -> flag, or flat hour-of-week -> flag; a flat
+    schedule with no hour past 23 applies to every day. A missing schedule
+    means every hour.
+    """
+    if not schedule:
+        return [True] * HOURS_PER_WEEK
+
+    flags = [False] * HOURS_PER_WEEK
+    flat = [int(hour) for hour, flag in schedule.items()
+            if type(flag) is not dict]
+    daily = all(hour < 24 for hour in flat)
+    for day, hours in schedule.items():
+        if type(hours) is dict:
+            for hour, flag in hours.items():
+                if flag == BACKUP_HOUR:
+                    flags[int(day) % 7 * 24 + int(hour) % 24] = True
+        elif hours == BACKUP_HOUR and daily:
+            for hour in range(int(day), HOURS_PER_WEEK, 24):
+                flags[hour] = True
+        elif hours == BACKUP_HOUR:
+            flags[int(day) % HOURS_PER_WEEK] = True
+    return flags
+
+
+def scheduleMask(schedule: Optional[Dict]) -> int:
+    """
+    `weeklyHours` of `schedule` as bits of an int, hour 0 (Sunday 00:00)
+    lowest.
+    """
+    mask = 0
+    for hour, flag in enumerate(weeklyHours(schedule)):
+        if flag:
+            mask |= 1 << hour
+    return mask
+
+
+def hourOfWeek(moment: datetime.datetime) -> int:
+    """
+    Index of `moment`'s hour into `weeklyHours` flags.
+    """
+    return moment.isoweekday() % 7 * 24 + moment.hour
+
+
+def pendingBacklog(snaps: SnapshotSeries, keys: AgentKeys) -> int:
+    """
+    Bytes an agent still has to send offsite: everything snapshotted since
+    its last offsite point, less what `.transfers` says is already sent.
+    """
+    return max(0, snaps.total(sinceOffsite(keys)) - sentOffsite(keys))
+
+
+def sinceOffsite(keys: AgentKeys) -> Optional[int]:
+    """
+    The epoch an agent's pending snapshots start at: just past its last
+    offsite point, if it has any.
+    """
+    points = keys.offSitePoints
+    return points[-1] + 1 if points else None
+
+
+def sentOffsite(keys: AgentKeys) -> int:
+    """
+    Bytes `.transfers` says are sent of an agent's pending snapshots.
+    """
+    since = sinceOffsite(keys)
+    return sum(sent for epochInt, sent in (keys.transfers or {}).items()
+               if since is None or epochInt >= since)
+
+
+def backupRate(snaps: SnapshotSeries, interval: Optional[int],
+               now: int, window: int = 7 * 24 * 3600) -> float:
+    """
+    Expected bytes added per hour while an agent's backups are scheduled:
+    the mean size of its snapshots over the last `window` seconds (or all of
+    them, if none are that recent), times backups per hour.
+    """
+    recent = snaps.between(now - window) or snaps
+    if not len(recent) or not interval:
+        return 0.0
+    return recent.total() / len(recent) * 60 / interval
+
+
+def simulateSync(backlog: Sequence[float], local: List[List[bool]],
+                 offsite: List[List[bool]], rates: Sequence[float],
+                 bandwidth: float, startHour: int, horizon: int,
+                 pruners: Optional[List[Optional[RetentionPruner]]] = None,
+                 startEpoch: int = 0) \
+        -> Tuple[Optional[int], List[Optional[int]], List[float]]:
+    """
+    Simulate offsite sync an hour at a time for `horizon` hours.
+
+    Each agent starts with `backlog` bytes queued. In its `local` scheduled
+    hours it generates `rates` bytes, which are queued at its next `offsite`
+    scheduled hour. Every hour, up to `bandwidth` bytes are sent, split
+    evenly between agents with data queued (an agent needing less than its
+    share frees the rest up for the others). An agent's `pruners` entry, if
+    any, is its backlog's ledger, and follows which snapshots in it
+    retention culls as the hours (from `startEpoch`) pass; those not yet
+    being sent come off its queue, as they never will be.
+
+    Returns the hours until every queue is first empty, for each agent the
+    hours until its own queue is first empty (None past the horizon), and
+    for each agent the bytes culled before they were sent.
+    """
+    np = numpy(len(backlog) * horizon)
+    if np is None:
+        return _simulateSyncLoop(backlog, local, offsite, rates, bandwidth,
+                                 startHour, horizon, pruners, startEpoch)
+
+    backlog = np.asarray(backlog, dtype=np.float64)
+    if not len(backlog):
+        return 0, [], []
+
+    return _drainQueues(backlog, _arrivals(local, offsite, rates, startHour,
+                                           horizon),
+                        bandwidth, horizon, pruners, startEpoch)
+
+
+def _arrivals(local: List[List[bool]], offsite: List[List[bool]],
+              rates: Sequence[float], startHour: int, horizon: int) -> Any:
+    """
+    Hours x agents grid of the bytes `simulateSync` queues for each agent in
+    each hour. It's linear in `rates`, so one made with rates of 1 can be
+    scaled by others.
+    """
+    np = numpy()
+
+    # hours x agents grids; indexing the weekly flags by each simulated
+    # hour's position in the week lays the schedules out over the horizon.
+    week = (startHour + np.arange(horizon)) % HOURS_PER_WEEK
+    generated = np.asarray(local, dtype=bool).T[week] \
+        * np.asarray(rates, dtype=np.float64)
+    np.cumsum(generated, axis=0, out=generated)
+
+    # Data is queued at the latest offsite hour at or before each hour.
+    queuedAt = np.where(np.asarray(offsite, dtype=bool).T[week],
+                        np.arange(horizon)[:, None], -1)
+    np.maximum.accumulate(queuedAt, axis=0, out=queuedAt)
+    arrivals = np.where(queuedAt >= 0, np.take_along_axis(
+        generated, np.maximum(queuedAt, 0), axis=0), 0.0)
+    del generated, queuedAt
+    arrivals[1:] -= arrivals[:-1].copy()
+    return arrivals
+
+
+def _drainQueues(backlog: Any, arrivals: Any, bandwidth: float, horizon: int,
+                 pruners: Optional[List[Optional[RetentionPruner]]] = None,
+                 startEpoch: int = 0) \
+        -> Tuple[Optional[int], List[Optional[int]], List[float]]:
+    """
+    The rest of `simulateSync`, once `arrivals` are laid out.
+    """
+    np = numpy()
+    agents = len(backlog)
+
+    # The total backlog is a Lindley recursion, W = max(0, W + X), which has
+    # a closed form over cumulative sums; that tells us how many hours the
+    # per-agent loop below needs to run. Culls only take bytes off, so with
+    # them it's a bound, and the loop finds the hour.
+    drift = np.cumsum(arrivals.sum(axis=1) - bandwidth) + backlog.sum()
+    total = drift - np.minimum(0.0, np.minimum.accumulate(drift))
+    empty = np.flatnonzero(total <= _EPSILON)
+    if backlog.sum() <= _EPSILON:
+        bound = 0  # type: Optional[int]
+    else:
+        bound = int(empty[0]) + 1 if len(empty) else None
+
+    pruning = [(agent, pruner) for agent, pruner in enumerate(pruners or ())
+               if pruner is not None and not pruner.done]
+    hours = None if pruning else bound
+    pruned = np.zeros(agents)
+
+    agentHours = np.where(backlog <= _EPSILON, 0, -1)
+    queue = backlog.copy()
+    for hour in range(horizon if bound is None else bound):
+        if hours is not None and (agentHours >= 0).all():
+            break
+        queue += arrivals[hour]
+        # The ledger's what's at the head of the queue, so it has the bytes.
+        for agent, pruner in pruning:
+            culled = pruner.cull(startEpoch + hour * 3600)
+            pruned[agent] += culled
+            queue[agent] = max(0.0, queue[agent] - culled)
+
+        sent = _waterFill(queue, bandwidth)
+        queue -= sent
+        for agent, pruner in pruning:
+            pruner.send(sent[agent])
+        pruning = [(agent, pruner) for agent, pruner in pruning
+                   if not pruner.done]
+
+        agentHours[(agentHours < 0) & (queue <= _EPSILON)] = hour + 1
+        if hours is None and queue.sum() <= _EPSILON:
+            hours = hour + 1
+
+    return hours if hours is not None else bound, \
+        [int(h) if h >= 0 else None for h in agentHours], pruned.tolist()
+
+
+def _waterFill(queue: Any, bandwidth: float) -> Any:
+    """
+    Split `bandwidth` evenly across `queue`, topping up the smallest first.
+    Returns how much each entry is sent.
+    """
+    np = numpy()
+    if queue.sum() <= bandwidth:
+        return queue.copy()
+
+    ordered = np.sort(queue)
+    remaining = len(ordered) - np.arange(len(ordered))
+    below = np.concatenate(([0.0], np.cumsum(ordered)[:-1]))
+    # Cost of raising everyone to each sorted level; find the last we afford.
+    full = int(np.searchsorted(below + ordered * remaining, bandwidth,
+                               side='right'))
+    # Summed in sorted order, the whole queue can fit where `sum` said it
+    # didn't, by a rounding error; then it's sent the lot.
+    if full == len(ordered):
+        return queue.copy()
+    level = (bandwidth - below[full]) / remaining[full]
+    return np.minimum(queue, level)
+
+
+def _simulateSyncLoop(backlog: Sequence[float], local: List[List[bool]],
+                      offsite: List[List[bool]], rates: Sequence[float],
+                      bandwidth: Union[float, Sequence[float]],
+                      startHour: int, horizon: int,
+                      pruners: Optional[List[Optional[RetentionPruner]]] = None,
+                      startEpoch: int = 0) \
+        -> Tuple[Optional[int], List[Optional[int]], List[float]]:
+    """
+    `simulateSync` without NumPy; same model, one agent at a time. For
+    `_simulateTrials`, `bandwidth` may also be given hour by hour.
+    """
+    if isinstance(bandwidth, (int, float)):
+        bandwidth = [bandwidth] * horizon
+    queue = [float(size) for size in backlog]
+    unqueued = [0.0] * len(queue)
+    pruned = [0.0] * len(queue)
+    pruners = pruners or [None] * len(queue)
+    agentHours = [0 if size <= _EPSILON else None
+                  for size in queue]  # type: List[Optional[int]]
+    hours = 0 if sum(queue) <= _EPSILON else None
+
+    for hour in range(horizon):
+        if hours is not None and None not in agentHours:
+            break
+        week = (startHour + hour) % HOURS_PER_WEEK
+        for agent, rate in enumerate(rates):
+            if local[agent][week]:
+                unqueued[agent] += rate
+            if offsite[agent][week]:
+                queue[agent] += unqueued[agent]
+                unqueued[agent] = 0.0
+            if pruners[agent] is not None and not pruners[agent].done:
+                culled = pruners[agent].cull(startEpoch + hour * 3600)
+                pruned[agent] += culled
+                queue[agent] = max(0.0, queue[agent] - culled)
+
+        # Even split, smallest queues first, as in `_waterFill`.
+        spare = bandwidth[hour]
+        order = sorted(range(len(queue)), key=queue.__getitem__)
+        for position, agent in enumerate(order):
+            sent = min(queue[agent], spare / (len(order) - position))
+            queue[agent] -= sent
+            spare -= sent
+            if pruners[agent] is not None:
+                pruners[agent].send(sent)
+            if queue[agent] <= _EPSILON and agentHours[agent] is None:
+                agentHours[agent] = hour + 1
+        if hours is None and sum(queue) <= _EPSILON:
+            hours = hour + 1
+
+    return hours, agentHours, pruned
+
+
+def _simulateTrials(model: MonteCarloModel, seed: Any, trials: int) \
+        -> List[Tuple[Optional[int], List[Optional[int]]]]:
+    """
+    Run `trials` of `Timeline.monteCarlo` with the random stream `seed` (a
+    NumPy `SeedSequence`, or a string for `random.Random` without NumPy),
+    returning the hours until all and each agent are caught up in each.
+    With NumPy, the trials are drawn and drained all at once.
+    """
+    import random
+
+    np = numpy()
+    if np is None:
+        rng = random.Random(seed)
+
+        def draw(values: Any) -> float:
+            return sum(values[rng.randrange(len(values))]
+                       for _ in range(len(values))) / len(values)
+
+        outcomes = []
+        for _ in range(trials):
+            rates = [draw(sizes) * perHour if sizes is not None else rate
+                     for sizes, perHour, rate in zip(
+                         model.sizes, model.perHour, model.rates)]
+            bandwidth = model.bandwidth  # type: Union[float, List[float]]
+            if len(model.throughput):
+                level = draw(model.throughput) / model.bandwidth
+                bandwidth = [min(level * model.throughput[rng.randrange(
+                    len(model.throughput))], model.speedLimit)
+                             for _ in range(model.horizon)]
+            hours, agentHours, _ = _simulateSyncLoop(
+                model.backlog, model.local, model.offsite, rates, bandwidth,
+                model.startHour, model.horizon,
+                [pruner.copy() if pruner is not None else None
+                 for pruner in model.pruners], model.startEpoch)
+            outcomes.append((hours, agentHours))
+        return outcomes
+
+    rng = np.random.default_rng(seed)
+
+    def draws(values: Any) -> Any:
+        # Each trial's mean of a resample of `values`.
+        return values[rng.integers(0, len(values),
+                                   (trials, len(values)))].mean(axis=1)
+
+    backlog = np.asarray(model.backlog, dtype=np.float64)
+    if not len(backlog):
+        return [(0, [])] * trials
+
+    # trials x agents
+    rates = np.column_stack([
+        draws(sizes) * perHour if sizes is not None else np.full(trials, rate)
+        for sizes, perHour, rate in zip(model.sizes, model.perHour,
+                                        model.rates)])
+    if len(model.throughput):
+        # trials x hours
+        level = draws(model.throughput) / model.bandwidth
+        bandwidth = np.minimum(level[:, None] * model.throughput[rng.integers(
+            0, len(model.throughput), (trials, model.horizon))],
+            model.speedLimit)
+    else:
+        bandwidth = np.full(trials, float(model.bandwidth))
+    hours, agentHours = _drainTrials(backlog, model.arrivals, rates,
+                                     bandwidth, model.horizon, model.culls)
+    return [(None if taken < 0 else int(taken),
+             [int(h) if h >= 0 else None for h in agents])
+            for taken, agents in zip(hours.tolist(), agentHours.tolist())]
+
+
+def _cullSchedule(pruners: List[Optional[RetentionPruner]], startEpoch: int,
+                  horizon: int) -> Optional[CullSchedule]:
+    """
+    Every snapshot `pruners` could cull within `horizon` hours of
+    `startEpoch`, for `_drainTrials`; None if there are none.
+    """
+    np = numpy()
+    snapshots = [(agent, position, hour, size, ahead)
+                 for agent, pruner in enumerate(pruners) if pruner is not None
+                 for hour, position, size, ahead in pruner.schedule(startEpoch)
+                 if hour < horizon]
+    if not snapshots:
+        return None
+
+    # By agent, and by position in its ledger.
+    snapshots.sort()
+    agents, _, hours, sizes, ahead = [np.asarray(column) for column in
+                                      zip(*snapshots)]
+    first = np.searchsorted(agents, agents)
+    return CullSchedule(agents=agents, sizes=sizes.astype(np.float64),
+                        ahead=ahead.astype(np.float64), first=first,
+                        hours=[(int(hour), np.flatnonzero(hours == hour))
+                               for hour in np.unique(hours)])
+
+
+def _drainTrials(backlog: Any, unit: Any, rates: Any, bandwidth: Any,
+                 horizon: int, culls: Optional[CullSchedule] = None) \
+        -> Tuple[Any, Any]:
+    """
+    `_drainQueues` for a batch of trials at once, each a row of `rates`
+    (trials x agents) and of `bandwidth` (trials, or trials x hours for it
+    to vary hour to hour), with `unit` the arrivals at rates of 1, and
+    `culls` what the agents' pruners would cull. Returns the hours until
+    every queue and until each agent's is first empty in each trial (trials,
+    and trials x agents), -1 past the horizon.
+    """
+    np = numpy()
+    trials = len(bandwidth)
+    agents = len(backlog)
+    bandwidth = np.broadcast_to(bandwidth.reshape(trials, -1),
+                                (trials, horizon))
+
+    # The Lindley recursion of `_drainQueues`, for every trial (hours x
+    # trials), gives the hours until all are caught up outright, or without
+    # culls, a bound on it.
+    drift = np.cumsum(unit.dot(rates.T) - bandwidth.T, axis=0) \
+        + backlog.sum()
+    total = drift - np.minimum(0.0, np.minimum.accumulate(drift, axis=0))
+    empty = total <= _EPSILON
+    if backlog.sum() <= _EPSILON:
+        hours = np.zeros(trials, dtype=np.int64)
+    else:
+        hours = np.where(empty.any(axis=0), empty.argmax(axis=0) + 1, -1)
+    bound = hours
+    if culls is not None:
+        hours = np.where(bound == 0, 0, -1)
+
+        # Each trial's bytes sent of each agent's ledger, and culled from
+        # it, in all and of each snapshot. A snapshot's culled if sending
+        # hasn't reached it, past the snapshots ahead of it not culled
+        # before then.
+        ledgerSent = np.zeros((trials, agents))
+        ledgerCulled = np.zeros((trials, agents))
+        culled = np.zeros((trials, len(culls.sizes)))
+        cullsAt = dict(culls.hours)
+
+    agentHours = np.where(backlog <= _EPSILON, 0, -1) * np.ones(
+        (trials, 1), dtype=np.int64)
+    queue = np.tile(backlog, (trials, 1))
+    for hour in range(horizon if (bound < 0).any() else int(bound.max())):
+        if (agentHours >= 0).all() and (hours >= 0).all():
+            break
+        queue += unit[hour] * rates
+        if culls is not None and hour in cullsAt:
+            due = cullsAt[hour]
+            before = np.cumsum(culled, axis=1) - culled
+            ahead = culls.ahead[due] - (before[:, due]
+                                        - before[:, culls.first[due]])
+            cut = np.where(ledgerSent[:, culls.agents[due]] > ahead, 0.0,
+                           culls.sizes[due])
+            culled[:, due] = cut
+            cutFrom = np.zeros((trials, agents))
+            np.add.at(cutFrom, (slice(None), culls.agents[due]), cut)
+            ledgerCulled += cutFrom
+            np.maximum(queue - cutFrom, 0.0, out=queue)
+        sent = _waterFillRows(queue, bandwidth[:, hour])
+        queue -= sent
+        if culls is not None:
+            ledgerSent += np.minimum(sent, backlog - ledgerSent - ledgerCulled)
+            hours[(hours < 0) & (queue.sum(axis=1) <= _EPSILON)] = hour + 1
+        agentHours[(agentHours < 0) & (queue <= _EPSILON)] = hour + 1
+
+    if culls is not None:
+        hours = np.where(hours < 0, bound, hours)
+    return hours, agentHours
+
+
+def _waterFillRows(queue: Any, bandwidth: Any) -> Any:
+    """
+    `_waterFill` each row of `queue` with its entry of `bandwidth`.
+    """
+    np = numpy()
+    agents = queue.shape[1]
+    ordered = np.sort(queue, axis=1)
+    remaining = agents - np.arange(agents)
+    below = np.cumsum(ordered, axis=1) - ordered
+    full = (below + ordered * remaining
+            <= bandwidth[:, None]).sum(axis=1)
+    last = np.minimum(full, agents - 1)
+    level = (bandwidth - below[np.arange(len(queue)), last]) / remaining[last]
+    # Rows whose whole queue fits are sent the lot.
+    level[full == agents] = np.inf
+    return np.minimum(queue, level[:, None])
+
+
+def percentile(hours: List[Optional[int]], percent: float) -> Optional[int]:
+    """
+    The `percent`th percentile (nearest rank) of `hours`, where None (not
+    within the horizon) is longer than any; None if it falls on one.
+    """
+    if not hours:
+        return None
+    ordered = sorted(hours, key=lambda taken: math.inf if taken is None
+                     else taken)
+    rank = max(1, int(math.ceil(percent / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def formatHours(start: datetime.datetime, hours: Optional[int],
+                horizon: int) -> str:
+    """
+    When something `hours` from `start` is, or that it's past `horizon`.
+    """
+    if hours is None:
+        return 'not within {} hours'.format(horizon)
+    return 'in {} hours ({})'.format(hours, (
+        start + datetime.timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M'))
+
+
+def formatDistribution(distribution: SyncDistribution) -> List[str]:
+    """
+    Lines of a report on `distribution`, like `formatEstimate`'s.
+    """
+    def when(hours: List[Optional[int]]) -> str:
+        return ', '.join('P{:g} {}'.format(percent, formatHours(
+            distribution.start, taken, distribution.horizon))
+            for percent, taken in zip(distribution.percentiles, hours))
+
+    lines = ['{} trials across {} agents (--seed {})'.format(
+        distribution.trials, len(distribution.agents), distribution.seed)]
+    for agent, hours in zip(distribution.agents, distribution.agentHours):
+        lines.append('{}: caught up {}'.format(agent, when(hours)))
+    lines.append('All agents caught up {}'.format(when(distribution.hours)))
+    return lines
+
+
+def formatEstimate(estimate: SyncEstimate) -> List[str]:
+    """
+    Lines of a report on `estimate`: a summary, one per agent (in order),
+    and when everything's caught up.
+    """
+    def when(hours: Optional[int]) -> str:
+        return formatHours(estimate.start, hours, estimate.horizon)
+
+    lines = ['{} pending offsite across {} agents at {}/s'.format(
+        humanBytes(sum(estimate.backlog)), len(estimate.agents),
+        humanBytes(estimate.bandwidth / 3600))]
+    for agent, backlog, hours, pruned in zip(
+            estimate.agents, estimate.backlog, estimate.agentHours,
+            estimate.pruned):
+        lines.append('{}: {} pending{}, caught up {}'.format(
+            agent, humanBytes(backlog),
+            ' ({} of it culled by retention before it\'s sent)'.format(
+                humanBytes(pruned)) if pruned else '', when(hours)))
+    lines.append('All agents caught up {}'.format(when(estimate.hours)))
+    return lines
+
+
+def estimateRecord(estimate: SyncEstimate) -> Dict[str, Any]:
+    """
+    `estimate` as something `json.dumps` can take; bytes, and hours from
+    `start` (None if not within `horizon`).
+    """
+    return OrderedDict([
+        ('start', estimate.start.isoformat()),
+        ('bandwidth', estimate.bandwidth / 3600),  # bytes/s
+        ('backlog', sum(estimate.backlog)),
+        ('horizon', estimate.horizon),
+        ('hours', estimate.hours),
+        ('agents', OrderedDict(
+            (agent, {'backlog': backlog, 'hours': hours, 'pruned': pruned})
+            for agent, backlog, hours, pruned in zip(
+                estimate.agents, estimate.backlog, estimate.agentHours,
+                estimate.pruned)
+        ))
+    ])
+
+
+def formatWeek(counts: Sequence[int]) -> List[str]:
+    """
+    Lines of a table of `HOURS_PER_WEEK` `counts`; a row per day, a column
+    per hour.
+    """
+    lines = ['     ' + ''.join('{:>3}'.format(hour) for hour in range(24))]
+    for day, name in enumerate(('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri',
+                                'Sat')):
+        lines.append('{:<5}'.format(name) + ''.join(
+            '{:>3}'.format(count) for count in counts[day * 24:day * 24 + 24]))
+    return lines
+
+
+def exportTimeline(timeline: 'Timeline', path: str) -> str:
+    """
+    Write what `timeline` simulates from to `path` as columnar tables (see
+    `exportTables`), for notebooks and `Timeline.fromExport`. With PyArrow
+    installed `path` becomes a directory of Arrow IPC (Feather) files, one
+    per table, unless it ends in .npz; otherwise it's an uncompressed .npz
+    of `<table>.<column>` arrays. Returns the path written.
+    """
+    import tempfile
+
+    tables = exportTables(timeline)
+
+    pa = pyarrow()
+    if pa is not None and not path.endswith('.npz'):
+        os.makedirs(path, exist_ok=True)
+        for name, columns in tables.items():
+            table = pa.table(columns)
+            with pa.OSFile(os.path.join(path, name + '.arrow'), 'wb') \
+                    as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return path
+
+    if not path.endswith('.npz'):
+        path += '.npz'
+    directory = os.path.dirname(path) or '.'
+    handle, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as exportFile:
+            # Stored, not deflated, so `loadExport` can map the arrays.
+            numpy().savez(exportFile, **dict(
+                ('{}.{}'.format(name, column), values)
+                for name, columns in tables.items()
+                for column, values in columns.items()
+            ))
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return path
+
+
+def exportTables(timeline: 'Timeline') -> Dict[str, Dict[str, Any]]:
+    """
+    `timeline`'s agents and keys as tables of NumPy columns, rows grouped
+    by `agent` (a row of `agents`) where they're per agent:
+
+        meta       version, now, bandwidth (bytes/hour, NaN if unknown),
+                   speedLimit (bytes/s, NaN if none)
+        agents     dataset, estimated, interval (-1 if none), schedule and
+                   offsiteSchedule (whether the agent has them), parsed
+        snapshots  agent, epoch, written, compressratio, size
+        schedules  agent, hour (of the week), local, offsite
+        retention  agent, offsite, intra, daily, weekly, total
+        points     agent, epoch
+        transfers  agent, epoch, size
+
+    `written` and `compressratio` come from another `zfs list` unless the
+    timeline was itself loaded from an export; they're -1 and NaN for any
+    snapshot gone since.
+    """
+    np = numpy()
+    if np is None:
+        raise ImportError('Exporting needs NumPy')
+
+    datasets = timeline.agents
+    keys = [timeline.keys[basename(dataset)] for dataset in datasets]
+    positions = np.arange(len(datasets), dtype=np.int32)
+    lengths = [len(series) for series in timeline.snaps]
+
+    details = timeline.details
+    if details is None:
+        listed = listSnapshotDetails(datasets, timeline._parents(),
+                                     timeline.timeout)
+        details = {}
+        for dataset, series in zip(datasets, timeline.snaps):
+            columns = [listed[dataset].get(epochInt, (-1, math.nan))
+                       for epochInt in series.epochs.tolist()]
+            details[dataset] = (
+                np.array([written for written, _ in columns], np.int64),
+                np.array([ratio for _, ratio in columns], np.float64))
+
+    def perAgent(counts: List[int], **columns: Any) -> Dict[str, Any]:
+        table = OrderedDict([('agent', np.repeat(positions, counts))])
+        table.update(columns)
+        return table
+
+    def concatenate(arrays: List[Any], dtype: Any) -> Any:
+        return np.concatenate([np.asarray(values, dtype) for values in arrays]
+                              or [np.zeros(0, dtype)])
+
+    def masks(field: str) -> Any:
+        packed = b''.join(
+            (ScheduleMasks.FULL if getattr(key, field) is None
+             else getattr(key, field)).to_bytes(ScheduleMasks.BYTES,
+                                                'little')
+            for key in keys)
+        return np.unpackbits(np.frombuffer(packed, np.uint8),
+                             bitorder='little').astype(bool)
+
+    policies = [(position, offsite, policy)
+                for position, key in enumerate(keys)
+                for offsite, policy in ((False, key.retention),
+                                        (True, key.offsiteRetention))
+                if policy]
+    policy = np.array([policy for _, _, policy in policies],
+                      np.int64).reshape(len(policies), 4)
+    points = [key.offSitePoints or [] for key in keys]
+    transfers = [sorted((key.transfers or {}).items()) for key in keys]
+    bandwidth = timeline.bandwidth
+
+    return OrderedDict([
+        ('meta', OrderedDict([
+            ('version', np.array([EXPORT_VERSION], np.int64)),
+            ('now', np.array([timeline.now.timestamp()], np.float64)),
+            ('bandwidth', np.array([math.nan if bandwidth is None
+                                    else bandwidth], np.float64)),
+            ('speedLimit', np.array([timeline.speedLimit or math.nan],
+                                    np.float64))
+        ])),
+        ('agents', OrderedDict([
+            ('dataset', np.array(datasets, dtype=str)),
+            ('estimated', np.array([basename(dataset) in
+                                    timeline.agent_identifiers
+                                    for dataset in datasets], dtype=bool)),
+            ('interval', np.array([-1 if key.interval is None
+                                   else key.interval for key in keys],
+                                  np.int64)),
+            ('schedule', np.array([key.schedule is not None
+                                   for key in keys], dtype=bool)),
+            ('offsiteSchedule', np.array([key.offsiteSchedule is not None
+                                          for key in keys], dtype=bool)),
+            ('parsed', np.array([key.parsed for key in keys], np.int64))
+        ])),
+        ('snapshots', perAgent(
+            lengths,
+            epoch=concatenate([series.epochs for series in timeline.snaps],
+                              np.int64),
+            written=concatenate([details[dataset][0]
+                                 for dataset in datasets], np.int64),
+            compressratio=concatenate([details[dataset][1]
+                                       for dataset in datasets], np.float64),
+            size=concatenate([series.sizes for series in timeline.snaps],
+                             np.int64)
+        )),
+        ('schedules', perAgent(
+            [HOURS_PER_WEEK] * len(keys),
+            hour=np.tile(np.arange(HOURS_PER_WEEK, dtype=np.int16),
+                         len(keys)),
+            local=masks('schedule'),
+            offsite=masks('offsiteSchedule')
+        )),
+        ('retention', OrderedDict([
+            ('agent', np.array([position for position, _, _ in policies],
+                               np.int32)),
+            ('offsite', np.array([offsite for _, offsite, _ in policies],
+                                 dtype=bool)),
+            ('intra', policy[:, 0]),
+            ('daily', policy[:, 1]),
+            ('weekly', policy[:, 2]),
+            ('total', policy[:, 3])
+        ])),
+        ('points', perAgent(list(map(len, points)),
+                            epoch=concatenate(points, np.int64))),
+        ('transfers', perAgent(
+            list(map(len, transfers)),
+            epoch=concatenate([[epochInt for epochInt, _ in sent]
+                               for sent in transfers], np.int64),
+            size=concatenate([[size for _, size in sent]
+                              for sent in transfers], np.int64)
+        ))
+    ])
+
+
+def loadExport(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Read back what `exportTimeline` wrote to `path`, as NumPy columns that
+    are views of the memory-mapped files wherever the format allows.
+    """
+    np = numpy()
+    if np is None:
+        raise ImportError('Loading an export needs NumPy')
+
+    tables = {}  # type: Dict[str, Dict[str, Any]]
+    if os.path.isdir(path):
+        pa = pyarrow()
+        if pa is None:
+            raise ImportError('Loading an Arrow export needs PyArrow')
+        for entry in sorted(os.listdir(path)):
+            name, extension = os.path.splitext(entry)
+            if extension != '.arrow':
+                continue
+            table = pa.ipc.open_file(
+                pa.memory_map(os.path.join(path, entry))).read_all()
+            tables[name] = dict((column, table.column(column).to_numpy())
+                                for column in table.column_names)
+    else:
+        for name, values in _mapNpz(path).items():
+            table, _, column = name.partition('.')
+            tables.setdefault(table, {})[column] = values
+
+    version = tables.get('meta', {}).get('version')
+    if version is None or int(version[0]) != EXPORT_VERSION:
+        raise ValueError('{} isn\'t an export this version can read'.format(
+            path))
+    return tables
+
+
+def isExport(path: str) -> bool:
+    """
+    Whether `path` looks like something `exportTimeline` wrote: a directory
+    of Arrow files, or a .npz.
+    """
+    import zipfile
+
+    if os.path.isdir(path):
+        return os.path.isfile(os.path.join(path, 'meta.arrow'))
+    return zipfile.is_zipfile(path)
+
+
+def _mapNpz(path: str) -> Dict[str, Any]:
+    """
+    Memory-map every array stored uncompressed in the .npz at `path`;
+    anything deflated is read in as usual.
+    """
+    import zipfile
+
+    np = numpy()
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as raw:
+        for member in archive.infolist():
+            name, extension = os.path.splitext(member.filename)
+            if extension != '.npy':
+                continue
+            if member.compress_type != zipfile.ZIP_STORED:
+                with archive.open(member) as deflated:
+                    arrays[name] = np.load(deflated)
+                continue
+
+            # Skip the member's local header to the .npy inside.
+            raw.seek(member.header_offset + 26)
+            nameLength, extraLength = struct.unpack('<HH', raw.read(4))
+            raw.seek(nameLength + extraLength, os.SEEK_CUR)
+            version = np.lib.format.read_magic(raw)
+            readHeader = np.lib.format.read_array_header_1_0 \
+                if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = readHeader(raw)
+
+            if not int(np.prod(shape)):
+                arrays[name] = np.zeros(shape, dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype, 'r', raw.tell(), shape,
+                                         'F' if fortran else 'C')
+    return arrays
+
+
+def _splitRows(table: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    """
+    Split a table whose rows are grouped by `agent` into `count` tables, one
+    per agent, of views.
+    """
+    np = numpy()
+    bounds = np.searchsorted(table['agent'], np.arange(count + 1))
+    return [dict((column, values[start:end])
+                 for column, values in table.items())
+            for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+
+def importKeys(tables: Dict[str, Dict[str, Any]]) -> Dict[str, AgentKeys]:
+    """
+    Every exported agent's keys, from `loadExport`'s tables, as
+    `loadAgentKeys` would have decoded them (without `agentInfo`).
+    """
+    np = numpy()
+    agents = tables['agents']
+    count = len(agents['dataset'])
+    schedules = _splitRows(tables['schedules'], count)
+    retention = _splitRows(tables['retention'], count)
+    points = _splitRows(tables['points'], count)
+    transfers = _splitRows(tables['transfers'], count)
+
+    def mask(flags: Any) -> int:
+        return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(),
+                              'little')
+
+    def policy(rows: Dict[str, Any], offsite: bool) -> Optional[List[int]]:
+        matches = np.flatnonzero(rows['offsite'] == offsite)
+        if not len(matches):
+            return None
+        return [int(rows[field][matches[0]])
+                for field in ('intra', 'daily', 'weekly', 'total')]
+
+    keys = {}
+    for position in range(count):
+        agent = basename(str(agents['dataset'][position]))
+        interval = int(agents['interval'][position])
+        keys[agent] = AgentKeys(
+            agent=agent,
+            schedule=mask(schedules[position]['local'])
+            if agents['schedule'][position] else None,
+            offsiteSchedule=mask(schedules[position]['offsite'])
+            if agents['offsiteSchedule'][position] else None,
+            retention=policy(retention[position], False),
+            offsiteRetention=policy(retention[position], True),
+            interval=None if interval < 0 else interval,
+            offSitePoints=points[position]['epoch'].tolist(),
+            transfers=dict(zip(transfers[position]['epoch'].tolist(),
+                               transfers[position]['size'].tolist())),
+            agentInfo=None,
+            errors={},
+            parsed=int(agents['parsed'][position])
+        )
+    return keys
+
+
+def readSpeedLimit() -> Optional[int]:
+    """
+    Read the appliance's offsite upload speed limit (KiB/s), if one's set.
+    """
+    try:
+        with open(SPEED_LIMIT, 'r') as limit:
+            return int(limit.readline().strip()) or None
+    except (OSError, ValueError):
+        return None
+
+
+def humanBytes(size: float) -> str:
+    """
+    Format a number of bytes for reading.
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(size) < 1024 or unit == 'TiB':
+            break
+        size /= 1024
+    return '{:.1f} {}'.format(size, unit)
+
+
+def _day(epochInt: int) -> int:
+    return epochInt // 86400
+
+
+def _week(epochInt: int) -> int:
+    # The epoch was a Thursday; weeks start on Sunday.
+    return (epochInt // 86400 + 4) // 7
+
+
+def _month(epochInt: int) -> int:
+    moment = gmtime(epochInt)
+    return moment.tm_year * 12 + moment.tm_mon
+
+
+def asSeries(snapshots: Union[Dict[int, int], SnapshotSeries]) \
+        -> SnapshotSeries:
+    """
+    `snapshots` as a series, if they aren't one already.
+    """
+    if isinstance(snapshots, SnapshotSeries):
+        return snapshots
+    return SnapshotSeries.fromDict(snapshots)
+
+
+def parseSnapshot(line: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Parse a line of `ZFS_list_snapshots` output into (dataset, epoch,
+    transfer size), or None if it isn't one of our epoch-named snapshots.
+    """
+    snapshot = parseSnapshotFields(line)
+    if snapshot is None:
+        return None
+
+    dataset, epochInt, epochSize, compressRatio = snapshot
+    return dataset, epochInt, int(epochSize * compressRatio)
+
+
+def parseSnapshotFields(line: str) \
+        -> Optional[Tuple[str, int, int, float]]:
+    """
+    Parse a line of `ZFS_list_snapshots` output into (dataset, epoch,
+    written, compression ratio), or None if it isn't one of our epoch-named
+    snapshots.
+    """
+    fields = re.split(spaces, line.strip())
+    if len(fields) < 3:
+        return None
+
+    dataset, _, name = fields[0].partition('@')
+    if not name.isdigit():
+        return None
+
+    return dataset, int(name), int(fields[1]), float(fields[2].rstrip('x'))
+
+
+def listAgents(datasets: Optional[List[str]] = None,
+               timeout: Optional[float] = None) -> List[str]:
+    """
+    Every agent's dataset or, given `datasets`, just those, so asking about
+    a few agents doesn't list the whole pool. If any of `datasets` isn't an
+    agent's dataset that exists, every agent is listed after all, for
+    `Timeline._selectAgents` to warn about it against.
+    """
+    command = ZFS_agent_list.split() + list(datasets or [])
+    try:
+        agents = [dataset for dataset in iterIO(command, timeout,
+                                                name=ZFS_agent_list)
+                  if dataset and agentDatasets.search(dataset)]
+    except CommandError:
+        # `zfs` lists what exists but fails on what doesn't.
+        if not datasets:
+            raise
+        agents = []
+
+    if datasets and set(agents) != set(datasets):
+        return listAgents(None, timeout)
+    return agents
+
+
+async def listAgentsAsync(datasets: Optional[List[str]] = None,
+                          limit: Optional['asyncio.Semaphore'] = None,
+                          timeout: Optional[float] = None) \
+        -> List[str]:
+    """
+    `listAgents` with an asyncio subprocess.
+    """
+    command = ZFS_agent_list.split() + list(datasets or [])
+    try:
+        agents = [dataset for dataset in await getIOAsync(command, limit,
+                                                          timeout)
+                  if agentDatasets.search(dataset)]
+    except CommandError:
+        if not datasets:
+            raise
+        agents = []
+
+    if datasets and set(agents) != set(datasets):
+        return await listAgentsAsync(None, limit, timeout)
+    return agents
+
+
+def getAllSnapshots(agents: List[str], parents: Optional[List[str]] = None,
+                    timeout: Optional[float] = None) \
+        -> Dict[str, Dict[int, int]]:
+    """
+    Get the snapshots of every agent in `agents` (full dataset names) as
+    dictionaries of epoch -> transfer size, with a single `zfs list` whose
+    output is partitioned by agent as it's read. If `parents` is given, those
+    datasets are listed recursively instead of naming each agent.
+    """
+    snapshots = OrderedDict((agent, {}) for agent in agents)
+    if not agents:
+        return snapshots
+
+    command = ZFS_list_snapshots.split() + (parents or agents)
+    for line in iterIO(command, timeout, name=ZFS_list_snapshots):
+        _addSnapshot(snapshots, line)
+
+    return snapshots
+
+
+def getAllSnapshotsIncremental(agents: List[str], state: SnapshotState,
+                               parents: Optional[List[str]] = None,
+                               timeout: Optional[float] = None,
+                               batch: int = 512) \
+        -> Dict[str, SnapshotSeries]:
+    """
+    `getAllSnapshots` against `state`, as series. Agents `state` hasn't
+    seen are listed in full. For the rest only snapshot names are listed,
+    which spares `zfs` working out every snapshot's `written`; sizes are
+    then fetched (`batch` snapshots a call) for just the snapshots newer
+    than the agent's watermark, and for those after any that were deleted
+    since (tombstones, dropped from the series), as `written` takes in what
+    a deleted snapshot held. Snapshots destroyed between the listing and
+    the sizing are tombstones like the rest. `state` is updated, but not
+    saved.
+    """
+    series = OrderedDict((agent, None) for agent in agents)  # type: Dict
+    fresh = [agent for agent in agents if agent not in state]
+    known = [agent for agent in agents if agent in state]
+
+    if fresh:
+        listed = getAllSnapshots(fresh, timeout=timeout)
+        for agent in fresh:
+            state[agent] = series[agent] = SnapshotSeries.fromDict(
+                listed[agent])
+
+    if known:
+        # agent -> epoch -> snapshot name, of what's there now
+        names = OrderedDict((agent, {}) for agent in known)
+        command = ZFS_list_snapshot_names.split() + (parents or known)
+        for line in iterIO(command, timeout, name=ZFS_list_snapshot_names):
+            snapshot = line.split('\t', 1)[0].strip()
+            dataset, _, name = snapshot.partition('@')
+            if not name.isdigit():
+                continue
+            while dataset and dataset not in names:
+                dataset = os.path.dirname(dataset)
+            if dataset:
+                names[dataset][int(name)] = snapshot
+
+        wanted = {}  # type: Dict[str, Tuple[str, int]]
+        deletions = {}  # type: Dict[str, Set[int]]
+        for agent in known:
+            listed = names[agent]
+            watermark = state.watermark(agent)
+            epochs = state[agent].epochs.tolist()
+            deleted = [epochInt for epochInt in epochs
+                       if epochInt not in listed]
+            deletions[agent] = set(deleted)
+
+            changed = set(epochInt for epochInt in listed
+                          if watermark is None or epochInt > watermark)
+            ordered = sorted(listed)
+            for epochInt in deleted:
+                after = bisect_left(ordered, epochInt)
+                if after < len(ordered):
+                    changed.add(ordered[after])
+            for epochInt in changed:
+                wanted[listed[epochInt]] = (agent, epochInt)
+
+        sizes = dict((agent, {}) for agent in known)
+        while wanted:
+            snapshots = list(wanted)
+            fetched = {}  # type: Dict[str, int]
+            for start in range(0, len(snapshots), batch):
+                fetched.update(getSnapshotSizes(
+                    snapshots[start:start + batch], timeout))
+
+            # Those that didn't come back were destroyed since they were
+            # listed: tombstones too, so what follows them is sized again.
+            gone = [wanted[name] for name in snapshots if name not in fetched]
+            for agent, epochInt in gone:
+                del names[agent][epochInt]
+                deletions[agent].add(epochInt)
+            retry = {}  # type: Dict[str, Tuple[str, int]]
+            for agent, epochInt in gone:
+                ordered = sorted(names[agent])
+                after = bisect_left(ordered, epochInt)
+                if after < len(ordered):
+                    retry[names[agent][ordered[after]]] = (agent,
+                                                           ordered[after])
+            for name, size in fetched.items():
+                if name not in retry:
+                    agent, epochInt = wanted[name]
+                    sizes[agent][epochInt] = size
+            wanted = retry
+
+        for agent in known:
+            state[agent] = series[agent] = state[agent].updated(
+                sizes[agent], deletions[agent])
+
+    return series
+
+
+def getSnapshotSizes(snapshots: List[str], timeout: Optional[float] = None) \
+        -> Dict[str, int]:
+    """
+    Transfer sizes of `snapshots` (full names), as `parseSnapshot` works
+    them out, with one `zfs get`. Snapshots destroyed since they were listed
+    are left out; `zfs` still prints the rest before failing on those.
+    """
+    if not snapshots:
+        return {}
+
+    properties = {}  # type: Dict[str, Dict[str, str]]
+    command = ZFS_get_sizes.split() + snapshots
+    try:
+        for line in iterIO(command, timeout, name=ZFS_get_sizes):
+            fields = line.split('\t')
+            if len(fields) >= 3:
+                properties.setdefault(fields[0], {})[fields[1]] = fields[2]
+    except CommandError as error:
+        if 'does not exist' not in error.stderr:
+            raise
+
+    sizes = {}
+    for name, values in properties.items():
+        try:
+            sizes[name] = int(int(values['written'])
+                              * float(values['compressratio'].rstrip('x')))
+        except (KeyError, ValueError):
+            continue
+    return sizes
+
+
+def listSnapshotDetails(agents: List[str],
+                        parents: Optional[List[str]] = None,
+                        timeout: Optional[float] = None) \
+        -> Dict[str, Dict[int, Tuple[int, float]]]:
+    """
+    Like `getAllSnapshots`, but epoch -> (written, compression ratio).
+    """
+    snapshots = OrderedDict((agent, {}) for agent in agents)
+    if not agents:
+        return snapshots
+
+    command = ZFS_list_snapshots.split() + (parents or agents)
+    for line in iterIO(command, timeout, name=ZFS_list_snapshots):
+        snapshot = parseSnapshotFields(line)
+        if snapshot is None:
+            continue
+        dataset, epochInt, written, ratio = snapshot
+        while dataset and dataset not in snapshots:
+            dataset = os.path.dirname(dataset)
+        if dataset:
+            snapshots[dataset][epochInt] = (written, ratio)
+
+    return snapshots
+
+
+async def getAllSnapshotsAsync(agents: List[str],
+                               parents: Optional[List[str]] = None,
+                               limit: Optional['asyncio.Semaphore'] = None,
+                               timeout: Optional[float] = None) \
+        -> Dict[str, Dict[int, int]]:
+    """
+    `getAllSnapshots` as an asyncio subprocess.
+    """
+    snapshots = OrderedDict((agent, {}) for agent in agents)
+    if agents:
+        command = ZFS_list_snapshots.split() + (parents or agents)
+        await _runAsync(command, lambda line: _addSnapshot(snapshots, line),
+                        limit, timeout, ZFS_list_snapshots)
+    return snapshots
+
+
+def _addSnapshot(snapshots: Dict[str, Dict[int, int]], line: str) -> None:
+    """
+    File a line of `zfs list` output under the agent it's a snapshot of.
+    """
+    snapshot = parseSnapshot(line)
+    if snapshot is None:
+        return
+    dataset, epochInt, size = snapshot
+
+    # Snapshots of an agent's child datasets count towards the agent.
+    while dataset and dataset not in snapshots:
+        dataset = os.path.dirname(dataset)
+    if dataset:
+        snapshots[dataset][epochInt] = size
+
+
+def getIO(command: Union[str, List[str]], timeout: Optional[float] = None) \
+        -> List[str]:
+    """
+    Get results from terminal commands as lists of lines of text.
+    """
+    return [line for line in iterIO(command, timeout) if line]
+
+
+async def getIOAsync(command: Union[str, List[str]],
+                     limit: Optional['asyncio.Semaphore'] = None,
+                     timeout: Optional[float] = None) -> List[str]:
+    """
+    `getIO` as an asyncio subprocess.
+    """
+    lines = []  # type: List[str]
+    await _runAsync(command, lambda line: line and lines.append(line), limit,
+                    timeout)
+    return lines
+
+
+async def _runAsync(command: Union[str, List[str]],
+                    handleLine: Callable[[str], Any],
+                    limit: Optional['asyncio.Semaphore'] = None,
+                    timeout: Optional[float] = None,
+                    name: Optional[str] = None) -> None:
+    """
+    Run `command` as an asyncio subprocess (holding `limit`, if given),
+    handing each line of its stdout to `handleLine` as it arrives. Raises
+    like `iterIO` does, and is timed in `STATS` under `name` likewise.
+    """
+    from subprocess import PIPE, TimeoutExpired
+    import asyncio
+    import shlex
+
+    if isinstance(command, str):
+        command = shlex.split(command)
+
+    async def run() -> None:
+        started = monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            *command, stdout=PIPE, stderr=PIPE)
+        try:
+            async def readStdout() -> None:
+                while True:
+                    line = await proc.stdout.readline()
+                    if not line:
+                        break
+                    handleLine(line.rstrip(b'\n').decode(errors='replace'))
+
+            _, stderr = await asyncio.gather(readStdout(),
+                                             proc.stderr.read())
+            returncode = await proc.wait()
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            STATS.command(name or ' '.join(command), monotonic() - started)
+
+        if returncode:
+            raise CommandError(command, returncode,
+                               stderr.decode(errors='replace'))
+
+    if limit is None:
+        limit = asyncio.Semaphore()
+    async with limit:
+        try:
+            await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutExpired(command, timeout)
+
+
+def iterIO(command: Union[str, List[str]], timeout: Optional[float] = None,
+           chunkSize: int = 65536, maxStderr: int = 65536,
+           name: Optional[str] = None) -> Iterator[str]:
+    """
+    Run `command` (no shell involved) and yield its stdout a line at a time as
+    the child produces it, so memory is bounded by the longest line rather
+    than the whole output. stderr is drained alongside (keeping its last
+    `maxStderr` bytes) so the child can't block on a full pipe.
+
+    Raises `subprocess.TimeoutExpired` if the child runs past `timeout`
+    seconds, and `CommandError` if it exits non-zero. The child is killed if
+    we stop iterating early. Its running time is added to `STATS` under
+    `name` (the command itself by default).
+    """
+    from subprocess import Popen, PIPE, TimeoutExpired
+    import selectors
+    import shlex
+
+    if isinstance(command, str):
+        command = shlex.split(command)
+
+    started = monotonic()
+    deadline = None if timeout is None else started + timeout
+    proc = Popen(command, stdout=PIPE, stderr=PIPE)
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+    selector.register(proc.stderr, selectors.EVENT_READ)
+    remainder = b''
+    stderr = b''
+
+    try:
+        while selector.get_map():
+            wait = None if deadline is None else deadline - monotonic()
+            if wait is not None and wait <= 0:
+                raise TimeoutExpired(command, timeout, stderr=stderr)
+
+            for key, _ in selector.select(wait):
+                data = os.read(key.fd, chunkSize)
+                if not data:
+                    selector.unregister(key.fileobj)
+                elif key.fileobj is proc.stderr:
+                    stderr = (stderr + data)[-maxStderr:]
+                else:
+                    lines = (remainder + data).split(b'\n')
+                    remainder = lines.pop()
+                    for line in lines:
+                        yield line.decode(errors='replace')
+
+        if remainder:
+            yield remainder.decode(errors='replace')
+
+        try:
+            returncode = proc.wait(
+                None if deadline is None else max(0, deadline - monotonic()))
+        except TimeoutExpired:
+            raise TimeoutExpired(command, timeout, stderr=stderr)
+
+        if returncode:
+            raise CommandError(command, returncode,
+                               stderr.decode(errors='replace'))
+    finally:
+        selector.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+        STATS.command(name or ' '.join(command), monotonic() - started)
+
+
+def setRoot(root: str) -> None:
+    """
+    Read the appliance's config, and keep our own state, under `root` rather
+    than '/'; say, an appliance made up by fixtures.py.
+    """
+    for name in _ROOTED:
+        globals()[name] = os.path.join(root, _ROOT_PATHS[name].lstrip('/'))
+
+
+def setStateDir(directory: str) -> None:
+    """
+    Keep our own state in `directory`, wherever `setRoot` put it before.
+    """
+    for name in _STATE:
+        globals()[name] = os.path.join(
+            directory, _ROOT_PATHS[name][len(_ROOT_PATHS['STATE_DIR']):])
+
+
+def flatten(inList: List[List]) -> List:
+    """
+    Similar to Haskell's `concat :: [[a]] -> [a]`.
+    """
+    flatList = []
+    for subList in inList:
+        for string in subList:
+            flatList.append(string)
+    return flatList
+
+
+_numpy = None  # type: Any
+
+
+def numpy(size: Optional[int] = None) -> Any:
+    """
+    Import NumPy the first time it's asked for, returning None if it isn't
+    installed. It's optional, and slow enough to import that we only want it
+    when something actually uses it; and given the `size` of that something
+    (in elements), only if it's at least `NUMPY_THRESHOLD`, unless NumPy's
+    already imported. Smaller work is done as quickly without.
+    """
+    global _numpy
+    if _numpy is None:
+        if size is not None and size < NUMPY_THRESHOLD \
+                and 'numpy' not in sys.modules:
+            return None
+        try:
+            import numpy as np
+        except ImportError:
+            np = False
+        _numpy = np
+    return _numpy or None
+
+
+_pyarrow = None  # type: Any
+
+
+def pyarrow() -> Any:
+    """
+    Import PyArrow (and its IPC module) like `numpy`, returning None if it
+    isn't installed.
+    """
+    global _pyarrow
+    if _pyarrow is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+        except ImportError:
+            pa = False
+        _pyarrow = pa
+    return _pyarrow or None
+
+
+class InvalidArrayFormat(SyntaxError):
+    """
+    Raised when the input "compressed" JSON format is invalid.
+    """
+
+
+class PausedTransfers(Exception):
+    """
+    Raised when Speedsync options are paused.
+    """
+
+
+class CommandError(ValueError):
+    """
+    Raised when a terminal command exits non-zero.
+    """
+
+    def __init__(self, command: List[str], returncode: int, stderr: str) \
+            -> None:
+        super().__init__('Command {!r} exited with status {}: {}'.format(
+            ' '.join(command), returncode, stderr.strip()))
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def estimateAppliance(appliance: str, arguments: 'argparse.Namespace',
+                      state: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Estimate one appliance of a fleet: a directory with the appliance's
+    /datto/config and a bin/zfs standing in for its `zfs` under it, a
+    tarball of one, or an `--export` of it. Anything else is an error, rather
+    than listed with this box's own `zfs`. Returns its `estimateRecord`, or
+    what went wrong, along with whatever was warned about on the way.
+
+    Our state for the appliance is kept in a directory of its own under
+    `state` (`STATE_DIR`/fleet by default), not in the appliance's tree,
+    which may well be a read-only mirror.
+    """
+    from subprocess import TimeoutExpired
+    import tempfile
+    import tarfile
+    import argparse
+
+    state = os.path.join(state or os.path.join(STATE_DIR, 'fleet'),
+                         re.sub(r'[^\w.-]+', '_',
+                                os.path.abspath(appliance).strip('/')))
+    started = monotonic()
+    record = OrderedDict([('appliance', appliance)])
+    path = os.environ.get('PATH', '')
+
+    with warnings.catch_warnings(record=True) as warned, \
+            tempfile.TemporaryDirectory() as extracted:
+        warnings.simplefilter('always', RuntimeWarning)
+        try:
+            arguments = argparse.Namespace(**dict(vars(arguments),
+                                                  agents=None))
+            root = appliance
+            if not os.path.exists(appliance):
+                raise FileNotFoundError('No appliance at ' + appliance)
+            if isExport(appliance):
+                timeline = Timeline.fromExport(appliance, arguments)
+            else:
+                if os.path.isfile(appliance):
+                    with tarfile.open(appliance) as tarball:
+                        if hasattr(tarfile, 'data_filter'):
+                            tarball.extractall(extracted, filter='data')
+                        else:
+                            tarball.extractall(extracted)
+                    root = extracted
+
+                zfs = os.path.join(root, 'bin', 'zfs')
+                if not os.path.isfile(zfs) or not os.access(zfs, os.X_OK):
+                    raise FileNotFoundError(
+                        '{} has neither a bin/zfs to list its snapshots with '
+                        'nor an export to estimate from'.format(appliance))
+                setRoot(root)
+                setStateDir(state)
+                os.environ['PATH'] = os.path.join(root, 'bin') + os.pathsep \
+                    + path
+                timeline = Timeline(arguments)
+            if not timeline.bandwidth:
+                record['error'] = 'No offsite throughput observed or speed ' \
+                                  'limit set'
+            else:
+                record.update(estimateRecord(timeline.simulate()))
+        except (PausedTransfers, CommandError, TimeoutExpired, OSError,
+                ValueError, ImportError, tarfile.TarError) as error:
+            record['error'] = str(error)
+        finally:
+            os.environ['PATH'] = path
+            setRoot('/')
+
+    record['warnings'] = [str(warning.message) for warning in warned]
+    record['seconds'] = monotonic() - started
+    return record
+
+
+def estimateFleet(appliances: List[str], arguments: 'argparse.Namespace',
+                  jobs: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    `estimateAppliance` every one of `appliances` across `jobs` processes,
+    yielding records as they finish (not in order). Each appliance's keys
+    are decoded in its worker, in-process.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import argparse
+
+    arguments = argparse.Namespace(**dict(vars(arguments), processes=1))
+    state = os.path.join(STATE_DIR, 'fleet')
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(estimateAppliance, appliance, arguments, state)
+                   for appliance in appliances]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def checkAgents(agents: Optional[List[str]] = None,
+                timeout: Optional[float] = ZFS_TIMEOUT) \
+        -> Dict[str, Optional[str]]:
+    """
+    Whether each of `agents` (datasets; every agent, by default) could be
+    estimated, short of estimating: that it exists, has snapshots and the
+    keys it can't be estimated without, and isn't paused. Returns what's
+    wrong with each, or None. Only those agents' datasets, required keys and
+    sync options are read, and nothing is cached or saved.
+    """
+    try:
+        Timeline.checkGlobalOptions()
+        paused = None
+    except PausedTransfers as error:
+        paused = str(error)
+
+    datasets = listAgents(agents, timeout)
+    problems = OrderedDict(
+        (dataset, None if dataset in datasets else 'is not in the dataset')
+        for dataset in agents or datasets
+    )  # type: Dict[str, Optional[str]]
+    found = [dataset for dataset, problem in problems.items()
+             if problem is None]
+
+    # Counting snapshots only needs their names.
+    counts = OrderedDict((dataset, 0) for dataset in found)
+    if found:
+        command = ZFS_list_snapshot_names.split() + (
+            found if agents else sorted(set(map(os.path.dirname, found))))
+        for line in iterIO(command, timeout, name=ZFS_list_snapshot_names):
+            dataset, _, name = line.split('\t', 1)[0].strip().partition('@')
+            if not name.isdigit():
+                continue
+            while dataset and dataset not in counts:
+                dataset = os.path.dirname(dataset)
+            if dataset:
+                counts[dataset] += 1
+
+    options = loadSyncOptions(map(basename, found))
+    for dataset in found:
+        agent = basename(dataset)
+        errors = _loadAgentKeys(agent, list(REQUIRED_KEYS)).errors
+        missing = [errors[field] for field in REQUIRED_KEYS if field in errors]
+        if paused:
+            problems[dataset] = paused
+        elif not counts[dataset]:
+            problems[dataset] = 'has no snapshots'
+        elif missing:
+            problems[dataset] = 'has unreadable keys ({})'.format(
+                '; '.join(missing))
+        elif agent not in options:
+            problems[dataset] = 'has no sync options'
+        elif isPaused(options[agent]):
+            problems[dataset] = 'is paused'
+    return problems
+
+
+def main(args: 'argparse.Namespace') -> None:
+    if args.root != '/':
+        setRoot(args.root)
+
+    if args.query is not None:
+        sys.stdout.write(queryDaemon(args.socket, args.query))
+        return
+
+    if args.fleet:
+        import json
+
+        for record in estimateFleet(args.fleet, args, args.jobs):
+            sys.stdout.write(json.dumps(record) + '\n')
+            sys.stdout.flush()
+        return
+
+    if args.check_only:
+        problems = checkAgents(flatten(args.agents) if args.agents else None,
+                               args.zfs_timeout)
+        for dataset, problem in problems.items():
+            sys.stdout.write('{}: {}\n'.format(dataset, problem or 'OK'))
+        sys.exit(1 if any(problems.values()) else 0)
+
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile() if args.profile_format == 'pstats' \
+            else StackSampler()
+        profiler.enable()
+
+    time = None
+    try:
+        if args.asynchronous:
+            import asyncio
+
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                time = loop.run_until_complete(
+                    Timeline.create(args, args.concurrency))
+            finally:
+                loop.close()
+        elif args.offline:
+            time = Timeline.fromExport(args.offline, args)
+        else:
+            time = Timeline(args)
+
+        if args.export:
+            exportTimeline(time, args.export)
+
+        if args.daemon:
+            EstimateDaemon(time, args.socket, args.refresh).serve()
+        elif args.schedule_load:
+            sys.stdout.write(time.scheduleLoad())
+        elif args.monte_carlo:
+            sys.stdout.write(time.runMonteCarlo(
+                args.monte_carlo, args.jobs, args.seed, args.percentiles))
+        else:
+            sys.stdout.write(time.run())
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats_json:
+            STATS.save(args.stats_json, time and time.cache)
+
+
+def argumentParser() -> 'argparse.ArgumentParser':
+    """
+    The command line's parser, for anything that wants our arguments and
+    their defaults without running us (bench.py, say).
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Estimate the amount of time it\'s going to take to '
+                    'complete offsite sync.'
+    )
+
+    # It's okay to list arguments following `-a`, or use multiple `-a`'s.
+    # They'll be `flattened` into the same list anyway.
+    parser.add_argument('-a', '--agents', type=str, action='append', 
+        nargs='+', help='Specific agents to test offsite sync.'
+    )
+
+    parser.add_argument('-b', '--bandwidth', type=int,
+        help='Offsite bandwidth in KiB/s (defaults to the speed limit).'
+    )
+
+    parser.add_argument('--half-life', type=float, default=24,
+        help='Hours for observed throughput to lose half its weight.'
+    )
+
+    parser.add_argument('--holt', action='store_true',
+        help='Follow the trend in observed throughput (Holt smoothing).'
+    )
+
+    parser.add_argument('--horizon', type=int, default=HORIZON,
+        help='Hours ahead to simulate (default a year).'
+    )
+
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+        help='Don\'t read or update the decoded key cache in {}.'.format(
+            STATE_DIR)
+    )
+
+    parser.add_argument('--full-listing', dest='incremental',
+        action='store_false',
+        help='List and size every snapshot, rather than just those new or '
+             'changed since the last run (kept in {}).'.format(STATE_DIR)
+    )
+
+    parser.add_argument('--cache-size', type=int, default=4096,
+        help='Maximum number of decoded keys to keep cached.'
+    )
+
+    parser.add_argument('--check-only', action='store_true',
+        help='Just check that the agents could be estimated (they exist, '
+             'have snapshots and keys, and aren\'t paused), printing what\'s '
+             'wrong with any and exiting 1 if so.'
+    )
+
+    parser.add_argument('--schedule-load', action='store_true',
+        help='Show how many agents back up and sync in each hour of the week '
+             'instead of estimating.'
+    )
+
+    parser.add_argument('--export', metavar='PATH',
+        help='Also write the agents, snapshots and keys estimated from to '
+             'PATH as columnar tables: Arrow files in a directory if PyArrow '
+             'is installed, or a .npz.'
+    )
+
+    parser.add_argument('--offline', metavar='PATH',
+        help='Estimate from an --export instead of ZFS and the keys.'
+    )
+
+    parser.add_argument('--processes', type=int,
+        help='Processes to decode keys across (default one per CPU).'
+    )
+
+    parser.add_argument('--fleet', nargs='+', metavar='APPLIANCE',
+        help='Estimate many appliances: directories with a datto/config and a '
+             'bin/zfs under them, tarballs of those, or --exports. Writes a '
+             'line of JSON per appliance as each finishes.'
+    )
+
+    parser.add_argument('-j', '--jobs', type=int,
+        help='Appliances to estimate at once with --fleet, or processes to '
+             'run --monte-carlo trials across (default one per CPU).'
+    )
+
+    parser.add_argument('--monte-carlo', type=int, nargs='?',
+        const=MONTE_CARLO_TRIALS, metavar='TRIALS',
+        help='Report percentiles of when agents are caught up over TRIALS '
+             '(default {}) simulations, each drawing backup sizes and '
+             'bandwidth from those observed.'.format(MONTE_CARLO_TRIALS)
+    )
+
+    parser.add_argument('--percentiles', type=float, nargs='+',
+        default=list(PERCENTILES),
+        help='Percentiles to report with --monte-carlo (default {}).'.format(
+            ' '.join(map(str, PERCENTILES)))
+    )
+
+    parser.add_argument('--seed', type=int,
+        help='Seed --monte-carlo, to repeat a run.'
+    )
+
+    parser.add_argument('--async', dest='asynchronous', action='store_true',
+        help='Gather snapshots and keys concurrently with asyncio.'
+    )
+
+    parser.add_argument('--concurrency', type=int, default=16,
+        help='Most subprocesses and key reads in flight at once with --async.'
+    )
+
+    parser.add_argument('--zfs-timeout', type=float, default=ZFS_TIMEOUT,
+        metavar='SECONDS',
+        help='Give up on any one `zfs` command after this long (default '
+             '%(default)s), rather than hang on it.'
+    )
+
+    parser.add_argument('--profile', metavar='FILE',
+        help='Profile the run, writing the result to FILE.'
+    )
+
+    parser.add_argument('--profile-format', choices=('pstats', 'collapsed'),
+        default='pstats',
+        help='cProfile stats for pstats/snakeviz, or collapsed stacks for '
+             'flamegraph.pl/speedscope (default pstats).'
+    )
+
+    parser.add_argument('--stats-json', metavar='FILE',
+        help='Write per-phase timings and per-agent counters to FILE as JSON '
+             '(- for stderr).'
+    )
+
+    parser.add_argument('--daemon', action='store_true',
+        help='Stay resident, following changes to keys and sync options, '
+             'and serve estimates on --socket.'
+    )
+
+    parser.add_argument('--refresh', type=float, default=300,
+        help='Seconds between relisting snapshots in --daemon mode.'
+    )
+
+    parser.add_argument('--query', nargs='?', const='', metavar='AGENT',
+        help='Ask a running --daemon for its estimate (of just AGENT).'
+    )
+
+    parser.add_argument('--socket',
+        help='Unix socket --daemon serves on (default {}).'.format(
+            DAEMON_SOCKET)
+    )
+
+    parser.add_argument('--root', default='/',
+        help='Read /datto/config, and keep state in {}, under this directory '
+             'instead.'.format(STATE_DIR)
+    )
+
+    return parser
+
+
+if __name__ == '__main__':
+    parser = argumentParser()
     args = parser.parse_args()
+    if args.offline and (args.asynchronous or args.daemon):
+        parser.error('--offline can\'t be used with --async or --daemon')
     main(args)
\ No newline at end of file
@@ -0,0 +1,177 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Print the volumes included in each of agents' snapshots, from the voltab in
+/home/agents/<uuid>/.zfs/snapshot/<epoch>/, like getVol.sh, but for any
+number of agents at once. Each voltab is memory-mapped and its mountpoints
+pulled out with one regex, and snapshots are scanned across a thread pool
+with results printed per snapshot, in order, as they come in.
+
+    ./voltab.py                      # every agent
+    ./voltab.py <uuid> --changes     # just when the volumes included changed
+"""
+
+from typing import List, Tuple, Iterator, Pattern, Optional
+from concurrent.futures import ThreadPoolExecutor
+from time import localtime, strftime
+
+import argparse
+import mmap
+import json
+import sys
+import os
+import re
+
+AGENTS = '/home/agents/'
+SNAPSHOTS = '.zfs/snapshot/'
+VOLTAB = 'voltab'
+KEYS = '/datto/config/keys/'
+AGENT_INFO = '.agentInfo'
+
+# Regexes
+mountpoint = re.compile(rb'"mountpoint":\s*"([A-Z])')
+hostName = re.compile(rb'"hostName";s:[0-9]+:"([^"]+)')
+
+# (agent, epoch, volumes, or None without a voltab)
+Snapshot = Tuple[str, int, Optional[List[str]]]
+
+
+def searchFile(path: str, pattern: Pattern) -> Optional[List[bytes]]:
+    """
+    Every match of `pattern`'s group in the file at `path`, searched in place
+    through a read-only memory map, or None if there's no such file.
+    """
+    try:
+        with open(path, 'rb') as searched:
+            if not os.fstat(searched.fileno()).st_size:
+                return []
+            with mmap.mmap(searched.fileno(), 0,
+                           access=mmap.ACCESS_READ) as buffer:
+                return pattern.findall(buffer)
+    except FileNotFoundError:
+        return None
+
+
+def scanVoltab(path: str) -> Optional[List[str]]:
+    """
+    Volumes (e.g. 'C:\\') included according to the voltab at `path`, or None
+    if there isn't one.
+    """
+    letters = searchFile(path, mountpoint)
+    if letters is None:
+        return None
+    return [letter.decode() + ':\\' for letter in letters]
+
+
+def getHostName(agent: str) -> Optional[str]:
+    """
+    The host name in `agent`'s `.agentInfo`, if it has one.
+    """
+    names = searchFile(KEYS + agent + AGENT_INFO, hostName)
+    return names[0].decode(errors='replace') if names else None
+
+
+def listSnapshots(agent: str) -> List[int]:
+    """
+    Epochs of `agent`'s snapshots, oldest first.
+    """
+    # Read to the end, so scandir closes its directory without `with`,
+    # which needs Python 3.6.
+    try:
+        return sorted(int(entry.name) for entry in os.scandir(
+            AGENTS + agent + '/' + SNAPSHOTS) if entry.name.isdigit())
+    except FileNotFoundError:
+        return []
+
+
+def scanAgents(agents: List[str], threads: Optional[int] = None) \
+        -> Iterator[Snapshot]:
+    """
+    Scan every snapshot of every one of `agents` across `threads` threads,
+    yielding them in order (by agent, then epoch) as soon as each one and
+    all those before it are done.
+    """
+    snapshots = [(agent, epoch) for agent in agents
+                 for epoch in listSnapshots(agent)]
+
+    def scan(snapshot: Tuple[str, int]) -> Snapshot:
+        agent, epoch = snapshot
+        return agent, epoch, scanVoltab('{}{}/{}{}/{}'.format(
+            AGENTS, agent, SNAPSHOTS, epoch, VOLTAB))
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        yield from pool.map(scan, snapshots)
+
+
+def formatSnapshot(epoch: int, volumes: Optional[List[str]]) -> str:
+    """
+    A line about a snapshot, like getVol.sh prints.
+    """
+    if volumes is None:
+        included = 'voltab doesn\'t exist'
+    elif not volumes:
+        included = '* No volumes included in voltab'
+    else:
+        included = ' '.join(volumes)
+    return '{} - {}'.format(strftime('%a %b %d %H:%M:%S %Z %Y',
+                                     localtime(epoch)), included)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Print the volumes included in agents\' snapshots.'
+    )
+
+    parser.add_argument('agents', nargs='*', metavar='UUID',
+        help='Agents to scan (default all of them).'
+    )
+
+    parser.add_argument('--changes', action='store_true',
+        help='Only print snapshots whose volumes differ from the one before.'
+    )
+
+    parser.add_argument('--json', action='store_true',
+        help='Print a line of JSON per snapshot.'
+    )
+
+    parser.add_argument('-t', '--threads', type=int, default=32,
+        help='Snapshots to scan at once.'
+    )
+
+    parser.add_argument('--root', default='/',
+        help='Look for /home/agents and /datto/config under this directory '
+             'instead.'
+    )
+
+    args = parser.parse_args()
+
+    AGENTS = os.path.join(args.root, AGENTS.lstrip('/'))
+    KEYS = os.path.join(args.root, KEYS.lstrip('/'))
+
+    agents = args.agents
+    if not agents:
+        agents = sorted(entry.name for entry in os.scandir(AGENTS)
+                        if entry.is_dir())
+    for agent in agents:
+        if not os.path.isdir(AGENTS + agent):
+            sys.stderr.write('ERROR: "{}" doesn\'t exist\n'.format(agent))
+    agents = [agent for agent in agents if os.path.isdir(AGENTS + agent)]
+
+    last = None
+    previous = None  # type: Optional[List[str]]
+    for agent, epoch, volumes in scanAgents(agents, args.threads):
+        if agent != last:
+            host = getHostName(agent)
+            if not args.json:
+                print('{} {}'.format(agent, host or ''))
+            last, previous = agent, None
+        elif args.changes and volumes == previous:
+            continue
+        previous = volumes
+
+        if args.json:
+            print(json.dumps({'agent': agent, 'hostName': host,
+                              'epoch': epoch, 'volumes': volumes}))
+        else:
+            print('  ' + formatSnapshot(epoch, volumes))